@@ -0,0 +1,73 @@
+"""Microbenchmark for the date handling done while serving a comic page.
+
+This compares the per-request date overhead of the old string-based approach
+(where dates were parsed with `datetime.strptime` at every step) with the
+current one (where `datetime.date` objects are passed around).
+
+Run it from the repo's root as:
+
+    python benchmarks/bench_dates.py
+"""
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from timeit import repeat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import ALT_DATE_FMT, DATE_FMT, FIRST_COMIC  # noqa: E402
+from utils import date_to_str, str_to_date  # noqa: E402
+
+_FIRST_COMIC_STR = FIRST_COMIC.strftime(DATE_FMT)
+_LATEST_COMIC_STR = "2022-03-12"
+
+
+def _old_request(year: int, month: int, day: int) -> None:
+    """Do the date conversions done by a request before the date objects."""
+    # comic_page
+    date = f"{year:04d}-{month:02d}-{day:02d}"
+    datetime.strptime(date, DATE_FMT)
+    # ComicScraper._get_cached_data (DB lookup, `dateStr`, `last_used`)
+    datetime.strptime(date, DATE_FMT)
+    datetime.strptime(date, DATE_FMT).strftime(ALT_DATE_FMT)
+    datetime.strptime(date, DATE_FMT)
+    # LatestDateScraper._get_cached_data
+    datetime.strptime(_LATEST_COMIC_STR, DATE_FMT).strftime(DATE_FMT)
+    # serve_comic
+    latest = datetime.strptime(_LATEST_COMIC_STR, DATE_FMT)
+    _ = latest < datetime.strptime(date, DATE_FMT)
+    # _serve_template
+    date_obj = datetime.strptime(date, DATE_FMT)
+    first = datetime.strptime(_FIRST_COMIC_STR, DATE_FMT)
+    max(first, date_obj - timedelta(days=1)).strftime(DATE_FMT)
+    latest = datetime.strptime(_LATEST_COMIC_STR, DATE_FMT)
+    min(latest, date_obj + timedelta(days=1)).strftime(DATE_FMT)
+
+
+def _new_request(year: int, month: int, day: int) -> None:
+    """Do the date conversions done by a request with the date objects."""
+    # comic_page
+    comic_date = date(year, month, day)
+    # ComicScraper._get_cached_data (only `dateStr` needs conversion)
+    date_to_str(comic_date, fmt=ALT_DATE_FMT)
+    # LatestDateScraper._get_cached_data returns a date object directly
+    latest = str_to_date(_LATEST_COMIC_STR)
+    # serve_comic
+    _ = latest < comic_date
+    # _serve_template
+    date_to_str(comic_date)
+    date_to_str(max(FIRST_COMIC, comic_date - timedelta(days=1)))
+    date_to_str(min(latest, comic_date + timedelta(days=1)))
+    date_to_str(FIRST_COMIC)
+
+
+def main() -> None:
+    """Time both approaches and print the per-request overhead."""
+    number = 20_000
+    for name, func in [("before", _old_request), ("after", _new_request)]:
+        best = min(repeat(lambda: func(2021, 6, 15), number=number, repeat=5))
+        print(f"{name:>6}: {best / number * 1e6:.2f} µs per request")
+
+
+if __name__ == "__main__":
+    main()
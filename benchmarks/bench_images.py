@@ -0,0 +1,310 @@
+"""Benchmark for the on-disk cache of proxied comic images.
+
+This runs `ImageCache` against a local stand-in for the image CDN, which serves
+a fixed-size GIF for every image. It checks and times:
+    * misses, which download the image into the cache
+    * hits, which are served from disk without contacting the stand-in
+    * concurrent misses for the same image, which share one download
+    * eviction of the least recently used images, once the cache is full
+    * "304 Not Modified" for clients that already have the image
+    * failing fast, once the circuit for a stalled CDN is open
+
+It then checks the same behaviour through the app's "/img/<date>" route, with
+the app's memory backend and stand-ins for both "dilbert.com" and the CDN.
+Images that can't be proxied must redirect to the CDN.
+
+The caches are in temporary directories, which are deleted at the end. Run it
+from the repo's root as:
+
+    python benchmarks/bench_images.py
+"""
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import aiohttp
+from aiohttp import web
+from quart import Quart
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from loadtest import FakeUpstream  # noqa: E402
+
+import comics  # noqa: E402
+import latest  # noqa: E402
+import main as viewer  # noqa: E402
+from breaker import UpstreamUnavailableError  # noqa: E402
+from constants import BREAKER_THRESHOLD  # noqa: E402
+from images import ImageCache, image_response  # noqa: E402
+from utils import curr_date  # noqa: E402
+
+_IMAGE_SIZE = 100 * 1024
+# The cache fits this many images
+_CACHE_IMAGES = 3
+_NUM_HITS = 200
+_NUM_CONCURRENT = 20
+# The stand-in stalls for longer than this for the "slow" images
+_TIMEOUT = 0.2
+
+
+class FakeCDN:
+    """Local stand-in for the image CDN.
+
+    Attributes:
+        calls: The no. of requests received, by kind of image
+    """
+
+    def __init__(self) -> None:
+        """Create the image that is served for every request."""
+        self.calls: Counter[str] = Counter()
+        self._image = b"GIF89a" + bytes(_IMAGE_SIZE - 6)
+        self._runner: web.AppRunner
+
+    async def _image_handler(self, request: web.Request) -> web.Response:
+        """Serve the image, after a short delay like a real network."""
+        self.calls["image"] += 1
+        await asyncio.sleep(0.005)
+        return web.Response(body=self._image, content_type="image/gif")
+
+    async def _slow_handler(self, _: web.Request) -> web.Response:
+        """Stall for longer than the timeout for downloads."""
+        self.calls["slow"] += 1
+        await asyncio.sleep(_TIMEOUT * 10)
+        return web.Response(body=self._image, content_type="image/gif")
+
+    async def start(self) -> str:
+        """Start serving, and get the base URL."""
+        app = web.Application()
+        app.router.add_get("/img/{name}", self._image_handler)
+        app.router.add_get("/slow/{name}", self._slow_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        """Stop serving."""
+        await self._runner.cleanup()
+
+
+def _disk_usage(directory: str) -> tuple[set[str], int]:
+    """Get the names and the total size of the cached images."""
+    names = {name for name in os.listdir(directory) if name.endswith(".gif")}
+    size = sum(os.path.getsize(os.path.join(directory, n)) for n in names)
+    return names, size
+
+
+async def _check_cache(cdn: FakeCDN, base_url: str, directory: str) -> None:
+    """Check and time misses, hits and eviction."""
+    logger = logging.getLogger("bench_images")
+    dates = [date(2020, 1, 1) + timedelta(days=i) for i in range(4)]
+
+    async with aiohttp.ClientSession() as sess:
+        cache = ImageCache(
+            directory, _CACHE_IMAGES * _IMAGE_SIZE, sess, logger
+        )
+        cache.start()
+
+        try:
+            # Misses
+            start = perf_counter()
+            for day in dates[:_CACHE_IMAGES]:
+                image = await cache.get_image(day, f"{base_url}/img/{day}")
+                assert image.size == _IMAGE_SIZE
+            miss_time = (perf_counter() - start) / _CACHE_IMAGES
+            assert cdn.calls["image"] == _CACHE_IMAGES
+
+            # Hits
+            hits = [dates[i % _CACHE_IMAGES] for i in range(_NUM_HITS)]
+            start = perf_counter()
+            for day in hits:
+                await cache.get_image(day, f"{base_url}/img/{day}")
+            hit_time = (perf_counter() - start) / _NUM_HITS
+            assert cdn.calls["image"] == _CACHE_IMAGES
+
+            # Concurrent misses for one more image, which evict the least
+            # recently used one
+            new = dates[_CACHE_IMAGES]
+            images = await asyncio.gather(
+                *(
+                    cache.get_image(new, f"{base_url}/img/{new}")
+                    for _ in range(_NUM_CONCURRENT)
+                )
+            )
+            assert len({image.path for image in images}) == 1
+            assert cdn.calls["image"] == _CACHE_IMAGES + 1
+
+            names, size = _disk_usage(directory)
+            last_used = {day: i for i, day in enumerate(hits)}
+            lru = min(last_used, key=last_used.__getitem__)
+            assert size <= _CACHE_IMAGES * _IMAGE_SIZE, size
+            assert f"{lru}.gif" not in names, names
+            assert f"{new}.gif" in names, names
+
+            # Conditional requests
+            app = Quart(__name__)
+            headers = {"If-None-Match": f'"{images[0].etag}"'}
+            async with app.test_request_context("/", headers=headers):
+                response = await image_response(images[0])
+                assert response.status_code == 304
+            async with app.test_request_context("/"):
+                response = await image_response(images[0])
+                assert response.status_code == 200
+                assert len(await response.get_data()) == _IMAGE_SIZE
+        finally:
+            await cache.close()
+
+    print(f"  miss: {miss_time * 1e3:8.2f} ms per image")
+    print(f"   hit: {hit_time * 1e6:8.1f} µs per image")
+    print(
+        f"        {_NUM_CONCURRENT} concurrent misses -> 1 download, "
+        f"{len(names)} images ({size} bytes) left on disk"
+    )
+
+
+async def _check_breaker(cdn: FakeCDN, base_url: str, directory: str) -> None:
+    """Check that downloads from a stalled CDN fail fast."""
+    logger = logging.getLogger("bench_images")
+    async with aiohttp.ClientSession() as sess:
+        cache = ImageCache(
+            directory,
+            _CACHE_IMAGES * _IMAGE_SIZE,
+            sess,
+            logger,
+            timeout=_TIMEOUT,
+        )
+        cache.start()
+
+        try:
+            timings = []
+            for i in range(BREAKER_THRESHOLD + 1):
+                day = date(2021, 1, 1) + timedelta(days=i)
+                start = perf_counter()
+                try:
+                    await cache.get_image(day, f"{base_url}/slow/{day}")
+                except UpstreamUnavailableError:
+                    pass
+                else:
+                    raise AssertionError("Download from stalled CDN worked")
+                timings.append(perf_counter() - start)
+        finally:
+            await cache.close()
+
+    # The last one fails without contacting the CDN, as the circuit is open
+    assert cdn.calls["slow"] == BREAKER_THRESHOLD, cdn.calls
+    assert all(timing < _TIMEOUT * 2 for timing in timings), timings
+    print(
+        f"stalled CDN: {timings[0] * 1e3:.0f} ms per timed out download, "
+        f"{timings[-1] * 1e3:.2f} ms once the circuit is open"
+    )
+
+
+async def _check_route(cdn: FakeCDN, base_url: str, directory: str) -> None:
+    """Check the app's route for proxied images."""
+    cdn.calls.clear()
+    dates = [date(2020, 2, 1) + timedelta(days=i) for i in range(4)]
+
+    upstream = FakeUpstream(curr_date(), 0, img_prefix=f"{base_url}/img/")
+    src_prefix = await upstream.start()
+
+    # Point the app to the stand-ins, and to a small image cache
+    comics.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    latest.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    viewer.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    viewer.IMG_CACHE_DIR = directory  # type: ignore[misc]
+    viewer.IMG_CACHE_SIZE = _CACHE_IMAGES * _IMAGE_SIZE  # type: ignore[misc]
+    os.environ["DILBERT_CACHE_BACKEND"] = "memory"
+    os.environ["DILBERT_IMG_PROXY"] = "true"
+    os.environ["DILBERT_STARTUP_PREFETCH_DAYS"] = "0"
+    os.environ["DILBERT_NEIGHBOUR_PREFETCH_WINDOW"] = "0"
+
+    app = viewer.app
+    try:
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+
+            # The page links to the image through the app
+            response = await client.get(f"/{dates[0]}")
+            assert f"/img/{dates[0]}" in await response.get_data(as_text=True)
+
+            # Misses
+            etags = []
+            for day in dates[:_CACHE_IMAGES]:
+                response = await client.get(f"/img/{day}")
+                assert response.status_code == 200, response.status_code
+                assert len(await response.get_data()) == _IMAGE_SIZE
+                assert "immutable" in response.headers["Cache-Control"]
+                etags.append(response.headers["ETag"])
+            assert cdn.calls["image"] == _CACHE_IMAGES, cdn.calls
+
+            # Hits, with and without the client's copy. These also make the
+            # second image the least recently used one.
+            for day, etag in zip(dates[:_CACHE_IMAGES], etags):
+                if day == dates[1]:
+                    continue
+                response = await client.get(f"/img/{day}")
+                assert response.status_code == 200, response.status_code
+                assert response.headers["ETag"] == etag
+                response = await client.get(
+                    f"/img/{day}", headers={"If-None-Match": etag}
+                )
+                assert response.status_code == 304, response.status_code
+            assert cdn.calls["image"] == _CACHE_IMAGES, cdn.calls
+
+            # A miss for one more image, which evicts the least recently used
+            # one. That one is then downloaded again.
+            response = await client.get(f"/img/{dates[_CACHE_IMAGES]}")
+            assert response.status_code == 200, response.status_code
+            names, size = _disk_usage(directory)
+            assert size <= _CACHE_IMAGES * _IMAGE_SIZE, size
+            assert f"{dates[1]}.gif" not in names, names
+            response = await client.get(f"/img/{dates[1]}")
+            assert response.status_code == 200, response.status_code
+            assert cdn.calls["image"] == _CACHE_IMAGES + 2, cdn.calls
+
+            # Images from a stalled CDN redirect to the CDN, and once the
+            # circuit is open, without contacting it
+            upstream.img_prefix = f"{base_url}/slow/"
+            app.image_cache.breaker.budget = _TIMEOUT
+            for i in range(BREAKER_THRESHOLD + 1):
+                day = date(2021, 2, 1) + timedelta(days=i)
+                response = await client.get(f"/img/{day}")
+                assert response.status_code == 302, response.status_code
+                location = response.headers["Location"]
+                assert location == f"{base_url}/slow/{day}.gif", location
+            assert cdn.calls["slow"] == BREAKER_THRESHOLD, cdn.calls
+    finally:
+        await upstream.close()
+
+    print(
+        '"/img/<date>": hits, misses, eviction, 304s and redirects for a '
+        "stalled CDN are as expected"
+    )
+
+
+async def main() -> None:
+    """Run all checks against the stand-in CDN."""
+    cdn = FakeCDN()
+    base_url = await cdn.start()
+    try:
+        with TemporaryDirectory() as directory:
+            print(f"{_IMAGE_SIZE} byte images, cache of {_CACHE_IMAGES}:")
+            await _check_cache(cdn, base_url, directory)
+        with TemporaryDirectory() as directory:
+            await _check_breaker(cdn, base_url, directory)
+        with TemporaryDirectory() as directory:
+            await _check_route(cdn, base_url, directory)
+    finally:
+        await cdn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Benchmark for extracting the comic data from saved comic pages.
+
+This compares the old approach (decoding the whole page, and then running
+three separate regex searches over it) with the incremental parser used by
+`ComicScraper`, which is fed the page in chunks and stops once it has found
+all the data.
+
+The pages in "benchmarks/pages" mimic the layout of a comic's page on
+"dilbert.com", one with a title and one without (like older comics).
+
+Run it from the repo's root as:
+
+    python benchmarks/bench_scrape.py
+"""
+import re
+import sys
+from html import unescape
+from pathlib import Path
+from timeit import repeat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import SCRAPE_CHUNK_SIZE  # noqa: E402
+from extract import ComicPageParser  # noqa: E402
+
+_PAGES_DIR = Path(__file__).resolve().parent / "pages"
+
+
+def _old_extract(page: bytes) -> tuple[dict[str, str], int]:
+    """Extract the comic data as `ComicScraper` used to."""
+    content = page.decode("utf-8")
+    data = {}
+
+    match = re.search(
+        r'<span class="comic-title-name">([^<]+)</span>', content
+    )
+    data["title"] = "" if match is None else unescape(match.groups()[0])
+
+    match = re.search(
+        r'<date class="comic-title-date" item[pP]rop="datePublished">[^<]*'
+        r'<span>([^<]*)</span>[^<]*<span item[pP]rop="copyrightYear">'
+        r"([^<]+)</span>",
+        content,
+    )
+    assert match is not None
+    data["dateStr"] = " ".join(match.groups())
+
+    match = re.search(r'<img[^>]*class="img-[^>]*src="([^"]+)"[^>]*>', content)
+    assert match is not None
+    data["imgURL"] = match.groups()[0]
+
+    return data, len(page)
+
+
+def _new_extract(page: bytes) -> tuple[dict[str, str], int]:
+    """Extract the comic data with the incremental parser."""
+    parser = ComicPageParser()
+    num_read = 0
+
+    for start in range(0, len(page), SCRAPE_CHUNK_SIZE):
+        chunk = page[start : start + SCRAPE_CHUNK_SIZE]
+        num_read += len(chunk)
+        parser.feed(chunk)
+        if parser.done:
+            break
+
+    return parser.result(), num_read
+
+
+def main() -> None:
+    """Time both approaches on every saved page."""
+    number = 200
+    for path in sorted(_PAGES_DIR.glob("*.html")):
+        page = path.read_bytes()
+        old_data, _ = _old_extract(page)
+        new_data, num_read = _new_extract(page)
+        assert old_data == new_data, f"Mismatch for {path.name}"
+        # The parser stops early on every page, including untitled ones
+        assert num_read < len(page), f"{path.name} was read to the end"
+
+        print(f"{path.name} ({len(page)} bytes):")
+        for name, func in [("before", _old_extract), ("after", _new_extract)]:
+            best = min(repeat(lambda: func(page), number=number, repeat=5))
+            _, num_read = func(page)
+            print(
+                f"  {name:>6}: {best / number * 1e6:8.1f} µs per page, "
+                f"{num_read} bytes read"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+r"""Concurrency benchmark for the writes to the cache database.
+
+This runs many concurrent writers against a local PostgreSQL database, all of
+them caching the same comics and latest dates (i.e. the worst case for
+contention). It compares the old write paths (INSERT and then UPDATE on a
+unique violation for comics; UPDATE and then INSERT if no rows were updated for
+the latest date) with the current upserts. It reports the no. of round trips
+per write, as counted on the connections, along with the unique violations
+and the no. of latest date rows left behind. It fails if the upserts raise
+any error, or leave more than one latest date row.
+
+Everything is done in a temporary schema, which is dropped at the end, so this
+doesn't touch any existing cache. Run it from the repo's root as:
+
+    DATABASE_URL=postgresql://localhost/postgres \
+        python benchmarks/bench_upsert.py --writers 50 --comics 100
+"""
+import asyncio
+import os
+import sys
+from argparse import ArgumentParser
+from collections.abc import Awaitable, Callable
+from datetime import date, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import LATEST_DATE_CHANNEL  # noqa: E402
+from db import CacheConnection, Statement, init_connection  # noqa: E402
+
+_ROOT = Path(__file__).resolve().parent.parent
+_SCHEMA = "bench_upsert"
+
+# The methods of connections and statements that send a query to the
+# server, i.e. those that each take one round trip
+_QUERY_METHODS = {"execute", "executemany", "fetch", "fetchrow", "fetchval"}
+
+
+class _Counter:
+    """Counts of the round trips and unique violations of a writer."""
+
+    def __init__(self) -> None:
+        """Start with zero counts."""
+        self.round_trips = 0
+        self.unique_violations = 0
+
+
+class _Counted:
+    """Proxy for a connection or a statement, which counts its queries.
+
+    Attributes of connections (e.g. `stmts`) are wrapped too, so that queries
+    on the bound statements are counted as well.
+    """
+
+    def __init__(self, target: Any, counter: _Counter):
+        """Wrap the target."""
+        self._target = target
+        self._counter = counter
+
+    def __getattr__(self, name: str) -> Any:
+        """Get the attribute, counting it as a round trip if it's a query."""
+        attr = getattr(self._target, name)
+        if name == "stmts" or isinstance(attr, Statement):
+            return _Counted(attr, self._counter)
+        if name not in _QUERY_METHODS:
+            return attr
+
+        async def query(*args: Any, **kwargs: Any) -> Any:
+            self._counter.round_trips += 1
+            try:
+                return await attr(*args, **kwargs)
+            except asyncpg.UniqueViolationError:
+                self._counter.unique_violations += 1
+                raise
+
+        return query
+
+
+Writer = Callable[[Any, date], Awaitable[None]]
+
+
+async def _old_comic_write(conn: Any, comic: date) -> None:
+    """Cache a comic as before."""
+    try:
+        await conn.execute(
+            """INSERT INTO comic_cache (comic, img_url, title)
+            VALUES ($1, $2, $3);""",
+            comic,
+            "https://example.com/comic.gif",
+            "Title",
+        )
+    except asyncpg.UniqueViolationError:
+        await conn.execute(
+            "UPDATE comic_cache SET last_used = DEFAULT WHERE comic = $1;",
+            comic,
+        )
+
+
+async def _new_comic_write(conn: Any, comic: date) -> None:
+    """Cache a comic with the upsert."""
+    await conn.stmts.upsert_comic.fetch(
+        comic, "https://example.com/comic.gif", "Title"
+    )
+
+
+async def _old_latest_write(conn: Any, latest: date) -> None:
+    """Cache the latest date as before."""
+    result = await conn.execute(
+        "UPDATE latest_date SET latest = $1, last_check = DEFAULT;", latest
+    )
+    if int(result.split()[1]) == 0:
+        try:
+            await conn.execute(
+                "INSERT INTO latest_date (latest) VALUES ($1);", latest
+            )
+        except asyncpg.UniqueViolationError:
+            pass
+    await conn.execute(
+        "SELECT pg_notify($1, $2);", LATEST_DATE_CHANNEL, latest.isoformat()
+    )
+
+
+async def _new_latest_write(conn: Any, latest: date) -> None:
+    """Cache the latest date with the upsert."""
+    await conn.stmts.upsert_latest.fetchval(
+        latest, LATEST_DATE_CHANNEL, latest.isoformat()
+    )
+
+
+class _Result:
+    """The measurements of a run of concurrent writers."""
+
+    def __init__(self) -> None:
+        """Start with no measurements."""
+        self.writes = 0
+        self.counter = _Counter()
+        self.errors: list[BaseException] = []
+        self.elapsed = 0.0
+        self.latest_rows = 0
+
+
+async def _run(
+    pool: asyncpg.Pool, writer: Writer, dates: list[date], num_writers: int
+) -> _Result:
+    """Run concurrent writers that all write the given dates."""
+    async with pool.acquire() as conn:
+        await conn.execute("TRUNCATE comic_cache, latest_date;")
+
+    result = _Result()
+
+    async def write_all() -> None:
+        for day in dates:
+            async with pool.acquire() as conn:
+                await writer(_Counted(conn, result.counter), day)
+
+    start = perf_counter()
+    outcomes = await asyncio.gather(
+        *(write_all() for _ in range(num_writers)), return_exceptions=True
+    )
+    result.elapsed = perf_counter() - start
+    result.writes = num_writers * len(dates)
+    result.errors = [ex for ex in outcomes if isinstance(ex, BaseException)]
+
+    async with pool.acquire() as conn:
+        result.latest_rows = await conn.fetchval(
+            "SELECT count(*) FROM latest_date;"
+        )
+    return result
+
+
+async def main(num_writers: int, num_comics: int) -> None:
+    """Compare the old and new write paths.
+
+    Raises:
+        AssertionError: If the new write paths fail, or leave more than one
+            latest date
+    """
+    dsn = os.environ["DATABASE_URL"]
+    setup_conn = await asyncpg.connect(dsn)
+    await setup_conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE;")
+    await setup_conn.execute(f"CREATE SCHEMA {_SCHEMA};")
+    await setup_conn.execute(f"SET search_path TO {_SCHEMA};")
+    await setup_conn.execute((_ROOT / "cache_init.sql").read_text())
+
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=num_writers,
+        max_size=num_writers,
+        server_settings={"search_path": _SCHEMA},
+        connection_class=CacheConnection,
+        init=init_connection,
+    )
+
+    first = date(2020, 1, 1)
+    comics = [first + timedelta(days=i) for i in range(num_comics)]
+    scenarios = [
+        ("comic (before)", _old_comic_write, False),
+        ("comic (after)", _new_comic_write, True),
+        ("latest (before)", _old_latest_write, False),
+        ("latest (after)", _new_latest_write, True),
+    ]
+
+    try:
+        for name, writer, is_new in scenarios:
+            result = await _run(pool, writer, comics, num_writers)
+            print(
+                f"{name:>16}: "
+                f"{result.counter.round_trips / result.writes:.2f} round "
+                f"trips/write, {result.writes / result.elapsed:8.0f} "
+                f"writes/s, {result.counter.unique_violations} unique "
+                f"violations, {len(result.errors)} failed writers, "
+                f"{result.latest_rows} latest date rows"
+            )
+
+            if is_new:
+                # The upserts must never fail, and must never leave more than
+                # one latest date
+                assert not result.errors, result.errors
+                assert result.counter.unique_violations == 0
+                if writer is _new_latest_write:
+                    assert result.latest_rows == 1, result.latest_rows
+    finally:
+        await pool.close()
+        await setup_conn.execute(f"DROP SCHEMA {_SCHEMA} CASCADE;")
+        await setup_conn.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Benchmark concurrent writes to the cache database"
+    )
+    parser.add_argument(
+        "-w", "--writers", type=int, default=50, help="no. of writers"
+    )
+    parser.add_argument(
+        "-c",
+        "--comics",
+        type=int,
+        default=100,
+        help="no. of comics written by each writer",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.writers, args.comics))
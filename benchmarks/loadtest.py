@@ -0,0 +1,446 @@
+r"""Load test for the whole app, against a fake "dilbert.com".
+
+This starts the app in-process with hypercorn, along with a local stand-in for
+"dilbert.com". The stand-in serves the sample page in "benchmarks/pages" for
+every comic (with that comic's date and image), and redirects to its homepage
+for dates without a comic, like the real site. The cache database is a
+temporary schema in a local PostgreSQL database, which the app initializes
+from cache_init.sql, and which is dropped at the end.
+
+The same requests to "/", "/<date>" and "/random" are then sent twice at the
+given concurrency: first with empty caches ("cold"), and then again with the
+caches filled by the first run ("warm"). For each run, this reports the
+latency percentiles and throughput, along with the no. of requests to the
+stand-in. For the app's database pool, it reports the no. of connections
+acquired from it, its size, and the max. no. of its connections that were in
+use at a time.
+
+It also fails if concurrent requests aren't coalesced, i.e. if concurrent
+requests for an uncached comic scrape it more than once, or if any comic is
+scraped more than once across both runs. Likewise, it fails if the pool grows
+beyond the connections that each worker has for it.
+
+Run it from the repo's root as:
+
+    DATABASE_URL=postgresql://localhost/postgres \
+        python benchmarks/loadtest.py --requests 2000 --concurrency 50
+"""
+import asyncio
+import os
+import random
+import socket
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+
+import aiohttp
+import asyncpg
+from aiohttp import web
+from asyncpg.pool import Pool
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import comics  # noqa: E402
+import latest  # noqa: E402
+import main as viewer  # noqa: E402
+from constants import ALT_DATE_FMT, FIRST_COMIC  # noqa: E402
+from metrics import DB_POOL_WAIT_SECONDS  # noqa: E402
+from utils import curr_date, date_to_str, str_to_date  # noqa: E402
+
+_PAGE = Path(__file__).resolve().parent / "pages" / "comic.html"
+_SCHEMA = "bench_load"
+
+# Parts of the sample page that are specific to its comic
+_PAGE_DATE = b"<span>Tuesday March 08,</span>"
+_PAGE_YEAR = b'<span itemprop="copyrightYear">2022</span>'
+_PAGE_IMG = b"https://assets.amuniversal.com/3d7c1f00a1b2013a8bff005056a9545d"
+
+
+class FakeUpstream:
+    """Local stand-in for "dilbert.com".
+
+    Attributes:
+        latest: The date of the latest comic
+        delay: The time (in seconds) taken to respond to each request
+        img_prefix: The URL prefix for each comic's image
+        calls: The no. of requests received, by kind of response
+        comic_calls: The no. of requests received for each comic
+    """
+
+    def __init__(
+        self,
+        latest: date,
+        delay: float,
+        img_prefix: str = "https://example.com/",
+    ):
+        """Load the sample page.
+
+        Args:
+            latest: The date of the latest comic
+            delay: The time (in seconds) taken to respond to each request
+            img_prefix: The URL prefix for each comic's image, which is
+                followed by "<date>.gif"
+        """
+        self.latest = latest
+        self.delay = delay
+        self.img_prefix = img_prefix
+        self.calls: Counter[str] = Counter()
+        self.comic_calls: Counter[date] = Counter()
+        self._page = _PAGE.read_bytes()
+        self._runner: web.AppRunner
+
+    def _comic_page(self, comic: date) -> bytes:
+        """Get the sample page, changed to be for the given comic."""
+        # E.g. "Tuesday March 08, 2022" is split into the day and the year
+        day, year = date_to_str(comic, fmt=ALT_DATE_FMT).rsplit(" ", 1)
+        return (
+            self._page.replace(_PAGE_DATE, f"<span>{day}</span>".encode())
+            .replace(_PAGE_YEAR, _PAGE_YEAR.replace(b"2022", year.encode()))
+            .replace(_PAGE_IMG, f"{self.img_prefix}{comic}.gif".encode())
+        )
+
+    async def _strip(self, request: web.Request) -> web.Response:
+        """Serve the page for a comic, or redirect if there's no comic."""
+        await asyncio.sleep(self.delay)
+        try:
+            comic = str_to_date(request.match_info["date"])
+        except ValueError:
+            comic = None
+
+        if comic is None or not FIRST_COMIC <= comic <= self.latest:
+            self.calls["redirect"] += 1
+            raise web.HTTPFound("/")
+
+        self.calls["comic"] += 1
+        self.comic_calls[comic] += 1
+        return web.Response(
+            body=self._comic_page(comic), content_type="text/html"
+        )
+
+    async def _homepage(self, _: web.Request) -> web.Response:
+        """Serve a placeholder for the homepage."""
+        self.calls["homepage"] += 1
+        return web.Response(text="Dilbert", content_type="text/html")
+
+    async def start(self) -> str:
+        """Start serving, and get the URL prefix for each comic."""
+        app = web.Application()
+        app.router.add_get("/", self._homepage)
+        app.router.add_get("/strip/{date}", self._strip)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}/strip/"
+
+    async def close(self) -> None:
+        """Stop serving."""
+        await self._runner.cleanup()
+
+
+def _free_port() -> int:
+    """Find a free local port for the app."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _make_paths(
+    num_requests: int, days: int, weights: list[int], latest: date
+) -> list[str]:
+    """Choose the paths for all requests.
+
+    Args:
+        num_requests: The total no. of requests
+        days: The no. of most recent days from which comics are requested
+        weights: The relative frequencies of "/", "/<date>" and "/random"
+        latest: The date of the latest comic
+
+    Returns:
+        The path for each request
+    """
+    kinds = random.choices(
+        ["latest", "date", "random"], weights, k=num_requests
+    )
+    paths = []
+    for kind in kinds:
+        if kind == "latest":
+            paths.append("/")
+        elif kind == "random":
+            paths.append("/random")
+        else:
+            comic = latest - timedelta(days=random.randrange(days))
+            paths.append(f"/{date_to_str(comic)}")
+    return paths
+
+
+async def _drive(
+    base_url: str, paths: list[str], concurrency: int
+) -> tuple[dict[str, list[float]], float, Counter[int]]:
+    """Send requests for all paths with the given concurrency.
+
+    Returns:
+        The latencies (in seconds) by route, the total time taken, and the
+        no. of responses by status code
+    """
+    latencies: dict[str, list[float]] = {}
+    statuses: Counter[int] = Counter()
+    pending = iter(paths)
+
+    async def worker(sess: aiohttp.ClientSession) -> None:
+        # The workers share the same iterator, so each path is requested once
+        for path in pending:
+            route = path if path in ("/", "/random") else "/<date>"
+            start = perf_counter()
+            async with sess.get(
+                base_url + path, allow_redirects=False
+            ) as resp:
+                await resp.read()
+            latencies.setdefault(route, []).append(perf_counter() - start)
+            statuses[resp.status] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as sess:
+        start = perf_counter()
+        await asyncio.gather(*(worker(sess) for _ in range(concurrency)))
+        elapsed = perf_counter() - start
+
+    return latencies, elapsed, statuses
+
+
+class _PoolWatcher:
+    """Tracks the size and the usage of a database pool during a run.
+
+    Attributes:
+        max_size: The max. no. of connections in the pool
+        max_in_use: The max. no. of connections in use at a time
+    """
+
+    def __init__(self, pool: Pool):
+        """Start with no measurements."""
+        self.max_size = 0
+        self.max_in_use = 0
+        self._pool = pool
+        self._acquires = DB_POOL_WAIT_SECONDS.count()
+
+    @property
+    def acquires(self) -> int:
+        """Get the no. of connections acquired from the pool since start."""
+        return DB_POOL_WAIT_SECONDS.count() - self._acquires
+
+    async def watch(self, interval: float = 0.005) -> None:
+        """Sample the pool at the given interval (in seconds), till cancelled.
+
+        Connections that are used only between two samples are missed, so the
+        max. no. in use may be slightly underestimated.
+        """
+        while True:
+            size = self._pool.get_size()
+            self.max_size = max(self.max_size, size)
+            self.max_in_use = max(
+                self.max_in_use, size - self._pool.get_idle_size()
+            )
+            await asyncio.sleep(interval)
+
+
+async def _wait_until_up(base_url: str) -> None:
+    """Wait until the app accepts requests."""
+    async with aiohttp.ClientSession() as sess:
+        while True:
+            try:
+                async with sess.get(base_url + "/robots.txt") as resp:
+                    await resp.read()
+                    return
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.05)
+
+
+def _report(
+    name: str,
+    latencies: dict[str, list[float]],
+    elapsed: float,
+    statuses: Counter[int],
+    upstream_calls: Counter[str],
+    pool: _PoolWatcher,
+) -> None:
+    """Print the results of a run."""
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{name}: {total / elapsed:.0f} req/s ({total} in {elapsed:.2f}s)")
+    for route, values in sorted(latencies.items()):
+        if len(values) < 2:
+            continue
+        cuts = quantiles(values, n=100)
+        print(
+            f"  {route:>8}: p50 {cuts[49] * 1000:7.2f} ms, "
+            f"p99 {cuts[98] * 1000:7.2f} ms ({len(values)} requests)"
+        )
+    print(f"  status codes: {dict(sorted(statuses.items()))}")
+    print(f"  upstream calls: {dict(sorted(upstream_calls.items()))}")
+    print(
+        f"  DB pool: {pool.acquires} acquires, max. size {pool.max_size}, "
+        f"max. {pool.max_in_use} in use"
+    )
+
+
+async def _check_single_flight(
+    base_url: str, upstream: FakeUpstream, comic: date, concurrency: int
+) -> None:
+    """Check that concurrent requests for an uncached comic scrape it once."""
+    paths = [f"/{date_to_str(comic)}"] * concurrency
+    _, _, statuses = await _drive(base_url, paths, concurrency)
+    assert statuses == {200: concurrency}, statuses
+    calls = upstream.comic_calls[comic]
+    assert calls == 1, f"{concurrency} requests for {comic} scraped {calls}x"
+    print(f"\n{concurrency} concurrent requests for {comic}: 1 upstream call")
+
+
+def _check_pool(pool: _PoolWatcher, conn_per_worker: int) -> None:
+    """Check that the pool stayed within the worker's connections.
+
+    One of the worker's connections is kept out of the pool, for listening and
+    for advisory locks.
+    """
+    assert pool.max_size <= conn_per_worker - 1, (
+        f"DB pool grew to {pool.max_size} connections, but only "
+        f"{conn_per_worker - 1} of the worker's {conn_per_worker} are for it"
+    )
+    assert pool.max_in_use <= pool.max_size, pool.max_in_use
+
+
+def _check_scraped_once(upstream: FakeUpstream, latest: date) -> None:
+    """Check that no comic was scraped more than once in all runs.
+
+    Every scraped comic is cached, and the cache can hold all of them, so
+    scraping one again means that concurrent requests for it weren't merged.
+    The latest comic is excluded, as the latest date is checked periodically.
+    """
+    repeated = {
+        comic: calls
+        for comic, calls in upstream.comic_calls.items()
+        if calls > 1 and comic != latest
+    }
+    assert not repeated, f"Comics scraped more than once: {repeated}"
+
+
+async def main(
+    num_requests: int,
+    concurrency: int,
+    days: int,
+    weights: list[int],
+    delay: float,
+) -> None:
+    """Run the cold-cache and warm-cache scenarios."""
+    dsn = os.environ["DATABASE_URL"]
+    setup_conn = await asyncpg.connect(dsn)
+    await setup_conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE;")
+    await setup_conn.execute(f"CREATE SCHEMA {_SCHEMA};")
+
+    latest_comic = curr_date()
+    upstream = FakeUpstream(latest_comic, delay)
+    src_prefix = await upstream.start()
+
+    # Point the app to the stand-in, and to the temporary schema. asyncpg
+    # sends unknown query parameters in the URL as server settings.
+    comics.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    latest.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    viewer.SRC_PREFIX = src_prefix  # type: ignore[misc]
+    separator = "&" if "?" in dsn else "?"
+    os.environ["DATABASE_URL"] = f"{dsn}{separator}search_path={_SCHEMA}"
+    os.environ["DILBERT_CACHE_BACKEND"] = "postgres"
+    os.environ.setdefault("DILBERT_DB_SSL", "false")
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(
+        serve(viewer.app, config, shutdown_trigger=shutdown.wait)
+    )
+
+    # The same requests are sent in both runs, so that the warm run only
+    # requests comics that were cached in the cold run.
+    paths = _make_paths(num_requests, days, weights, latest_comic)
+
+    try:
+        await _wait_until_up(base_url)
+        await _check_single_flight(
+            base_url, upstream, FIRST_COMIC, concurrency
+        )
+        for name in ("Cold cache", "Warm cache"):
+            upstream.calls.clear()
+            pool = _PoolWatcher(viewer.app.cache_backend.pool)
+            watcher = asyncio.create_task(pool.watch())
+            try:
+                results = await _drive(base_url, paths, concurrency)
+            finally:
+                watcher.cancel()
+            _report(name, *results, upstream.calls, pool)
+            _check_pool(pool, viewer.app.settings.db_conn_per_worker)
+        _check_scraped_once(upstream, latest_comic)
+    finally:
+        shutdown.set()
+        await server
+        await upstream.close()
+        await setup_conn.execute(f"DROP SCHEMA {_SCHEMA} CASCADE;")
+        await setup_conn.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Load test the app against a fake dilbert.com"
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=2000, help="no. of requests"
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=50,
+        help="no. of requests in flight at a time",
+    )
+    parser.add_argument(
+        "-d",
+        "--days",
+        type=int,
+        default=365,
+        help="no. of most recent days from which comics are requested",
+    )
+    parser.add_argument(
+        "-w",
+        "--weights",
+        type=int,
+        nargs=3,
+        default=[1, 8, 1],
+        metavar=("LATEST", "DATE", "RANDOM"),
+        help='relative frequencies of "/", "/<date>" and "/random"',
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.05,
+        help="time (in seconds) taken by the fake dilbert.com to respond",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed for choosing the requests"
+    )
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    asyncio.run(
+        main(
+            args.requests,
+            args.concurrency,
+            args.days,
+            args.weights,
+            args.delay,
+        )
+    )
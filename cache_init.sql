@@ -19,3 +19,10 @@ CREATE TABLE IF NOT EXISTS latest_date (
   last_check TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- when this entry was last updated
   PRIMARY KEY (latest)
 );
+
+-- Only allow a single row, as the indexed expression is the same for every row.
+-- This lets concurrent inserts into an empty table conflict with each other,
+-- even if they insert different dates. Any extra rows (e.g. left by such
+-- inserts before this index existed) are removed first, keeping the latest.
+DELETE FROM latest_date WHERE latest < (SELECT max(latest) FROM latest_date);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_latest_date_single_row ON latest_date ((1));
@@ -0,0 +1,137 @@
+"""Static assets, with fingerprinted names and precompressed variants."""
+import mimetypes
+import os
+from hashlib import sha256
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from quart import Response
+
+from compression import compress
+from constants import (
+    ASSET_BROTLI_QUALITY,
+    ASSET_GZIP_LEVEL,
+    ASSET_HASH_LEN,
+    ASSET_MAX_AGE,
+    ASSET_URL_PREFIX,
+)
+from pages import compressed_response
+
+# MIME types that aren't "text/*", but are still worth compressing
+_COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+
+class StaticAsset(NamedTuple):
+    """A static file, held in memory with its precompressed variants.
+
+    Attributes:
+        bodies: The file's data for each available content coding
+        mimetype: The MIME type of the file
+        etag: A strong entity tag, derived from the file's data
+    """
+
+    bodies: dict[str, bytes]
+    mimetype: str
+    etag: str
+
+
+class StaticAssets:
+    """The static files, served under names with their content hashes.
+
+    A changed file gets a new name, so clients can cache the files forever.
+    All files are small, so they are read and compressed once on startup, and
+    then served from memory.
+
+    Attributes:
+        directory: The directory with the static files
+    """
+
+    def __init__(self, directory: str):
+        """Store the directory with the static files.
+
+        `load` must be called before using this.
+
+        Args:
+            directory: The directory with the static files
+        """
+        self.directory = directory
+        # The assets, keyed by their fingerprinted names
+        self._assets: dict[str, StaticAsset] = {}
+        # The URLs of the assets, keyed by the original names of the files
+        self._urls: dict[str, str] = {}
+
+    def load(self) -> None:
+        """Read, fingerprint and compress all static files."""
+        root = Path(self.directory)
+        for path in sorted(root.rglob("*")):
+            if not path.is_file():
+                continue
+
+            data = path.read_bytes()
+            digest = sha256(data).hexdigest()
+            mimetype = (
+                mimetypes.guess_type(path.name)[0]
+                or "application/octet-stream"
+            )
+
+            if mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_TYPES:
+                bodies = compress(
+                    data,
+                    gzip_level=ASSET_GZIP_LEVEL,
+                    brotli_quality=ASSET_BROTLI_QUALITY,
+                )
+            else:
+                # Images like PNGs are already compressed
+                bodies = {"identity": data}
+
+            # Keep the extension last, so that the MIME type can be guessed
+            # from the fingerprinted name too
+            name = path.relative_to(root).as_posix()
+            stem, ext = os.path.splitext(name)
+            hashed_name = f"{stem}.{digest[:ASSET_HASH_LEN]}{ext}"
+
+            self._assets[hashed_name] = StaticAsset(
+                bodies, mimetype, digest[:32]
+            )
+            self._urls[name] = f"{ASSET_URL_PREFIX}/{hashed_name}"
+
+    def url_for(self, filename: str) -> str:
+        """Get the URL of a static file, with its fingerprinted name.
+
+        Args:
+            filename: The path of the file, relative to the static directory
+
+        Returns:
+            The URL of the file
+        """
+        return self._urls[filename]
+
+    def get(self, hashed_name: str) -> Optional[StaticAsset]:
+        """Get the asset with the given fingerprinted name, if it exists."""
+        return self._assets.get(hashed_name)
+
+
+def asset_response(asset: StaticAsset) -> Response:
+    """Create a response for the asset, honouring conditional requests.
+
+    The asset is compressed as per the client's "Accept-Encoding". Its name
+    changes with its content, so clients may cache it forever.
+
+    Args:
+        asset: The static asset
+
+    Returns:
+        The response with the asset, or "304 Not Modified" if the client's
+        copy is up-to-date
+    """
+    response = compressed_response(
+        asset.bodies, asset.etag, None, mimetype=asset.mimetype
+    )
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,175 @@
+"""Circuit breaker for scraping from "dilbert.com" and its image CDN."""
+import asyncio
+from collections.abc import Awaitable
+from logging import Logger
+from time import monotonic
+from typing import Optional, TypeVar
+
+from aiohttp import ClientError
+
+from constants import BREAKER_RESET_TIMEOUT, BREAKER_THRESHOLD, SCRAPE_BUDGET
+
+Result = TypeVar("Result")
+
+
+class UpstreamUnavailableError(Exception):
+    """Used to indicate that "dilbert.com" is too slow or unreachable.
+
+    Attributes:
+        retry_after: The time (in seconds) after which "dilbert.com" will be
+            tried again
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        """Store the time after which "dilbert.com" will be tried again."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker with a latency budget for each scrape.
+
+    A scrape fails if it takes longer than the budget (including the time spent
+    waiting for a free connection), or if "dilbert.com" can't be reached. After
+    enough consecutive failures, the circuit "opens", and scrapes fail
+    immediately instead of piling up on the connection limit. After a while,
+    a single scrape is let through as a trial. If it succeeds, the circuit
+    "closes" again, else it stays open for another while.
+
+    Attributes:
+        logger: The main app logger
+        upstream: The name of the upstream server, for log and error messages
+        budget: The max. time (in seconds) for a single scrape
+        threshold: The no. of consecutive failures that open the circuit
+        reset_timeout: The time (in seconds) for which the circuit stays open
+            before a trial
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        *,
+        upstream: str = '"dilbert.com"',
+        budget: float = SCRAPE_BUDGET,
+        threshold: int = BREAKER_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        """Start with a closed circuit.
+
+        Args:
+            logger: The main app logger
+            upstream: The name of the upstream server, for log and error
+                messages
+            budget: The max. time (in seconds) for a single scrape
+            threshold: The no. of consecutive failures that open the circuit
+            reset_timeout: The time (in seconds) for which the circuit stays
+                open before a trial
+        """
+        self.logger = logger
+        self.upstream = upstream
+        self.budget = budget
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        # When the circuit was last opened, or None if it is closed
+        self._opened_at: Optional[float] = None
+        # Whether a trial scrape is in progress while the circuit is open
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        """Return whether scrapes are currently failing immediately."""
+        return self._opened_at is not None
+
+    @property
+    def retry_after(self) -> float:
+        """Return the time (in seconds) until the next trial is allowed."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - monotonic())
+
+    def _allow(self) -> bool:
+        """Check if a scrape can be attempted now."""
+        if self._opened_at is None:
+            return True
+        if self._trial or self.retry_after > 0:
+            return False
+        self._trial = True
+        return True
+
+    def _on_success(self) -> None:
+        """Record that "dilbert.com" responded in time."""
+        if self._opened_at is not None:
+            self.logger.info(f"Circuit for {self.upstream} is closed again")
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def _on_failure(self, trial: bool) -> None:
+        """Record that "dilbert.com" failed to respond in time.
+
+        Args:
+            trial: Whether the failed scrape was the trial
+        """
+        self._failures += 1
+        if trial or (
+            self._opened_at is None and self._failures >= self.threshold
+        ):
+            self.logger.warning(
+                f"Circuit for {self.upstream} is open after "
+                f"{self._failures} consecutive failures; retrying in "
+                f"{self.reset_timeout}s"
+            )
+            self._opened_at = monotonic()
+            self._trial = False
+
+    async def run(self, scrape: Awaitable[Result]) -> Result:
+        """Run the scrape within the latency budget, if the circuit allows.
+
+        Args:
+            scrape: The scrape to run
+
+        Returns:
+            The result of the scrape
+
+        Raises:
+            UpstreamUnavailableError: If the circuit is open, or if the scrape
+                failed to reach "dilbert.com" within the latency budget
+        """
+        if not self._allow():
+            if asyncio.iscoroutine(scrape):
+                scrape.close()  # avoid a warning for never awaiting it
+            raise UpstreamUnavailableError(
+                f"Circuit for {self.upstream} is open", self.retry_after
+            )
+        # Scrapes are only let through an open circuit as the trial
+        trial = self._opened_at is not None
+
+        try:
+            result = await asyncio.wait_for(scrape, self.budget)
+        except asyncio.TimeoutError as ex:
+            self._on_failure(trial)
+            raise UpstreamUnavailableError(
+                f"No response from {self.upstream} within {self.budget}s",
+                self.retry_after,
+            ) from ex
+        except (ClientError, OSError) as ex:
+            self._on_failure(trial)
+            raise UpstreamUnavailableError(
+                f"Couldn't reach {self.upstream}: {ex!r}", self.retry_after
+            ) from ex
+        except asyncio.CancelledError:
+            # The caller gave up, so this says nothing about "dilbert.com".
+            # If this was the trial, then let another scrape be the trial
+            # instead.
+            if trial:
+                self._trial = False
+            raise
+        except Exception:
+            # "dilbert.com" did respond in time, e.g. without a comic
+            self._on_success()
+            raise
+
+        self._on_success()
+        return result
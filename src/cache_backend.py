@@ -0,0 +1,154 @@
+"""Abstract base class definition for a backend of the cache.
+
+The scrapers cache their data through a backend, so that the storage can be
+chosen per deployment. See `connections.create_cache_backend` for the
+available backends.
+"""
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
+from contextlib import AbstractAsyncContextManager
+from datetime import date
+from pathlib import Path
+from typing import Optional
+
+# The schema for the cache, which is created on startup if it doesn't exist
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / "cache_init.sql"
+
+ComicRow = tuple[date, str, str]  # date, image URL, title
+LatestListener = Callable[[date], None]
+
+
+class CacheBackend(ABC):
+    """Storage for the cached comics and the cached latest date.
+
+    The comics cache holds the image URL and title of each comic, along with
+    when it was last used. The latest date cache holds a single date, along
+    with when it was last checked.
+    """
+
+    async def close(self) -> None:
+        """Release all resources held by this backend."""
+
+    def exclusive(self, key: int) -> AbstractAsyncContextManager[bool]:
+        """Try to take a lock shared by all workers using this cache.
+
+        This doesn't wait for the lock. The lock is held till the context
+        exits.
+
+        Args:
+            key: The key identifying the lock
+
+        Returns:
+            A context manager, which gives whether the lock was taken
+        """
+        return _AlwaysAcquired()
+
+    async def listen_latest(self, callback: LatestListener) -> None:
+        """Start listening for new latest dates cached by any worker.
+
+        Backends that can't notify other workers don't do anything here.
+        """
+
+    async def unlisten_latest(self, callback: LatestListener) -> None:
+        """Stop listening for new latest dates."""
+
+    # ==================================================
+    # Comics cache
+    # ==================================================
+    @abstractmethod
+    async def get_comic(self, comic: date) -> Optional[tuple[str, str]]:
+        """Get the image URL and the title of the comic, if it's cached."""
+
+    @abstractmethod
+    async def upsert_comic(
+        self, comic: date, img_url: str, title: str
+    ) -> None:
+        """Cache the comic, or refresh it and mark it as used if cached."""
+
+    @abstractmethod
+    async def insert_comics_if_missing(
+        self, rows: Iterable[ComicRow], *, used: bool = False
+    ) -> None:
+        """Cache the comics in one go, leaving the cached ones untouched.
+
+        By default, the comics are cached as the least recently used ones, so
+        that bulk inserts don't evict the comics that are being viewed. If
+        `used` is True, they are marked as used at the start of the day
+        instead, with older comics marked as used slightly earlier, so that
+        newer comics are kept longer.
+        """
+
+    @abstractmethod
+    async def touch_comics(self, comics: list[date]) -> None:
+        """Mark the comics as used now."""
+
+    @abstractmethod
+    async def find_cached_comics(self, comics: list[date]) -> set[date]:
+        """Get which of the comics are cached."""
+
+    @abstractmethod
+    async def get_comics_between(
+        self, start: date, end: date
+    ) -> list[ComicRow]:
+        """Get the cached comics between the given dates (both inclusive).
+
+        Returns:
+            The cached comics, ordered by date
+        """
+
+    @abstractmethod
+    async def get_cached_dates(self) -> list[date]:
+        """Get the dates of all cached comics, in no particular order."""
+
+    @abstractmethod
+    async def count_comics(self) -> int:
+        """Get the exact no. of cached comics."""
+
+    @abstractmethod
+    async def evict_oldest_comics(self, limit: int) -> int:
+        """Remove the least recently used comics, up to the given limit.
+
+        Returns:
+            The no. of comics removed
+        """
+
+    # ==================================================
+    # Latest date cache
+    # ==================================================
+    @abstractmethod
+    async def get_latest(
+        self, refresh_hours: float
+    ) -> Optional[tuple[date, float]]:
+        """Get the latest date, if it was checked recently enough.
+
+        Args:
+            refresh_hours: The no. of hrs after a check when the latest date
+                is no longer "fresh"
+
+        Returns:
+            The latest date, and the time (in seconds) for which it stays
+            "fresh", or None if it isn't cached or isn't "fresh"
+        """
+
+    @abstractmethod
+    async def get_stale_latest(self) -> Optional[date]:
+        """Get the latest date, ignoring when it was last checked."""
+
+    @abstractmethod
+    async def upsert_latest(self, latest: date) -> int:
+        """Cache the latest date, and notify all listening workers.
+
+        Returns:
+            The no. of rows that were updated, which is 0 if the cache was
+            empty and more than 1 if the cache is corrupt
+        """
+
+
+class _AlwaysAcquired(AbstractAsyncContextManager):
+    """A "lock" for backends used by only one worker."""
+
+    async def __aenter__(self) -> bool:
+        return True
+
+    async def __aexit__(self, *_) -> None:
+        pass
@@ -1,14 +1,44 @@
 """Scraper to get info for requested Dilbert comics."""
 import asyncio
-import re
-from html import unescape
+import random
+from collections.abc import AsyncIterator
+from datetime import date, timedelta
+from logging import Logger
 from typing import Optional
 
-from asyncpg import UniqueViolationError
-
-from constants import ALT_DATE_FMT, CACHE_LIMIT, SRC_PREFIX
+from aiohttp import ClientError, ClientResponse, ClientSession
+
+from cache_backend import CacheBackend
+from constants import (
+    ALIAS_CACHE_SIZE,
+    ALIAS_TTL,
+    ALT_DATE_FMT,
+    API_CHUNK_DAYS,
+    API_CONCURRENCY,
+    API_MAX_SCRAPES,
+    CACHE_HIGH_MARGIN,
+    CACHE_LIMIT,
+    CACHE_LOW_MARGIN,
+    CACHED_INDEX_INTERVAL,
+    EVICTION_BATCH_SIZE,
+    EVICTION_INTERVAL,
+    EVICTION_LOCK_KEY,
+    FIRST_COMIC,
+    LAST_USED_FLUSH_INTERVAL,
+    NOT_FOUND_CACHE_SIZE,
+    NOT_FOUND_RECENT_TTL,
+    NOT_FOUND_TTL,
+    RANDOM_ATTEMPTS,
+    SCRAPE_CHUNK_SIZE,
+    SCRAPE_DRAIN_LIMIT,
+    SRC_PREFIX,
+)
+from extract import ComicPageParser
+from lru import LRUCache
+from metrics import SCRAPER_LOOKUPS, SCRAPER_STAGE_SECONDS
 from scraper import Scraper, ScrapingException
-from utils import date_to_str, str_to_date
+from tasks import PeriodicTask
+from utils import curr_date, date_to_str, str_to_date
 
 ComicData = dict[str, str]
 
@@ -17,10 +47,49 @@ class ComicNotFoundError(ScrapingException):
     """Used to indicate that the requested comic doesn't exist."""
 
 
-class ComicScraper(Scraper[ComicData, str]):
+class ScrapeLimitError(Exception):
+    """Used to indicate that a bulk retrieval would scrape too many comics.
+
+    Attributes:
+        resume_from: The date from which the retrieval is to be resumed
+    """
+
+    def __init__(self, message: str, resume_from: date):
+        """Store the date from which the retrieval is to be resumed."""
+        super().__init__(message)
+        self.resume_from = resume_from
+
+
+def _cached_comic_data(date: date, img_url: str, title: str) -> ComicData:
+    """Get the comic data for a comic in the cache."""
+    return {
+        "title": title,
+        "dateStr": date_to_str(date, fmt=ALT_DATE_FMT),
+        "imgURL": img_url,
+    }
+
+
+async def _discard_rest(resp: ClientResponse) -> None:
+    """Read and discard the rest of the response, so that it can be reused.
+
+    If the rest is too long or can't be read, then the connection is closed
+    instead.
+    """
+    discarded = 0
+    try:
+        async for chunk in resp.content.iter_any():
+            discarded += len(chunk)
+            if discarded > SCRAPE_DRAIN_LIMIT:
+                resp.close()
+                return
+    except (ClientError, OSError, asyncio.TimeoutError):
+        resp.close()
+
+
+class ComicScraper(Scraper[ComicData, date]):
     """Class for a comic scraper.
 
-    This scraper takes a date (in the format used by "dilbert.com") as input.
+    This scraper takes a date as input.
     It returns a dict representing the following info:
         * title: The title of that comic
         * dateStr: The date of that comic as displayed on "dilbert.com"
@@ -31,193 +100,523 @@ class ComicScraper(Scraper[ComicData, str]):
     different from the given date, as "dilbert.com" can redirect to a different
     date. This redirection only happens if the input date in invalid.
 
+    Dates without comics, and dates that redirect to other dates (i.e.
+    aliases), are remembered in memory for a while, so that requests for them
+    are answered without scraping "dilbert.com" every time.
+
+    The dates of the cached comics are also indexed in memory, so that random
+    comics can be picked from the cache.
+
     Attributes:
-        pool: The database connection pool
+        backend: The backend of the cache
         sess: The HTTP client session
         logger: The main app logger
+        mem_cache: The in-memory cache in front of the backend
+        high_watermark: The no. of comics in the backend above which the
+            oldest comics are cleared
+        low_watermark: The no. of comics in the backend to which it is
+            cleared
     """
 
-    async def _update_last_used(self, date: str) -> None:
-        """Update the last used date for the given comic."""
-        self.logger.info("Updating `last_used` for data in cache")
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE comic_cache SET last_used = DEFAULT WHERE comic = $1;",
-                str_to_date(date),
-            )
+    def __init__(
+        self,
+        backend: CacheBackend,
+        sess: ClientSession,
+        logger: Logger,
+        *,
+        cache_limit: int = CACHE_LIMIT,
+        flush_interval: float = LAST_USED_FLUSH_INTERVAL,
+        eviction_interval: float = EVICTION_INTERVAL,
+        index_interval: float = CACHED_INDEX_INTERVAL,
+        **kwargs,
+    ):
+        """Store the required objects.
 
-    async def _get_cached_data(self, date: str) -> Optional[ComicData]:
-        """Get the cached comic data from the database."""
-        async with self.pool.acquire() as conn:
-            # The other columns in the table are: `comic`, `last_used`. `comic`
-            # is not required here, as we already have the date as a function
-            # argument. In case the date given here is invalid (i.e. it would
-            # redirect to a comic with a different date), we cannot retrieve
-            # the correct date from the cache, as we aren't caching the mapping
-            # of incorrect:correct dates. `last_used` will be updated later.
-            row = await conn.fetchrow(
-                "SELECT img_url, title FROM comic_cache WHERE comic = $1;",
-                str_to_date(date),
-            )
+        Args:
+            backend: The backend of the cache
+            sess: The HTTP client session
+            logger: The main app logger
+            cache_limit: The limit (in no. of comics) for the backend
+            flush_interval: The time (in seconds) between bulk updates of
+                `last_used` in the backend
+            eviction_interval: The time (in seconds) between checks for
+                excess comics in the backend
+            index_interval: The time (in seconds) between reloads of the
+                index of cached comics
+            **kwargs: Options for the in-memory cache, as given to `Scraper`
+        """
+        super().__init__(backend, sess, logger, **kwargs)
+        self.high_watermark = cache_limit - CACHE_HIGH_MARGIN
+        self.low_watermark = cache_limit - CACHE_LOW_MARGIN
+        # Comics that were used since the last update of `last_used`. These
+        # are written to the backend in bulk, to avoid one UPDATE per use.
+        self._used_comics: set[date] = set()
+        self._flusher = PeriodicTask(
+            self.flush_last_used, flush_interval, logger, name="last_used"
+        )
+        self._evictor = PeriodicTask(
+            self._clean_cache, eviction_interval, logger, name="eviction"
+        )
+        # Dates without comics
+        self._not_found: LRUCache[date, bool] = LRUCache(
+            NOT_FOUND_CACHE_SIZE, NOT_FOUND_TTL
+        )
+        # Dates that redirect to other dates, mapped to the dates they
+        # redirect to
+        self._aliases: LRUCache[date, date] = LRUCache(
+            ALIAS_CACHE_SIZE, ALIAS_TTL
+        )
+        # The dates of the cached comics, as a list for random picks, and as
+        # a set for lookups. The backend is the source of truth, so these are
+        # reloaded periodically, and updated by this worker in between.
+        self._cached_index: list[date] = []
+        self._indexed: set[date] = set()
+        self._indexer = PeriodicTask(
+            self.reload_cached_index,
+            index_interval,
+            logger,
+            name="cached_index",
+        )
+
+    @property
+    def pending_flush(self) -> int:
+        """Return the no. of comics whose `last_used` is yet to be updated."""
+        return len(self._used_comics)
+
+    async def start(self) -> None:
+        """Start the periodic jobs, after loading the index of cached comics.
+
+        The periodic jobs are the `last_used` updates, cache cleaning and
+        reloads of the index of cached comics.
+        """
+        try:
+            await self.reload_cached_index()
+        except Exception:
+            # The index will be reloaded periodically, so simply log the
+            # error with the traceback.
+            self.logger.exception("Loading the index of cached comics failed")
+
+        self._flusher.start()
+        self._evictor.start()
+        self._indexer.start()
+
+    async def close(self) -> None:
+        """Stop the periodic jobs, and write the pending updates."""
+        await asyncio.gather(
+            self._flusher.stop(), self._evictor.stop(), self._indexer.stop()
+        )
+        await self.flush_last_used()
+
+    async def reload_cached_index(self) -> None:
+        """Reload the index of cached comics from the backend."""
+        dates = await self.backend.get_cached_dates()
+        self._cached_index = dates
+        self._indexed = set(dates)
+
+    def _index_cached(self, date: date) -> None:
+        """Add the given comic to the index of cached comics."""
+        if date not in self._indexed:
+            self._indexed.add(date)
+            self._cached_index.append(date)
+
+    def random_date(self, latest: date, *, cached_bias: float) -> date:
+        """Pick the date of a random comic, preferably a cached one.
+
+        Dates known to not have comics are never picked.
+
+        Args:
+            latest: The date of the latest comic
+            cached_bias: The probability of picking one of the cached comics,
+                instead of any comic
+
+        Returns:
+            The date of the random comic
+        """
+        for _ in range(RANDOM_ATTEMPTS):
+            if self._cached_index and random.random() < cached_bias:
+                comic = random.choice(self._cached_index)
+            else:
+                comic = date.fromordinal(
+                    random.randint(FIRST_COMIC.toordinal(), latest.toordinal())
+                )
+
+            if comic <= latest and comic not in self._not_found:
+                return comic
+
+        return latest
+
+    def _mark_used(self, reference: date) -> None:
+        """Queue an update of `last_used` for the given comic."""
+        self._used_comics.add(reference)
+
+    def _remember_not_found(self, date: date) -> None:
+        """Remember that there's no comic for the given date."""
+        # The comic for a recent date may yet be published
+        if date >= curr_date() - timedelta(days=1):
+            self._not_found.put(date, True, NOT_FOUND_RECENT_TTL)
+        else:
+            self._not_found.put(date, True)
+
+    def forget_not_found(self, date: date) -> None:
+        """Forget that there was no comic for the given date.
+
+        This is meant for when a comic is known to be published for the date.
+
+        Args:
+            date: The date of the comic
+        """
+        self._not_found.invalidate(date)
+
+    async def flush_last_used(self) -> None:
+        """Update `last_used` in the backend for all comics used recently."""
+        if not self._used_comics:
+            return
+
+        # Swap out the pending set before any awaits, so that comics used
+        # during the update are queued for the next one.
+        comics = self._used_comics
+        self._used_comics = set()
+
+        self.logger.info(
+            f"Updating `last_used` for {len(comics)} comics in cache"
+        )
+        try:
+            await self.backend.touch_comics(list(comics))
+        except BaseException:
+            # Retry these in the next update, even if this was cancelled
+            self._used_comics.update(comics)
+            raise
+
+    async def _get_cached_data(self, date: date) -> Optional[ComicData]:
+        """Get the cached comic data from the backend."""
+        # In case the date given here is invalid (i.e. it would redirect to a
+        # comic with a different date), the correct date can only be found if
+        # this redirection was remembered. `last_used` will be updated later.
+        date = self._aliases.get(date) or date
+        row = await self.backend.get_comic(date)
 
         if row is None:
             # This means that the comic for this date wasn't cached, or the
-            # date is invalid (i.e. it would redirect to a comic with a
-            # different date).
+            # date is invalid and its redirection was forgotten.
             return None
 
-        data = {
-            "title": row[1],
-            "dateStr": date_to_str(str_to_date(date), fmt=ALT_DATE_FMT),
-            "imgURL": row[0],
-        }
+        data = _cached_comic_data(date, *row)
+        self._index_cached(date)
 
         # Update `last_used`, so that this comic isn't accidently de-cached. We
         # want to keep the most recently used comics in the cache, and we are
-        # currently using this comic. Since this can be run independely in the
-        # background, we do so.
-        bg_awaitable = self._update_last_used(date)
-        asyncio.create_task(bg_awaitable)
+        # currently using this comic. This is batched with other such updates
+        # and written in the background.
+        self._mark_used(date)
 
         return data
 
     async def _clean_cache(self) -> None:
-        """Remove excess rows from the cache."""
-        # This is an approximate of the no. of rows in the `comic_cache` table.
-        # This is much faster than the accurate measurement, as given here:
-        # https://wiki.postgresql.org/wiki/Count_estimate
-        async with self.pool.acquire() as conn:
-            approx_rows = await conn.fetchval(
-                "SELECT reltuples FROM pg_class WHERE relname = 'comic_cache';"
-            )
-
-        if approx_rows < CACHE_LIMIT:
+        """Remove excess rows from the cache.
+
+        This is run periodically in the background by every worker. A lock
+        shared by all workers ensures that only one worker cleans the cache at
+        a time. If the no. of rows exceeds the high watermark, then the oldest
+        rows are removed in small batches until the low watermark is reached.
+        Small batches avoid holding row locks for long, which would block
+        inserts.
+        """
+        async with self.backend.exclusive(EVICTION_LOCK_KEY) as acquired:
+            if not acquired:
+                self.logger.info("Another worker is cleaning `comic_cache`")
+                return
+
+            with SCRAPER_STAGE_SECONDS.time(self._metrics_name, "clean_cache"):
+                await self._evict_oldest()
+
+    async def _evict_oldest(self) -> None:
+        """Remove the oldest rows from the cache, if it is too large."""
+        # An exact count is affordable here, as this isn't in the request path.
+        # The approximate count from `pg_class` is only updated on VACUUM or
+        # ANALYZE, which would make successive runs clear the same excess.
+        num_rows = await self.backend.count_comics()
+
+        if num_rows <= self.high_watermark:
             self.logger.info(
-                f"No. of rows in `comic_cache` ({approx_rows}) is less than "
-                f"the limit ({CACHE_LIMIT})"
+                f"No. of rows in `comic_cache` ({num_rows}) is within the "
+                f"limit ({self.high_watermark})"
             )
             return
 
-        rows_to_clear = approx_rows - CACHE_LIMIT + 1
+        rows_to_clear = num_rows - self.low_watermark
         self.logger.info(
-            f"No. of rows in `comic_cache` ({approx_rows}) exceeds the limit "
-            f"({CACHE_LIMIT}); now clearing the oldest {rows_to_clear} rows"
+            f"No. of rows in `comic_cache` ({num_rows}) exceeds the limit "
+            f"({self.high_watermark}); now clearing the oldest "
+            f"{rows_to_clear} rows"
         )
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """DELETE FROM comic_cache
-                WHERE ctid in
-                (SELECT ctid FROM comic_cache ORDER BY last_used LIMIT $1);""",
-                rows_to_clear,
+
+        while rows_to_clear > 0:
+            rows_deleted = await self.backend.evict_oldest_comics(
+                min(rows_to_clear, EVICTION_BATCH_SIZE)
             )
+            if rows_deleted == 0:
+                break  # the table was emptied by someone else
+            rows_to_clear -= rows_deleted
 
-    async def _cache_data(self, data: ComicData, date: str) -> None:
-        """Cache the comic data into the database."""
+        # Don't pick evicted comics as cached ones until the next reload
+        await self.reload_cached_index()
+
+    async def _cache_data(self, data: ComicData, date: date) -> None:
+        """Cache the comic data into the backend."""
         # The given date can be invalid (i.e. we may have been redirected to a
         # comic with a different date), hence get the correct date from the
         # scraped data.
-        date = date_to_str(str_to_date(data["dateStr"], fmt=ALT_DATE_FMT))
-
-        # This lock ensures that the no. of rows in the cache doesn't increase.
-        # This can happen, as the code involves first clearing excess rows,
-        # then adding a new row. Therefore, the following can increase the no.
-        # of rows:
-        #   1. Coroutine 1 clears excess rows
-        #   2. Coroutine 2 clears no excess rows, as coroutine 1 did them
-        #   3. Coroutine 1 adds its row
-        #   4. Coroutine 2 adds its row
-        async with asyncio.Lock():
-            try:
-                await self._clean_cache()
-            except Exception:
-                # This crash means that there can be some extra rows in the
-                # cache. As the row limit is a little conservative, this should
-                # not be a big issue.
-                self.logger.exception("Failed to clean comics cache")
+        date = str_to_date(data["dateStr"], fmt=ALT_DATE_FMT)
 
-            date_obj = str_to_date(date)
+        # Excess rows are removed periodically in the background, so that the
+        # request path only needs a single upsert. If some other coroutine has
+        # already cached this date in parallel, then this simply updates
+        # `last_used`.
+        await self.backend.upsert_comic(date, data["imgURL"], data["title"])
+        self._index_cached(date)
 
-            try:
-                async with self.pool.acquire() as conn:
-                    await conn.execute(
-                        """INSERT INTO comic_cache (comic, img_url, title)
-                        VALUES ($1, $2, $3);""",
-                        date_obj,
-                        data["imgURL"],
-                        data["title"],
-                    )
-            except UniqueViolationError:
-                # This comic date exists, so some other coroutine has already
-                # cached this date in parallel. So we can simply update
-                # `last_used` later (outside the lock).
-                self.logger.warn(
-                    f"Trying to cache date {date}, which is already cached."
-                )
-            else:
-                return  # succeeded in caching data, so exit
-
-        # This only executes if caching data led to a UniqueViolation error.
-        # The lock isn't needed here, as this command cannot increase the no.
-        # of rows in the cache.
-        self.logger.info("Now trying to update `last_used` in cache.")
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE comic_cache SET last_used = DEFAULT WHERE comic = $1;",
-                date_obj,
-            )
+    async def _scrape_data(self, date: date) -> ComicData:
+        """Scrape the comic data of the requested date from "dilbert.com".
+
+        The page is parsed as it arrives, and parsing stops as soon as all the
+        data is found.
+        """
+        url = SRC_PREFIX + date_to_str(date)
 
-    async def _scrape_data(self, date: str) -> ComicData:
-        """Scrape the comic data of the requested date from "dilbert.com"."""
-        url = SRC_PREFIX + date
         async with self.sess.get(url) as resp:
-            self.logger.debug(f"Got response for comic: {resp.status}")
-            content = await resp.text()
+            try:
+                self.logger.debug(f"Got response for comic: {resp.status}")
+                if resp.url.path == "/":
+                    # Redirected to homepage, implying that there's no comic
+                    # for this date.
+                    raise ComicNotFoundError(f"Comic for {date} not found")
+
+                parser = ComicPageParser(resp.charset or "utf-8")
+                async for chunk in resp.content.iter_chunked(
+                    SCRAPE_CHUNK_SIZE
+                ):
+                    parser.feed(chunk)
+                    if parser.done:
+                        break
+
+                # The rest of the page isn't parsed, but it must be read so
+                # that the connection can be reused for later requests.
+                await _discard_rest(resp)
+
+            except asyncio.CancelledError:
+                # The latency budget ran out. Reading the rest of a slow page
+                # would hold up the connection, so close it instead.
+                resp.close()
+                raise
+
+        data = parser.result()
+        actual_date = str_to_date(data["dateStr"], fmt=ALT_DATE_FMT)
+        if actual_date != date:
+            self.logger.info(f"Comic for {date} redirects to {actual_date}")
+            self._aliases.put(date, actual_date)
+        return data
 
-        if resp.url.path == "/":
-            # Redirected to homepage, implying that there's no comic for this
-            # date.
-            raise ComicNotFoundError(f"Comic for {date} not found")
+    async def get_comic_data(self, date: date) -> Optional[ComicData]:
+        """Retrieve the data for the requested comic.
 
-        data = {}
+        Args:
+            date: The date of the requested comic
 
-        match = re.search(
-            r'<span class="comic-title-name">([^<]+)</span>', content
-        )
-        if match is None:
-            # Some comics don't have a title. This is mostly for older comics.
-            data["title"] = ""
-        else:
-            data["title"] = unescape(match.groups()[0])
+        Returns:
+            The data for the comic, if it's found, else None
+        """
+        if date in self._not_found:
+            self.logger.info(f"Comic for {date} is known to not exist")
+            SCRAPER_LOOKUPS.inc(self._metrics_name, "not_found")
+            return None
 
-        match = re.search(
-            r'<date class="comic-title-date" item[pP]rop="datePublished">[^<]*'
-            r'<span>([^<]*)</span>[^<]*<span item[pP]rop="copyrightYear">'
-            r"([^<]+)</span>",
-            content,
-        )
-        if match is None:
-            raise ScrapingException("Error in scraping the date string")
-        data["dateStr"] = " ".join(match.groups())
+        try:
+            return await super().get_data(date)
+        except ComicNotFoundError:
+            self._remember_not_found(date)
+            return None
 
-        match = re.search(
-            r'<img[^>]*class="img-[^>]*src="([^"]+)"[^>]*>', content
-        )
-        if match is None:
-            raise ScrapingException("Error in scraping the image's URL")
-        data["imgURL"] = match.groups()[0]
+    async def scrape_comic_data(self, date: date) -> Optional[ComicData]:
+        """Scrape the data for the requested comic, bypassing all caches.
 
-        return data
-
-    async def get_comic_data(self, date: str) -> Optional[ComicData]:
-        """Retrieve the data for the requested comic.
+        This is meant for bulk jobs, which cache the data themselves.
 
         Args:
             date: The date of the requested comic
 
         Returns:
             The data for the comic, if it's found, else None
+
+        Raises:
+            UpstreamUnavailableError: If "dilbert.com" is too slow or
+                unreachable
         """
         try:
-            return await super().get_data(date)
+            return await self.breaker.run(self._scrape_data(date))
         except ComicNotFoundError:
             return None
+
+    async def get_uncached_dates(self, dates: list[date]) -> list[date]:
+        """Find which of the given comics are not in the cache.
+
+        Args:
+            dates: The dates of the comics to check
+
+        Returns:
+            The dates of the comics that are not cached, in the given order
+        """
+        cached = await self.backend.find_cached_comics(dates)
+        return [date for date in dates if date not in cached]
+
+    async def cache_many(
+        self, comics: list[ComicData], *, used: bool = False
+    ) -> None:
+        """Cache the data for many comics into the backend in one go.
+
+        Comics that are already cached are left untouched. By default, the
+        others are cached as the least recently used ones, so that bulk jobs
+        don't evict the comics that are being viewed. Excess rows are removed
+        later by the periodic cleaning of the cache.
+
+        Args:
+            comics: The data for each comic
+            used: Whether to mark the comics as used today, with newer comics
+                marked as used later. This is for comics that are likely to be
+                viewed, e.g. prefetched ones.
+        """
+        rows = [
+            (
+                str_to_date(data["dateStr"], fmt=ALT_DATE_FMT),
+                data["imgURL"],
+                data["title"],
+            )
+            for data in comics
+        ]
+        await self.backend.insert_comics_if_missing(rows, used=used)
+        for row in rows:
+            self._index_cached(row[0])
+
+    async def _scrape_many(
+        self, dates: list[date], concurrency: int
+    ) -> list[Optional[ComicData]]:
+        """Scrape the given comics with bounded concurrency.
+
+        Returns:
+            The data for each comic, or None if it isn't found, in the given
+            order
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def scrape(date: date) -> Optional[ComicData]:
+            async with semaphore:
+                return await self.scrape_comic_data(date)
+
+        tasks = [asyncio.create_task(scrape(date)) for date in dates]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # If one scrape failed, then the rest are of no use
+            for task in tasks:
+                task.cancel()
+
+    async def iter_comic_data(
+        self,
+        start: date,
+        end: date,
+        *,
+        chunk_days: int = API_CHUNK_DAYS,
+        concurrency: int = API_CONCURRENCY,
+        max_scrapes: int = API_MAX_SCRAPES,
+    ) -> AsyncIterator[tuple[date, ComicData]]:
+        """Retrieve the data for all comics in the given range of dates.
+
+        The range is retrieved in chunks of days, so that the memory used is
+        bounded for long ranges. The cached comics of each chunk are retrieved
+        in a single range query, and the rest are scraped with bounded
+        concurrency and cached.
+
+        Bulk retrievals don't mark the cached comics as used, and cache the
+        scraped comics as the least recently used ones, so that they don't
+        evict the comics that are actually being viewed.
+
+        Args:
+            start: The date of the first comic
+            end: The date of the last comic (inclusive)
+            chunk_days: The no. of days retrieved in one go
+            concurrency: The max. no. of comics scraped at a time
+            max_scrapes: The max. no. of uncached comics scraped in total
+
+        Yields:
+            The date and the data for each comic in the range, in order of
+            date. Dates without comics, and dates that redirect to the comic
+            of another date, are skipped.
+
+        Raises:
+            UpstreamUnavailableError: If "dilbert.com" is too slow or
+                unreachable for an uncached comic
+            ScrapeLimitError: If the range has more uncached comics than the
+                scraping limit. This is raised after yielding the comics
+                before the first comic over the limit.
+        """
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+            rows = await self.backend.get_comics_between(
+                chunk_start, chunk_end
+            )
+            comics = {
+                comic: _cached_comic_data(comic, img_url, title)
+                for comic, img_url, title in rows
+            }
+
+            num_days = (chunk_end - chunk_start).days + 1
+            days = (chunk_start + timedelta(days=i) for i in range(num_days))
+            missing = [
+                comic
+                for comic in days
+                if comic not in comics
+                and comic not in self._not_found
+                and comic not in self._aliases
+            ]
+
+            # The first date that is over the scraping limit, if any
+            resume_from = None
+            if len(missing) > max_scrapes:
+                resume_from = missing[max_scrapes]
+                missing = missing[:max_scrapes]
+            max_scrapes -= len(missing)
+
+            if missing:
+                self.logger.info(
+                    f"Scraping {len(missing)} uncached comics from "
+                    f"{chunk_start} to {chunk_end}"
+                )
+                scraped = await self._scrape_many(missing, concurrency)
+                found = []
+                for comic, data in zip(missing, scraped):
+                    if data is None:
+                        self._remember_not_found(comic)
+                        continue
+                    found.append(data)
+                    # A date that redirects has no comic of its own, and the
+                    # comic it redirects to is given for its own date.
+                    if str_to_date(data["dateStr"], fmt=ALT_DATE_FMT) == comic:
+                        comics[comic] = data
+                if found:
+                    try:
+                        await self.cache_many(found)
+                    except Exception:
+                        # These will simply be scraped again later, so simply
+                        # log the error with the traceback.
+                        self.logger.exception("Caching scraped comics failed")
+
+            for comic in sorted(comics):
+                if resume_from is not None and comic >= resume_from:
+                    break
+                yield comic, comics[comic]
+
+            if resume_from is not None:
+                raise ScrapeLimitError(
+                    "Too many uncached comics to scrape", resume_from
+                )
+            chunk_start = chunk_end + timedelta(days=1)
@@ -0,0 +1,64 @@
+"""Compression of responses, as per the client's "Accept-Encoding"."""
+import gzip
+
+from quart import request
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, as gzip is supported by all clients anyway
+    brotli = None
+
+# The supported content codings, in order of preference. "identity" (i.e. no
+# compression) is always supported, so it isn't included here.
+_CODINGS = ("br", "gzip")
+
+
+def compress(
+    data: bytes, *, gzip_level: int, brotli_quality: int
+) -> dict[str, bytes]:
+    """Compress the data with every supported content coding.
+
+    Codings that don't shrink the data (e.g. for tiny or already compressed
+    data) are left out.
+
+    Args:
+        data: The data to compress
+        gzip_level: The compression level for gzip (1-9)
+        brotli_quality: The compression quality for Brotli (0-11)
+
+    Returns:
+        The data for each content coding, including "identity"
+    """
+    # A fixed mtime makes the compressed data the same on every worker
+    bodies = {"gzip": gzip.compress(data, gzip_level, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(data, quality=brotli_quality)
+
+    bodies = {
+        coding: body
+        for coding, body in bodies.items()
+        if len(body) < len(data)
+    }
+    bodies["identity"] = data
+    return bodies
+
+
+def choose_coding(bodies: dict[str, bytes]) -> str:
+    """Choose the content coding for the request's response.
+
+    This prefers the smallest coding that the client accepts, ignoring the
+    relative weights given by the client, as all clients decompress both
+    quickly.
+
+    Args:
+        bodies: The data for each available content coding
+
+    Returns:
+        The chosen content coding
+    """
+    accepted = request.accept_encodings
+    for coding in _CODINGS:
+        if coding in bodies and accepted.quality(coding) > 0:
+            return coding
+    return "identity"
@@ -0,0 +1,204 @@
+"""Creation of the cache backend, and of connections to "dilbert.com"."""
+import ssl
+from functools import partial
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+import asyncpg
+from asyncpg.pool import Pool
+
+from cache_backend import SCHEMA_FILE, CacheBackend
+from constants import SCHEMA_LOCK_KEY
+from db import CacheConnection, init_connection
+from memory_backend import MemoryBackend
+from metrics import HTTP_CONN_QUEUED_SECONDS
+from pg_backend import PostgresBackend
+from settings import Settings
+from sqlite_backend import SQLiteBackend
+
+
+def _db_ssl_context(settings: Settings) -> Optional[ssl.SSLContext]:
+    """Create the SSL context for the cache database, if SSL is enabled."""
+    if not settings.db_ssl:
+        return None
+
+    # Heroku needs SSL for its PostgreSQL DB, but has issues with verifying
+    # the certificate. So simply disable verification while keeping SSL.
+    ctx = ssl.create_default_context(cafile="")
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+async def _create_db_schema(settings: Settings) -> None:
+    """Create the tables for the cache in the database, if they don't exist.
+
+    Every worker does this on startup, so an advisory lock ensures that they
+    don't create the same tables in parallel.
+    """
+    conn = await asyncpg.connect(
+        dsn=settings.database_url,
+        command_timeout=settings.db_timeout,
+        ssl=_db_ssl_context(settings),
+    )
+    try:
+        async with conn.transaction():
+            await conn.execute(
+                "SELECT pg_advisory_xact_lock($1);", SCHEMA_LOCK_KEY
+            )
+            await conn.execute(SCHEMA_FILE.read_text())
+    finally:
+        await conn.close()
+
+
+async def _connect_db(settings: Settings) -> CacheConnection:
+    """Open a connection to the cache database outside the pool."""
+    conn = await asyncpg.connect(
+        dsn=settings.database_url,
+        command_timeout=settings.db_timeout,
+        ssl=_db_ssl_context(settings),
+        connection_class=CacheConnection,
+    )
+    await init_connection(conn)
+    return conn
+
+
+async def create_db_pool(settings: Settings) -> Pool:
+    """Create the database connection pool for caching data.
+
+    The tables for the cache are created first, if they don't exist. All
+    statements on the cache are then bound to each connection when it is
+    created. See `db.CacheConnection` for the statements.
+
+    The pool opens its initial connections in parallel, so that the first
+    requests don't pay for connection setup and SSL handshakes. One of the
+    worker's connections is left out of the pool, for listening and for
+    advisory locks; see `PostgresBackend`.
+
+    Args:
+        settings: The settings for this deployment
+
+    Returns:
+        The database connection pool
+    """
+    # The statements can't be run on tables that don't exist
+    await _create_db_schema(settings)
+
+    max_size = settings.db_conn_per_worker - 1
+    return await asyncpg.create_pool(
+        dsn=settings.database_url,
+        command_timeout=settings.db_timeout,
+        min_size=min(settings.db_warm_conn, max_size),
+        max_size=max_size,
+        ssl=_db_ssl_context(settings),
+        connection_class=CacheConnection,
+        init=init_connection,
+    )
+
+
+async def create_cache_backend(settings: Settings) -> CacheBackend:
+    """Create the backend for caching data, as chosen in the settings.
+
+    The available backends are:
+        * "postgres": A PostgreSQL database, which can be shared by all
+          workers across machines
+        * "sqlite": An SQLite database file, which can be shared by all
+          workers on the same machine
+        * "memory": The worker's memory, which is neither shared nor persisted
+
+    The schema for the cache is created if it doesn't exist.
+
+    Args:
+        settings: The settings for this deployment
+
+    Returns:
+        The backend of the cache
+    """
+    if settings.cache_backend == "sqlite":
+        backend = SQLiteBackend(settings.sqlite_path, settings.db_timeout)
+        await backend.connect()
+        return backend
+    elif settings.cache_backend == "memory":
+        return MemoryBackend()
+    return PostgresBackend(
+        await create_db_pool(settings), partial(_connect_db, settings)
+    )
+
+
+async def _on_connection_queued_start(
+    _: aiohttp.ClientSession,
+    ctx: SimpleNamespace,
+    __: aiohttp.TraceConnectionQueuedStartParams,
+) -> None:
+    """Note when a request starts waiting for a free connection."""
+    ctx.queued_at = perf_counter()
+
+
+async def _on_connection_queued_end(
+    _: aiohttp.ClientSession,
+    ctx: SimpleNamespace,
+    __: aiohttp.TraceConnectionQueuedEndParams,
+) -> None:
+    """Record the time a request spent waiting for a free connection."""
+    HTTP_CONN_QUEUED_SECONDS.observe(perf_counter() - ctx.queued_at)
+
+
+def create_client_sess(settings: Settings) -> aiohttp.ClientSession:
+    """Create the aiohttp session for scraping comics.
+
+    This must be called from within a running event loop.
+
+    Args:
+        settings: The settings for this deployment
+
+    Returns:
+        The HTTP client session
+    """
+    # Limit max connections to "dilbert.com", else we might get blocked
+    connector = aiohttp.TCPConnector(
+        limit=settings.fetch_conn_per_worker,
+        keepalive_timeout=settings.keepalive_timeout,
+        ttl_dns_cache=settings.dns_cache_ttl,
+    )
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=settings.fetch_timeout,
+        sock_read=settings.fetch_read_timeout,
+    )
+
+    # A request is only queued when all connections are in use, so this
+    # measures how often (and how long) the connection limit is a bottleneck.
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(_on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(_on_connection_queued_end)
+
+    return aiohttp.ClientSession(
+        connector=connector, timeout=timeout, trace_configs=[trace_config]
+    )
+
+
+async def prime_client_sess(
+    sess: aiohttp.ClientSession, url: str, timeout: float
+) -> None:
+    """Open a keep-alive connection to "dilbert.com" for the first requests.
+
+    This sends a HEAD request, so that the DNS lookup, the TCP connection and
+    the SSL handshake are done before any request needs them.
+
+    Args:
+        sess: The HTTP client session
+        url: Any URL on "dilbert.com"
+        timeout: The max. time (in seconds) for the request
+
+    Raises:
+        aiohttp.ClientError: If the request fails
+        asyncio.TimeoutError: If the request is too slow
+    """
+    async with sess.head(
+        url,
+        allow_redirects=False,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ):
+        # The connection is returned to the pool for reuse on exit
+        pass
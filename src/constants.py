@@ -1,10 +1,13 @@
 """All constants used by this web page."""
+import os
+import tempfile
+from datetime import date, time
 from typing import Final
 
 # ==================================================
 # Date formats
 # ==================================================
-FIRST_COMIC: Final = "1989-04-16"  # date of the first ever Dilbert comic
+FIRST_COMIC: Final = date(1989, 4, 16)  # date of the first ever Dilbert comic
 DATE_FMT: Final = "%Y-%m-%d"  # date format used for URLs on "dilbert.com"
 # Date format used for display with the comic on "dilbert.com"
 ALT_DATE_FMT: Final = "%A %B %d, %Y"
@@ -12,24 +15,260 @@ ALT_DATE_FMT: Final = "%A %B %d, %Y"
 # ==================================================
 # Parameters for scraping from "dilbert.com"
 # ==================================================
-# Limit for connections to "dilbert.com"
+# NOTE: The parameters documented as defaults can be changed per deployment;
+# see settings.py.
+# Default limit for connections to "dilbert.com", across all workers
 MAX_FETCH_CONN: Final = 20
-# Timeout (in seconds) for establishing a connection
+# Default timeout (in seconds) for establishing a connection
 FETCH_TIMEOUT: Final = 3
+# Default timeout (in seconds) for reading a chunk of a response. There is no
+# timeout by default.
+FETCH_READ_TIMEOUT: Final = None
+# Default time (in seconds) for which idle connections are kept open for reuse
+KEEPALIVE_TIMEOUT: Final = 15
+# Default time (in seconds) for which DNS lookups are cached
+DNS_CACHE_TTL: Final = 10
+# Size (in bytes) of the chunks in which a comic's page is read and parsed
+SCRAPE_CHUNK_SIZE: Final = 8192
+# Max. size (in bytes) of the rest of a comic's page that is read and discarded
+# after all data is found, so that its connection can be reused. The
+# connection is closed instead if more of the page is left.
+SCRAPE_DRAIN_LIMIT: Final = 512 * 1024
+# Default max. time (in seconds) for a single scrape, including the time spent
+# waiting for a free connection
+SCRAPE_BUDGET: Final = 5
+# No. of consecutive failed scrapes after which scraping is paused
+BREAKER_THRESHOLD: Final = 5
+# Time (in seconds) for which scraping is paused before it is tried again
+BREAKER_RESET_TIMEOUT: Final = 30
 
 # ==================================================
 # Parameters for caching to the database
 # ==================================================
-# Limit for connections to the cache database. Heroku's free tier limit is 20.
+# Default backend for the cache. Only "postgres" is shared by workers across
+# machines; see `connections.create_cache_backend` for the others.
+CACHE_BACKEND: Final = "postgres"
+# Default path of the database file for the "sqlite" backend
+SQLITE_PATH: Final = os.path.join(tempfile.gettempdir(), "dilbert-cache.db")
+# Default limit for connections to the cache database, across all workers.
+# Heroku's free tier limit is 20.
 MAX_DB_CONN: Final = 19
-# Timeout (in seconds) for a single database operation
+# Default no. of connections to the cache database that each worker opens on
+# startup, so that the first requests don't wait for new connections. Apart
+# from these, each worker keeps one connection for listening to notifications
+# and for locks shared by all workers.
+DB_WARM_CONN: Final = 3
+# Default timeout (in seconds) for a single database operation
 DB_TIMEOUT: Final = 3
-# Limit (in no. of comics) for the comics cache in the database. Heroku's free
-# tier limit is 10,000 rows in a database with max. size 1GB. Note that apart
-# from this, we have the latest date table, which always has exactly one row.
+# Default limit (in no. of comics) for the comics cache in the database.
+# Heroku's free tier limit is 10,000 rows in a database with max. size 1GB.
+# Note that apart from this, we have the latest date table, which always has
+# exactly one row.
 CACHE_LIMIT: Final = 9900
-# No. of hrs after scraping the latest date when it is to be scraped again
+# The cache is cleaned periodically in the background. If its no. of rows
+# exceeds the high watermark, then the oldest rows are cleared until the low
+# watermark is reached. The gap between the hard limit and the high watermark
+# absorbs the inserts between cleanups. These are the margins of the
+# watermarks below the limit.
+CACHE_HIGH_MARGIN: Final = 100
+CACHE_LOW_MARGIN: Final = 500
+# Max. no. of rows cleared from the cache in one statement
+EVICTION_BATCH_SIZE: Final = 100
+# Interval (in seconds) between checks for excess rows in the cache
+EVICTION_INTERVAL: Final = 60
+# Key for the advisory lock that lets only one worker clean the cache at a time
+EVICTION_LOCK_KEY: Final = 0x6469_6C62  # "dilb" in ASCII
+# Interval (in seconds) between bulk updates of the `last_used` column
+LAST_USED_FLUSH_INTERVAL: Final = 30
+# Key for the advisory lock that lets only one worker prefetch at a time
+PREFETCH_LOCK_KEY: Final = EVICTION_LOCK_KEY + 1
+# Key for the advisory lock that lets only one worker create the schema
+SCHEMA_LOCK_KEY: Final = EVICTION_LOCK_KEY + 2
+# Key for the advisory lock that lets only one worker poll for a new comic at a
+# time
+REFRESH_LOCK_KEY: Final = EVICTION_LOCK_KEY + 3
+# Default no. of hrs after scraping the latest date when it is to be scraped
+# again
 LATEST_DATE_REFRESH: Final = 2
+# Channel for notifying all workers of a new latest date
+LATEST_DATE_CHANNEL: Final = "latest_date"
+# Time (in seconds) for which a stale latest date is kept in memory, while
+# "dilbert.com" is unavailable
+STALE_LATEST_DATE_TTL: Final = 60
+
+# ==================================================
+# Parameters for the in-memory cache
+# ==================================================
+# Max. no. of entries in the in-memory cache of each scraper
+MEM_CACHE_SIZE: Final = 512
+# Time (in seconds) for which an entry in the in-memory cache stays valid
+MEM_CACHE_TTL: Final = 600
+
+# Max. no. of dates without comics that are remembered by each worker, so that
+# requests for them don't scrape "dilbert.com" every time
+NOT_FOUND_CACHE_SIZE: Final = 1024
+# Time (in seconds) for which a date without a comic is remembered. Comics
+# aren't published for past dates, so this is long.
+NOT_FOUND_TTL: Final = 86400
+# Time (in seconds) for which a recent date (i.e. yesterday or later) without a
+# comic is remembered, as its comic may be published soon
+NOT_FOUND_RECENT_TTL: Final = 60
+# Max. no. of dates that "dilbert.com" redirects to other dates, which are
+# remembered by each worker along with the dates they redirect to
+ALIAS_CACHE_SIZE: Final = 1024
+# Time (in seconds) for which a date that redirects to another is remembered
+ALIAS_TTL: Final = 86400
+
+# Default probability with which "/random" picks one of the cached comics,
+# instead of any comic. Cached comics are served without scraping
+# "dilbert.com".
+RANDOM_CACHED_BIAS: Final = 0.8
+# Interval (in seconds) between reloads of the in-memory index of the cached
+# comics, which is used by "/random"
+CACHED_INDEX_INTERVAL: Final = 600
+# Max. no. of random picks for "/random", before settling for the latest comic
+RANDOM_ATTEMPTS: Final = 5
+
+# Max. no. of rendered comic pages in the in-memory page cache
+PAGE_CACHE_SIZE: Final = 256
+# Time (in seconds) for which a rendered page in the page cache stays valid
+PAGE_CACHE_TTL: Final = 3600
+
+# ==================================================
+# Parameters for caching by clients
+# ==================================================
+# Time (in seconds) for which clients may cache the pages of older comics.
+# These pages only change on redeployment.
+PAGE_MAX_AGE: Final = 86400
+# Time (in seconds) for which clients may cache the page of the latest comic,
+# which changes when a new comic is published.
+LATEST_PAGE_MAX_AGE: Final = 300
+
+# ==================================================
+# Parameters for compression and static assets
+# ==================================================
+# Compression levels for rendered pages. Pages are compressed every time they
+# are rendered, so these favour speed over size.
+PAGE_GZIP_LEVEL: Final = 6
+PAGE_BROTLI_QUALITY: Final = 5
+# Compression levels for static assets. These are only compressed once on
+# startup, so these favour size over speed.
+ASSET_GZIP_LEVEL: Final = 9
+ASSET_BROTLI_QUALITY: Final = 11
+# URL prefix for static assets, which are served under names with their
+# content hashes
+ASSET_URL_PREFIX: Final = "/assets"
+# Length of the content hashes in the names of static assets
+ASSET_HASH_LEN: Final = 12
+# Time (in seconds) for which clients may cache static assets. A changed asset
+# gets a new name, so this is a year.
+ASSET_MAX_AGE: Final = 365 * 24 * 60 * 60
+
+# ==================================================
+# Parameters for prefetching comics into the cache
+# ==================================================
+# Max. no. of comics scraped at a time while prefetching. This is kept well
+# below `MAX_FETCH_CONN`, so that requests aren't starved of connections.
+PREFETCH_CONCURRENCY: Final = 5
+# No. of comics inserted into the cache in one go while prefetching
+PREFETCH_BATCH_SIZE: Final = 50
+# Default no. of most recent days whose comics are prefetched on startup. Set
+# this to zero to disable prefetching on startup.
+STARTUP_PREFETCH_DAYS: Final = 0
+# By default, when a comic is viewed, the comics within this many days of it
+# are prefetched in the background, so that navigating to them is fast. Set
+# this to zero to disable prefetching of neighbouring comics.
+NEIGHBOUR_PREFETCH_WINDOW: Final = 0
+# No. of background workers for prefetching neighbouring comics. This bounds
+# the no. of connections to "dilbert.com" used by them.
+NEIGHBOUR_PREFETCH_WORKERS: Final = 2
+# Max. no. of neighbouring comics queued for prefetching. More are dropped.
+NEIGHBOUR_PREFETCH_QUEUE: Final = 32
+
+# ==================================================
+# Parameters for polling for a newly published comic
+# ==================================================
+# Time of day (in UTC) from which "dilbert.com" is polled for a new comic. New
+# comics are dated as per US time zones, so they are published a few hours
+# after midnight in UTC.
+PUBLISH_WINDOW_START: Final = time(0, 0)
+# Duration (in hrs) of the window for polling, after its start
+PUBLISH_WINDOW_HOURS: Final = 8
+# Interval (in seconds) between polls within the window, until the new comic
+# is found
+PUBLISH_POLL_INTERVAL: Final = 120
+
+# ==================================================
+# Parameters for the batch API
+# ==================================================
+# No. of days whose comics are retrieved in one go for a request to the batch
+# API. This bounds the memory used by a request for a long range of dates.
+API_CHUNK_DAYS: Final = 100
+# Max. no. of uncached comics scraped at a time for a request to the batch API
+API_CONCURRENCY: Final = 4
+# Max. no. of uncached comics scraped for a single request to the batch API.
+# The response ends before the first comic over this limit, and tells the
+# client to request the rest separately. This bounds the scraping that a
+# single request can cause.
+API_MAX_SCRAPES: Final = 200
+
+# ==================================================
+# Parameters for proxying comic images
+# ==================================================
+# Default for whether comic images are served through this app (with an on-disk
+# cache), instead of being fetched by browsers directly from the upstream CDN
+IMG_PROXY: Final = False
+# Directory for the on-disk cache of comic images
+IMG_CACHE_DIR: Final = os.path.join(tempfile.gettempdir(), "dilbert-images")
+# Max. total size (in bytes) of the on-disk cache of comic images
+IMG_CACHE_SIZE: Final = 256 * 1024 * 1024
+# Size (in bytes) of the chunks in which comic images are downloaded
+IMG_CHUNK_SIZE: Final = 64 * 1024
+# Max. time (in seconds) for downloading a single comic image. Failed downloads
+# open a circuit breaker separate from that for "dilbert.com", so that the
+# clients are redirected to the upstream image right away.
+IMG_FETCH_TIMEOUT: Final = 10
+# No. of threads for the file operations of the on-disk cache of comic images,
+# so that they don't block the event loop
+IMG_IO_THREADS: Final = 4
+# Time (in seconds) for which clients may cache comic images. The image for a
+# comic never changes, so this is a year.
+IMG_MAX_AGE: Final = 365 * 24 * 60 * 60
+
+# ==================================================
+# Parameters for metrics
+# ==================================================
+# Upper bounds (in seconds) of the buckets of the histograms for durations
+LATENCY_BUCKETS: Final = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+# ==================================================
+# Parameters for profiling
+# ==================================================
+# Time (in seconds) between stack samples while profiling
+PROFILE_INTERVAL: Final = 0.01
+# Default time (in seconds) after which profiling stops on its own
+PROFILE_DURATION: Final = 300
+# Max. no. of recent stack samples kept for attributing them to slow requests.
+# This is a minute of samples.
+PROFILE_MAX_SAMPLES: Final = 6000
+# Max. no. of recent slow requests kept along with their traces
+PROFILE_MAX_SLOW_REQUESTS: Final = 50
+# Default duration (in seconds) above which a request is considered slow
+SLOW_REQUEST_THRESHOLD: Final = 1
 
 # ==================================================
 # Miscellaneous
@@ -0,0 +1,241 @@
+"""Statements for the cache database, bound to each connection."""
+from collections.abc import AsyncIterator, Iterable, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, fields
+from time import perf_counter
+from typing import Any, Optional
+
+from asyncpg import Connection, Record
+from asyncpg.pool import Pool
+
+from metrics import DB_POOL_WAIT_SECONDS
+from profiling import span
+
+# The queries for all the statements, keyed by the statement's name
+_QUERIES = {
+    # ==================================================
+    # Comics cache
+    # ==================================================
+    # The other columns in the table are: `comic`, `last_used`. `comic` is not
+    # required here, as the date is already given.
+    "get_comic": "SELECT img_url, title FROM comic_cache WHERE comic = $1;",
+    # If the comic is already cached (e.g. by another worker in parallel), then
+    # its data is refreshed and it is marked as used.
+    "upsert_comic": """INSERT INTO comic_cache (comic, img_url, title)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (comic) DO UPDATE
+        SET img_url = EXCLUDED.img_url, title = EXCLUDED.title,
+            last_used = DEFAULT;""",
+    # This is for bulk inserts (e.g. by the batch API), which are marked as
+    # used long ago, so that they are evicted before the comics that are being
+    # viewed.
+    "insert_comic_if_missing": """INSERT INTO comic_cache
+        (comic, img_url, title, last_used) VALUES ($1, $2, $3, 'epoch')
+        ON CONFLICT (comic) DO NOTHING;""",
+    # This is for prefetched comics, which are likely to be viewed. They are
+    # marked as used at the start of the day, with older comics slightly
+    # earlier (by a millisecond per day), so that these are evicted first.
+    # This doesn't depend on when each batch is inserted, so the order holds
+    # across batches.
+    "insert_used_comic_if_missing": """INSERT INTO comic_cache
+        (comic, img_url, title, last_used) VALUES (
+            $1, $2, $3,
+            CURRENT_DATE::timestamp
+                - (CURRENT_DATE - $1::date) * INTERVAL '1 millisecond'
+        )
+        ON CONFLICT (comic) DO NOTHING;""",
+    "touch_comics": """UPDATE comic_cache SET last_used = DEFAULT
+        WHERE comic = ANY($1::date[]);""",
+    "find_cached_comics": """SELECT comic FROM comic_cache
+        WHERE comic = ANY($1::date[]);""",
+    # This is a range scan on the primary key
+    "get_comics_between": """SELECT comic, img_url, title FROM comic_cache
+        WHERE comic BETWEEN $1 AND $2 ORDER BY comic;""",
+    "get_cached_dates": "SELECT comic FROM comic_cache;",
+    "count_comics": "SELECT count(*) FROM comic_cache;",
+    "evict_oldest_comics": """DELETE FROM comic_cache
+        WHERE ctid in
+        (SELECT ctid FROM comic_cache ORDER BY last_used LIMIT $1);""",
+    # ==================================================
+    # Latest date cache
+    # ==================================================
+    # The interval for "freshness" of the entry has to be given this way
+    # instead of '$1 hours', because of PostgreSQL's syntax. All dates managed
+    # by asyncpg are set to UTC. Along with the date, this gives the time (in
+    # seconds) for which the entry stays "fresh".
+    "get_latest": """SELECT latest, EXTRACT(
+            EPOCH FROM last_check + INTERVAL '1 hour' * $1 - CURRENT_TIMESTAMP
+        )
+        FROM latest_date
+        WHERE last_check >= CURRENT_TIMESTAMP - INTERVAL '1 hour' * $1;""",
+    # This ignores "freshness", for when "dilbert.com" is unavailable
+    "get_stale_latest": "SELECT latest FROM latest_date;",
+    # This updates the only row in the `latest_date` table (hence no WHERE
+    # condition), or inserts it if the table is empty. It also notifies all
+    # workers of the new date, and gives the no. of rows updated, which is only
+    # more than one if the table is corrupt. All this is done in one statement
+    # to need only one round trip. The conflict can only happen if the table
+    # was empty and another worker inserted a date in parallel. It is detected
+    # on the single row index, as the other worker may have inserted a
+    # different date.
+    "upsert_latest": """WITH updated AS (
+            UPDATE latest_date SET latest = $1, last_check = DEFAULT
+            RETURNING latest
+        ), inserted AS (
+            INSERT INTO latest_date (latest)
+            SELECT $1 WHERE NOT EXISTS (SELECT FROM updated)
+            ON CONFLICT ((1)) DO UPDATE
+            SET latest = EXCLUDED.latest, last_check = DEFAULT
+        )
+        SELECT (SELECT count(*) FROM updated), pg_notify($2, $3);""",
+    # ==================================================
+    # Coordination between workers
+    # ==================================================
+    "notify": "SELECT pg_notify($1, $2);",
+    "try_lock": "SELECT pg_try_advisory_lock($1);",
+    "unlock": "SELECT pg_advisory_unlock($1);",
+}
+
+
+class Statement:
+    """A statement on the cache database, bound to a connection.
+
+    This only pairs the query with the connection, so that all queries are
+    named in one place. The query is run like any other, i.e. through
+    asyncpg's statement cache for the connection. asyncpg's
+    `PreparedStatement` objects aren't kept, as they are invalidated whenever
+    their connection is released to the pool.
+
+    Attributes:
+        query: The query of the statement
+    """
+
+    def __init__(self, conn: Connection, query: str):
+        """Bind the query to the connection.
+
+        Args:
+            conn: The database connection
+            query: The query of the statement
+        """
+        self._conn = conn
+        self.query = query
+
+    async def fetch(self, *args: Any) -> list[Record]:
+        """Run the statement, and get all its rows."""
+        return await self._conn.fetch(self.query, *args)
+
+    async def fetchrow(self, *args: Any) -> Optional[Record]:
+        """Run the statement, and get its first row."""
+        return await self._conn.fetchrow(self.query, *args)
+
+    async def fetchval(self, *args: Any) -> Any:
+        """Run the statement, and get the first value of its first row."""
+        return await self._conn.fetchval(self.query, *args)
+
+    async def execute(self, *args: Any) -> str:
+        """Run the statement, and get its status, e.g. "DELETE 10"."""
+        return await self._conn.execute(self.query, *args)
+
+    async def executemany(self, args: Iterable[Sequence[Any]]) -> None:
+        """Run the statement once for each set of arguments."""
+        await self._conn.executemany(self.query, args)
+
+
+@dataclass(frozen=True)
+class Statements:
+    """All statements used on the cache database, bound to a connection.
+
+    Each attribute is the statement of the same name in `_QUERIES`.
+    """
+
+    get_comic: Statement
+    upsert_comic: Statement
+    insert_comic_if_missing: Statement
+    insert_used_comic_if_missing: Statement
+    touch_comics: Statement
+    find_cached_comics: Statement
+    get_comics_between: Statement
+    get_cached_dates: Statement
+    count_comics: Statement
+    evict_oldest_comics: Statement
+    get_latest: Statement
+    get_stale_latest: Statement
+    upsert_latest: Statement
+    notify: Statement
+    try_lock: Statement
+    unlock: Statement
+
+    @classmethod
+    def bind(cls, conn: Connection) -> "Statements":
+        """Bind all statements to the given connection.
+
+        Args:
+            conn: The database connection
+
+        Returns:
+            The bound statements
+        """
+        return cls(
+            **{
+                field.name: Statement(conn, _QUERIES[field.name])
+                for field in fields(cls)
+            }
+        )
+
+
+class CacheConnection(Connection):
+    """Connection to the cache database, with all statements bound to it.
+
+    Attributes:
+        stmts: The statements on this connection
+    """
+
+    stmts: Statements
+
+
+async def init_connection(conn: CacheConnection) -> None:
+    """Bind all statements to a new connection.
+
+    This is meant to be the `init` callback of the connection pool, so that
+    the statements are available on every connection as `conn.stmts`.
+
+    Args:
+        conn: The new database connection
+    """
+    conn.stmts = Statements.bind(conn)
+
+
+@asynccontextmanager
+async def acquire(pool: Pool) -> AsyncIterator[CacheConnection]:
+    """Acquire a connection from the pool, and release it afterwards.
+
+    This is the same as `pool.acquire()`, except that it records the time
+    spent waiting for a free connection, for the metrics and the profiler.
+
+    Args:
+        pool: The database connection pool
+
+    Yields:
+        The acquired database connection
+    """
+    start = perf_counter()
+    with span("db.acquire"):
+        conn = await pool.acquire()
+    DB_POOL_WAIT_SECONDS.observe(perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def rows_affected(status: str) -> int:
+    """Get the no. of rows affected by a statement from its status.
+
+    Args:
+        status: The status of the statement, as given by `Statement.execute`
+
+    Returns:
+        The no. of rows affected
+    """
+    # The status is of the form "UPDATE 1", "DELETE 10", "INSERT 0 1", etc.
+    return int(status.split()[-1])
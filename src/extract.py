@@ -0,0 +1,124 @@
+"""Incremental extraction of comic data from a comic's page."""
+import re
+from html import unescape
+from typing import Optional
+
+from scraper import ScrapingException
+
+# The patterns work on the raw bytes of the page, so that the page needn't be
+# decoded. Only the matched data is decoded.
+_TITLE_PATTERN = re.compile(rb'<span class="comic-title-name">([^<]+)</span>')
+_DATE_PATTERN = re.compile(
+    rb'<date class="comic-title-date" item[pP]rop="datePublished">[^<]*'
+    rb'<span>([^<]*)</span>[^<]*<span item[pP]rop="copyrightYear">'
+    rb"([^<]+)</span>"
+)
+_IMG_PATTERN = re.compile(rb'<img[^>]*class="img-[^>]*src="([^"]+)"[^>]*>')
+
+# Upper bound on the length of a match of any of the above patterns. This much
+# of the previous content is searched along with every new chunk, so that
+# matches split across chunks are found.
+_MAX_MATCH_LEN = 2048
+
+
+class ComicPageParser:
+    """Parser for the data of a comic from its page on "dilbert.com".
+
+    The page is fed in chunks of raw bytes as they arrive, and each chunk is
+    searched only for the data not found yet. Once all the data is found, the
+    rest of the page needn't be read.
+
+    Attributes:
+        encoding: The character encoding of the page
+        title: The title of the comic, if found
+        date_str: The date of the comic as displayed on "dilbert.com", if
+            found
+        img_url: The URL to the comic image, if found
+    """
+
+    def __init__(self, encoding: str = "utf-8"):
+        """Initialize the parser with no content.
+
+        Args:
+            encoding: The character encoding of the page
+        """
+        self.encoding = encoding
+        self.title: Optional[str] = None
+        self.date_str: Optional[str] = None
+        self.img_url: Optional[str] = None
+        # Whether the page has been found to have no title
+        self._untitled = False
+        # The end of the content fed so far. This is searched again along with
+        # the next chunk, for matches that are split across chunks.
+        self._tail = b""
+
+    @property
+    def done(self) -> bool:
+        """Return whether all the data has been found."""
+        return (
+            (self.title is not None or self._untitled)
+            and self.date_str is not None
+            and self.img_url is not None
+        )
+
+    def _decode(self, data: bytes) -> str:
+        """Decode the matched data."""
+        return data.decode(self.encoding, errors="replace")
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the next chunk of the page.
+
+        Only a bounded part of the content fed so far is kept in memory.
+
+        Args:
+            chunk: The next chunk of the page
+        """
+        content = self._tail + chunk
+
+        if self.title is None:
+            match = _TITLE_PATTERN.search(content)
+            if match is not None:
+                self.title = unescape(self._decode(match[1]))
+
+        if self.date_str is None:
+            match = _DATE_PATTERN.search(content)
+            if match is not None:
+                self.date_str = " ".join(map(self._decode, match.groups()))
+
+        if self.img_url is None:
+            match = _IMG_PATTERN.search(content)
+            if match is not None:
+                self.img_url = self._decode(match[1])
+
+        # Some comics don't have a title. The title comes before the image on
+        # the page, so if it wasn't found by the time the date and the image
+        # are, the comic has no title.
+        if (
+            self.title is None
+            and self.date_str is not None
+            and self.img_url is not None
+        ):
+            self._untitled = True
+
+        self._tail = content[-_MAX_MATCH_LEN:]
+
+    def result(self) -> dict[str, str]:
+        """Get the comic data after the page has been fed.
+
+        Returns:
+            A dict with the keys "title", "dateStr" and "imgURL"
+
+        Raises:
+            ScrapingException: If the date or the image URL wasn't found
+        """
+        if self.date_str is None:
+            raise ScrapingException("Error in scraping the date string")
+        if self.img_url is None:
+            raise ScrapingException("Error in scraping the image's URL")
+
+        return {
+            # Some comics don't have a title. This is mostly for older comics.
+            "title": "" if self.title is None else self.title,
+            "dateStr": self.date_str,
+            "imgURL": self.img_url,
+        }
@@ -0,0 +1,354 @@
+"""Proxying of comic images, with an on-disk cache for them."""
+import asyncio
+import glob
+import mimetypes
+import os
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from logging import Logger
+from tempfile import NamedTemporaryFile
+from typing import IO, Any, NamedTuple, Optional, TypeVar
+
+from aiohttp import ClientSession, ClientTimeout
+from quart import Response, send_file
+
+from breaker import CircuitBreaker
+from constants import (
+    IMG_CHUNK_SIZE,
+    IMG_FETCH_TIMEOUT,
+    IMG_IO_THREADS,
+    IMG_MAX_AGE,
+)
+from pages import is_not_modified
+from utils import date_to_str
+
+Result = TypeVar("Result")
+
+
+class CachedImage(NamedTuple):
+    """A comic image stored in the on-disk cache."""
+
+    path: str
+    mimetype: str
+    size: int
+
+    @property
+    def etag(self) -> str:
+        """Get the entity tag for this image.
+
+        The image for a comic never changes, so its file name (which contains
+        the comic's date) is enough to identify it. This keeps the entity tag
+        the same across workers and restarts.
+        """
+        return os.path.basename(self.path)
+
+
+class ImageCache:
+    """An on-disk cache of comic images, with LRU eviction.
+
+    Images are stored as files named after the date of their comic, so the
+    cache survives restarts and can be shared by all workers. The index of
+    the cached images is kept in memory, ordered by recency of use. When the
+    total size exceeds the limit, the least recently used images are deleted.
+
+    All file operations after startup are run on a thread pool, so that a slow
+    disk doesn't block the event loop.
+
+    Attributes:
+        directory: The directory in which the images are stored
+        max_size: The max. total size (in bytes) of the stored images
+        sess: The aiohttp session for fetching images
+        logger: The logger for all methods
+        timeout: The max. time (in seconds) for downloading a single image
+        breaker: The circuit breaker for downloading images
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int,
+        sess: ClientSession,
+        logger: Logger,
+        *,
+        timeout: float = IMG_FETCH_TIMEOUT,
+    ):
+        """Store the parameters.
+
+        Args:
+            directory: The directory in which the images are stored
+            max_size: The max. total size (in bytes) of the stored images
+            sess: The aiohttp session for fetching images
+            logger: The logger for all methods
+            timeout: The max. time (in seconds) for downloading a single image
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.sess = sess
+        self.logger = logger
+        self.timeout = timeout
+        # The image CDN is separate from "dilbert.com", so it gets its own
+        # circuit. The budget is slightly longer than the timeout, so that a
+        # timed out download is cleaned up by aiohttp first.
+        self.breaker = CircuitBreaker(
+            logger, upstream="the image CDN", budget=timeout + 1
+        )
+
+        self._index: OrderedDict[date, CachedImage] = OrderedDict()
+        self._total_size = 0
+        self._in_flight: dict[date, asyncio.Task] = {}
+        self._executor = ThreadPoolExecutor(
+            IMG_IO_THREADS, thread_name_prefix="images"
+        )
+
+    async def _run(self, func: Callable[..., Result], *args: Any) -> Result:
+        """Run the blocking function on the thread pool for files."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def start(self) -> None:
+        """Create the cache directory, and index the images already in it.
+
+        The existing images are ordered by their modification times, which are
+        updated on every use.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name = os.path.splitext(entry.name)[0]
+                mimetype = mimetypes.guess_type(entry.name)[0]
+                if not entry.is_file() or mimetype is None:
+                    # Skip leftover temporary files and anything unrelated
+                    continue
+                try:
+                    comic_date = date.fromisoformat(name)
+                except ValueError:
+                    continue
+                stat = entry.stat()
+                image = CachedImage(entry.path, mimetype, stat.st_size)
+                entries.append((stat.st_mtime, comic_date, image))
+
+        for _, comic_date, image in sorted(entries, key=lambda e: e[0]):
+            self._add(comic_date, image)
+
+        self.logger.info(
+            f"Found {len(self._index)} cached images ({self._total_size} "
+            "bytes) on disk"
+        )
+        # This runs on startup, so it's fine for this to block.
+        _remove_files(self._pop_excess())
+
+    async def close(self) -> None:
+        """Cancel any pending downloads, and stop the file operations."""
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._executor.shutdown()
+
+    def _add(self, comic_date: date, image: CachedImage) -> None:
+        """Add the image to the index as the most recently used one."""
+        old = self._index.pop(comic_date, None)
+        if old is not None:
+            self._total_size -= old.size
+        self._index[comic_date] = image
+        self._total_size += image.size
+
+    def _pop_excess(self) -> list[str]:
+        """Remove the least recently used images from the index until it fits.
+
+        Returns:
+            The paths of the removed images, which are to be deleted
+        """
+        paths = []
+        while self._total_size > self.max_size and len(self._index) > 1:
+            _, image = self._index.popitem(last=False)
+            self._total_size -= image.size
+            paths.append(image.path)
+        return paths
+
+    async def _evict(self) -> None:
+        """Delete the least recently used images until the cache fits."""
+        paths = self._pop_excess()
+        if paths:
+            await self._run(_remove_files, paths)
+
+    async def _find_on_disk(self, comic_date: date) -> Optional[CachedImage]:
+        """Find the image if it was stored by another worker, and index it."""
+        pattern = os.path.join(self.directory, date_to_str(comic_date) + ".*")
+        image = await self._run(_find_image, pattern)
+        if image is not None:
+            self._add(comic_date, image)
+            await self._evict()
+        return image
+
+    async def _lookup(self, comic_date: date) -> Optional[CachedImage]:
+        """Get the image from the cache, if it's still on disk."""
+        image = self._index.get(comic_date)
+        if image is None:
+            # The cache directory is shared by all workers
+            return await self._find_on_disk(comic_date)
+
+        self._index.move_to_end(comic_date)
+        try:
+            # Mark it as used for the other workers (and for restarts) too
+            await self._run(os.utime, image.path)
+        except FileNotFoundError:
+            # Another worker has evicted it, so it has to be fetched again.
+            # This is only removed if it wasn't replaced in the meantime.
+            if self._index.get(comic_date) is image:
+                del self._index[comic_date]
+                self._total_size -= image.size
+            return None
+
+        return image
+
+    async def _download(self, comic_date: date, url: str) -> CachedImage:
+        """Stream the image from the given URL into the cache.
+
+        The image is first written to a temporary file, which is then renamed.
+        Thus, a partially written image is never served.
+        """
+        timeout = ClientTimeout(total=self.timeout)
+        async with self.sess.get(url, timeout=timeout) as resp:
+            if resp.status >= 500:
+                # Only these count as failures for the circuit breaker
+                resp.raise_for_status()
+            elif resp.status != 200:
+                raise ValueError(f"Unexpected status: {resp.status}")
+            mimetype = resp.content_type
+            ext = mimetypes.guess_extension(mimetype)
+            if not mimetype.startswith("image/") or ext is None:
+                raise ValueError(f"Unexpected content type: {mimetype}")
+
+            tmp = await self._run(
+                partial(
+                    NamedTemporaryFile,
+                    dir=self.directory,
+                    suffix=".part",
+                    delete=False,
+                )
+            )
+            try:
+                async for chunk in resp.content.iter_chunked(IMG_CHUNK_SIZE):
+                    await self._run(tmp.write, chunk)
+                await self._run(tmp.close)
+            except BaseException:
+                await self._run(_discard_file, tmp)
+                raise
+
+        path = os.path.join(self.directory, date_to_str(comic_date) + ext)
+        size = await self._run(_rename, tmp.name, path)
+        self.logger.info(f"Cached image for {comic_date} ({size} bytes)")
+
+        image = CachedImage(path, mimetype, size)
+        self._add(comic_date, image)
+        await self._evict()
+        return image
+
+    def _end_flight(self, comic_date: date, task: asyncio.Task) -> None:
+        """Remove the finished download from the in-flight downloads."""
+        del self._in_flight[comic_date]
+        if not task.cancelled():
+            task.exception()
+
+    async def get_image(self, comic_date: date, url: str) -> CachedImage:
+        """Get the image for the comic, downloading it if it's not cached.
+
+        Concurrent calls for the same comic share a single download.
+
+        Args:
+            comic_date: The date of the comic
+            url: The upstream URL of the comic's image
+
+        Returns:
+            The cached image
+
+        Raises:
+            UpstreamUnavailableError: If the image CDN failed to respond in
+                time, or if its circuit is open
+        """
+        image = await self._lookup(comic_date)
+        if image is not None:
+            return image
+
+        task = self._in_flight.get(comic_date)
+        if task is None:
+            task = asyncio.create_task(
+                self.breaker.run(self._download(comic_date, url))
+            )
+            self._in_flight[comic_date] = task
+            task.add_done_callback(partial(self._end_flight, comic_date))
+
+        # Shield the download, so that a client disconnecting doesn't cancel
+        # it for the other clients.
+        return await asyncio.shield(task)
+
+
+def _remove_files(paths: list[str]) -> None:
+    """Delete the files, ignoring those that are already deleted."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker has already evicted it
+            pass
+
+
+def _find_image(pattern: str) -> Optional[CachedImage]:
+    """Find the first image matching the glob pattern, if any."""
+    for path in glob.glob(pattern):
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype is None:
+            continue
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            # Another worker has evicted it in the meantime
+            continue
+        return CachedImage(path, mimetype, size)
+    return None
+
+
+def _discard_file(file: IO[bytes]) -> None:
+    """Close and delete a partially written file."""
+    file.close()
+    os.remove(file.name)
+
+
+def _rename(src: str, dest: str) -> int:
+    """Rename the file, replacing any existing file, and get its size."""
+    os.replace(src, dest)
+    return os.path.getsize(dest)
+
+
+async def image_response(image: CachedImage) -> Response:
+    """Create a response for the image, honouring conditional requests.
+
+    The image for a comic never changes, so clients may cache it for long.
+
+    Args:
+        image: The cached image
+
+    Returns:
+        The response with the image, or "304 Not Modified" if the client's
+        copy is up-to-date
+    """
+    if is_not_modified(image.etag, None):
+        response = Response("", status=304)
+    else:
+        # Quart streams the file from disk, so it's never fully read into
+        # memory.
+        response = await send_file(
+            image.path, mimetype=image.mimetype, add_etags=False
+        )
+
+    response.set_etag(image.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMG_MAX_AGE
+    response.cache_control.immutable = True
+    return response
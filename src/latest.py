@@ -1,108 +1,194 @@
 """Scraper to get info on the latest Dilbert comic."""
-from datetime import timedelta
+import asyncio
+from datetime import date, timedelta
+from logging import Logger
 from typing import Optional
 
-from constants import LATEST_DATE_REFRESH, SRC_PREFIX
+from aiohttp import ClientSession
+
+from breaker import UpstreamUnavailableError
+from cache_backend import CacheBackend
+from constants import LATEST_DATE_REFRESH, SRC_PREFIX, STALE_LATEST_DATE_TTL
 from scraper import Scraper, ScrapingException
 from utils import curr_date, date_to_str, str_to_date
 
 
-class LatestDateScraper(Scraper[str, None]):
+class LatestDateScraper(Scraper[date, None]):
     """Class to scrape the date of the latest Dilbert comic.
 
-    This scraper returns that date in the format used by "dilbert.com".
+    This scraper returns that date as a `datetime.date` object.
+
+    The latest date is kept in memory until its cached entry becomes stale.
+    Whenever a worker caches a new latest date, the backend notifies all
+    workers (if it can), so that they update their in-memory copies without
+    polling the backend.
+
+    While "dilbert.com" is unavailable, the cached latest date is served even
+    if it is stale, and it is refreshed in the background once "dilbert.com"
+    is available again.
 
     Attributes:
-        pool: The database connection pool
+        backend: The backend of the cache
         sess: The HTTP client session
         logger: The main app logger
+        mem_cache: The in-memory cache in front of the backend
     """
 
-    async def _get_cached_data(self, _: None = None, /) -> Optional[str]:
-        """Get the cached latest date from the database.
+    def __init__(
+        self,
+        backend: CacheBackend,
+        sess: ClientSession,
+        logger: Logger,
+        *,
+        refresh_hours: float = LATEST_DATE_REFRESH,
+        **kwargs,
+    ):
+        """Store the required objects.
+
+        Args:
+            backend: The backend of the cache
+            sess: The HTTP client session
+            logger: The main app logger
+            refresh_hours: The no. of hrs after scraping the latest date when
+                it is to be scraped again
+            **kwargs: Options for the in-memory cache, as given to `Scraper`
+        """
+        super().__init__(backend, sess, logger, **kwargs)
+        self._refresh_hours = refresh_hours
+        # The time (in seconds) for which a newly cached entry stays "fresh"
+        self._refresh_secs = refresh_hours * 60 * 60
+        # The time (in seconds) for which the last retrieved entry stays
+        # "fresh"; used for expiring it from the in-memory cache
+        self._fresh_for = self._refresh_secs
+        # The background refresh of a stale latest date, if any
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start listening for new latest dates cached by any worker."""
+        await self.backend.listen_latest(self._on_new_latest)
+
+    async def close(self) -> None:
+        """Stop listening for new latest dates, and any background refresh."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+        await self.backend.unlisten_latest(self._on_new_latest)
+
+    def _on_new_latest(self, latest: date) -> None:
+        """Store the new latest date cached by a worker in memory."""
+        self.logger.info(f"Notified of new latest date: {latest}")
+        self.mem_cache.put(None, latest, self._refresh_secs)
+
+    def _mem_cache_ttl(self, _: None, data: date, /) -> float:
+        """Keep the latest date in memory only while it is "fresh"."""
+        return self._fresh_for
+
+    async def _get_cached_data(self, _: None = None, /) -> Optional[date]:
+        """Get the cached latest date from the backend.
 
         If the latest date entry is stale (i.e. it was updated a long time
         back), or it wasn't found in the cache, None is returned.
         """
-        async with self.pool.acquire() as conn:
-            # The interval for "freshness" of the entry has to be given this
-            # way instead of '$1 hours', because of PostgreSQL's syntax.
-            # All dates managed by asyncpg are set to UTC.
-            date = await conn.fetchval(
-                """SELECT latest FROM latest_date
-                WHERE last_check >= CURRENT_TIMESTAMP - INTERVAL '1 hour' * $1;
-                """,
-                LATEST_DATE_REFRESH,
-            )
-
-        if date is not None:
-            # A "fresh" entry was found
-            date = date_to_str(date)
+        row = await self.backend.get_latest(self._refresh_hours)
+        if row is None:
+            # No "fresh" entry was found
+            return None
 
-        return date
+        latest, self._fresh_for = row
+        return latest
 
-    async def _cache_data(self, date: str, _: None = None, /) -> None:
-        """Cache the latest date into the database."""
-        # The WHERE condition is not required as there is always only one row
-        # in the `latest_date` table.
-        async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE latest_date SET latest = $1;", str_to_date(date)
-            )
+    async def _fallback_data(
+        self, _: None, error: UpstreamUnavailableError, /
+    ) -> Optional[date]:
+        """Get the cached latest date, even if it is stale.
 
-        rows_updated = int(result.split()[1])
-        if rows_updated == 1:
-            self.logger.info("Successfully updated latest date in cache")
+        This is kept in memory only briefly, and a refresh is started in the
+        background.
+        """
+        try:
+            latest = await self.backend.get_stale_latest()
+        except Exception:
+            # The original error is more relevant to the caller
+            self.logger.exception("Retrieving stale latest date failed")
+            return None
+
+        if latest is None:
+            return None
+
+        self.mem_cache.put(None, latest, STALE_LATEST_DATE_TTL)
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh())
+        return latest
+
+    async def _refresh(self) -> None:
+        """Scrape the latest date once "dilbert.com" is available again."""
+        while True:
+            # Scrapes fail immediately while the circuit is open, so wait till
+            # the next trial is allowed.
+            await asyncio.sleep(max(self.breaker.retry_after, 1.0))
+            try:
+                latest = await self.scrape_latest_date()
+                await self.update_latest_date(latest)
+            except UpstreamUnavailableError:
+                continue
+            except Exception:
+                # A later request with the stale date will start another
+                # refresh, so simply log the error with the traceback.
+                self.logger.exception("Refreshing stale latest date failed")
+            else:
+                self.logger.info(f"Refreshed stale latest date to: {latest}")
             return
-        elif rows_updated > 1:
+
+    async def _cache_data(self, date: date, _: None = None, /) -> None:
+        """Cache the latest date into the backend, and notify all workers."""
+        rows_updated = await self.backend.upsert_latest(date)
+
+        if rows_updated > 1:
             raise RuntimeError(
                 'The "latest_date" table has more than one row, '
                 "i.e. this table is corrupt"
             )
+        elif rows_updated == 1:
+            self.logger.info("Successfully updated latest date in cache")
+        else:
+            # No rows were updated, so the "latest_date" table must have been
+            # empty. This should only happen if this table was cleared
+            # manually, or this is the first run of this code on this database.
+            self.logger.info("Inserted latest date into empty cache")
 
-        # No rows were updated, so the "latest_date" table must be empty. This
-        # should only happen if this table was cleared manually, or this is the
-        # first run of this code on this database.
-        self.logger.info(
-            "Couldn't update latest date in cache; trying to insert it"
-        )
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO latest_date (latest) VALUES ($1);",
-                str_to_date(date),
-            )
-
-    async def _scrape_data(self, _: None = None, /) -> str:
+    async def _scrape_data(self, _: None = None, /) -> date:
         """Scrape the date of the latest comic from "dilbert.com"."""
         # If there is no comic for this date yet, "dilbert.com" will
         # auto-redirect to the homepage.
-        latest = date_to_str(curr_date())
-        url = SRC_PREFIX + latest
+        today = curr_date()
+        url = SRC_PREFIX + date_to_str(today)
 
         async with self.sess.get(url) as resp:
             self.logger.debug(f"Got response for latest date: {resp.status}")
-            date = resp.url.path.split("/")[-1]
+            date_str = resp.url.path.split("/")[-1]
 
-        if date == "":
+        if date_str == "":
             # Redirected to homepage, implying that there's no comic for this
             # date. There must be a comic for the previous date, so use that.
-            date = date_to_str(curr_date() - timedelta(days=1))
+            latest = today - timedelta(days=1)
             self.logger.info(
-                f"No comic found for today ({latest}); using date: {date}"
+                f"No comic found for today ({today}); using date: {latest}"
             )
         else:
             # Check to see if the scraped date is invalid
             try:
-                str_to_date(date)
+                latest = str_to_date(date_str)
             except ValueError:
                 raise ScrapingException(
                     "Error in scraping the latest date from the URL"
                 )
 
-        return date
+        self._fresh_for = self._refresh_secs
+        return latest
 
-    async def get_latest_date(self) -> str:
+    async def get_latest_date(self) -> date:
         """Retrieve the date of the latest comic.
 
         Returns:
@@ -110,6 +196,23 @@ class LatestDateScraper(Scraper[str, None]):
         """
         return await super().get_data(None)
 
-    async def update_latest_date(self, date: str) -> None:
+    async def scrape_latest_date(self) -> date:
+        """Scrape the date of the latest comic, bypassing all caches.
+
+        This is meant for background jobs, which cache the date themselves.
+
+        Returns:
+            The latest date
+
+        Raises:
+            UpstreamUnavailableError: If "dilbert.com" is too slow or
+                unreachable
+        """
+        return await self.breaker.run(self._scrape_data())
+
+    async def update_latest_date(self, date: date) -> None:
         """Update the latest date in the cache."""
+        # Update the in-memory cache first, so that this worker immediately
+        # stops serving the older date.
+        self.mem_cache.put(None, date, self._refresh_secs)
         await self._cache_data(date)
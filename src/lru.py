@@ -0,0 +1,102 @@
+"""Bounded in-memory cache with LRU and TTL eviction."""
+from collections import OrderedDict
+from collections.abc import Hashable
+from time import monotonic
+from typing import Generic, Optional, TypeVar
+
+Key = TypeVar("Key", bound=Hashable)
+Value = TypeVar("Value")
+
+
+class LRUCache(Generic[Key, Value]):
+    """In-memory cache that evicts the least recently used entries.
+
+    Entries also expire after a time-to-live (TTL), so that data that may
+    change in the database or on "dilbert.com" isn't served forever.
+
+    Attributes:
+        max_size: The max. no. of entries kept in the cache
+        ttl: The default time (in seconds) for which an entry stays valid
+        hits: The no. of lookups that found a valid entry
+        misses: The no. of lookups that didn't find a valid entry
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """Initialize an empty cache.
+
+        Args:
+            max_size: The max. no. of entries kept in the cache. If this is
+                not positive, then nothing is ever cached.
+            ttl: The time (in seconds) for which an entry stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Each value is stored along with its expiry time. The order of the
+        # keys is the order of their usage, with the most recent one last.
+        self._entries: OrderedDict[Key, tuple[float, Value]] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the no. of entries in the cache, including expired ones."""
+        return len(self._entries)
+
+    def __contains__(self, key: Key) -> bool:
+        """Check if the key has a valid entry, without counting a lookup."""
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > monotonic()
+
+    def get(self, key: Key) -> Optional[Value]:
+        """Get the value for the given key, if it is cached and still valid.
+
+        Args:
+            key: The key for the requested value
+
+        Returns:
+            The cached value, if found, else None
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            expiry, value = entry
+            if expiry > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            # Expired entries are removed lazily, i.e. only when accessed.
+            del self._entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: Key, value: Value, ttl: Optional[float] = None) -> None:
+        """Cache the value for the given key.
+
+        If the cache is full, then the least recently used entry is evicted.
+
+        Args:
+            key: The key for the value
+            value: The value to be cached
+            ttl: The time (in seconds) for which this entry stays valid. If
+                None, then the cache's TTL is used.
+        """
+        if self.max_size <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.ttl
+        self._entries[key] = (monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Key) -> None:
+        """Remove the entry for the given key, if it exists."""
+        self._entries.pop(key, None)
+
+    @property
+    def hit_ratio(self) -> float:
+        """Return the fraction of lookups that found a valid entry."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
@@ -1,59 +1,100 @@
 """The main file for the viewer app."""
 import asyncio
-import os
-import random
-import ssl
-from datetime import timedelta
-from typing import Union
-
-import aiohttp
-import asyncpg
-from quart import Quart, Response, redirect, render_template
-from werkzeug.exceptions import NotFound
-
-from comics import ComicScraper
+import hmac
+import json
+import math
+from collections.abc import AsyncIterator
+from datetime import date, timedelta
+from time import perf_counter
+
+from quart import Quart, Response, redirect, render_template, request
+from werkzeug.exceptions import BadRequest, NotFound, Unauthorized
+
+from assets import StaticAssets, asset_response
+from breaker import CircuitBreaker, UpstreamUnavailableError
+from comics import ComicScraper, ScrapeLimitError
+from connections import (
+    create_cache_backend,
+    create_client_sess,
+    prime_client_sess,
+)
 from constants import (
-    DB_TIMEOUT,
-    FETCH_TIMEOUT,
+    ASSET_URL_PREFIX,
     FIRST_COMIC,
-    MAX_DB_CONN,
-    MAX_FETCH_CONN,
+    IMG_CACHE_DIR,
+    IMG_CACHE_SIZE,
+    LATEST_PAGE_MAX_AGE,
+    PAGE_CACHE_SIZE,
+    PAGE_CACHE_TTL,
+    PAGE_MAX_AGE,
+    PROFILE_DURATION,
     REPO,
     SRC_PREFIX,
 )
+from images import ImageCache, image_response
 from latest import LatestDateScraper
-from utils import curr_date, date_to_str, str_to_date
+from lru import LRUCache
+from metrics import (
+    CONTENT_TYPE,
+    PENDING_LAST_USED,
+    RENDER_SECONDS,
+    SCRAPER_MEM_CACHE_HIT_RATIO,
+    render,
+)
+from pages import RenderedPage, page_response
+from prefetch import NeighbourPrefetcher, prefetch_on_startup
+from profiling import Profiler, span, traced
+from refresher import LatestRefresher
+from settings import load_settings
+from utils import date_to_str, str_to_date
 
 # URL path for static items is set to root as it's easy to serve robots.txt by
-# keeping it in static.
+# keeping it in static. Pages link to the static files by their fingerprinted
+# names instead; see `StaticAssets`.
 app = Quart("Dilbert Viewer", static_url_path="")
 
 
-async def _init_db_pool() -> None:
-    """Initialize the database connection pool for caching data."""
-    # Heroku needs SSL for its PostgreSQL DB, but has issues with verifying
-    # the certificate. So simply disable verification while keeping SSL.
-    ctx = ssl.create_default_context(cafile="")
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    app.db_pool = await asyncpg.create_pool(
-        dsn=os.environ["DATABASE_URL"],
-        command_timeout=DB_TIMEOUT,
-        min_size=1,
-        max_size=MAX_DB_CONN,
-        ssl=ctx,
-    )
+async def _init_cache_backend() -> None:
+    """Initialize the backend for caching data."""
+    app.cache_backend = await create_cache_backend(app.settings)
 
 
 async def _init_client_sess() -> None:
     """Initialize the aiohttp session for scraping comics."""
-    # Limit max connections to "dilbert.com", else we might get blocked
-    connector = aiohttp.TCPConnector(limit=MAX_FETCH_CONN)
-    timeout = aiohttp.ClientTimeout(sock_connect=FETCH_TIMEOUT)
-    app.client_sess = aiohttp.ClientSession(
-        connector=connector, timeout=timeout
-    )
+    app.client_sess = create_client_sess(app.settings)
+
+
+async def _prime_client_sess() -> None:
+    """Open a keep-alive connection to "dilbert.com" for the first requests."""
+    try:
+        await prime_client_sess(
+            app.client_sess, SRC_PREFIX, app.settings.scrape_budget
+        )
+    except Exception as ex:
+        # Requests will simply open their own connections
+        app.logger.warning(f"Failed to connect to dilbert.com early: {ex}")
+
+
+async def _load_latest_date() -> None:
+    """Load the latest date into memory for the first requests."""
+    try:
+        await app.latest_date_scraper.get_latest_date()
+    except UpstreamUnavailableError as ex:
+        # Requests will retry this, so don't hold up startup
+        app.logger.warning(f"Failed to load the latest date early, as {ex}")
+
+
+async def _warm_up() -> None:
+    """Warm up everything that the first requests would otherwise wait for.
+
+    The connections to the cache database are opened when creating the
+    backend, so this handles the rest.
+    """
+    start = perf_counter()
+    # Compile the template, which Jinja then keeps cached
+    app.jinja_env.get_template("layout.html")
+    await asyncio.gather(_prime_client_sess(), _load_latest_date())
+    app.logger.info(f"Warmed up in {perf_counter() - start:.3f}s")
 
 
 @app.before_serving
@@ -61,33 +102,137 @@ async def create_aux() -> None:
     """Initialize and store auxiliary items.
 
     The auxiliary items are:
-        * The database connection pool for caching data
+        * The settings for this deployment
+        * The profiler for this worker
+        * The fingerprinted and compressed static files
+        * The backend for caching data
         * The aiohttp session for scraping comics
         * The scrapers for the comics and the latest comic date
+        * The prefetcher for comics next to the ones being viewed
+        * The refresher for the latest date and the latest comic
+        * The cache for rendered pages
+        * The on-disk cache for comic images, if they are proxied
+
+    Hypercorn only accepts requests after this finishes, so this also warms
+    up the worker for its first requests.
     """
+    # Not ready until warmed up, and again once shutting down
+    app.is_ready = False
+
+    # Fail early with a clear message if this deployment is misconfigured
+    app.settings = load_settings()
+    app.settings.check()
+    # Static files are small, so fingerprinting and compressing them here
+    # barely delays startup
+    app.static_assets = StaticAssets(app.static_folder)
+    app.static_assets.load()
+
+    app.logger.info(
+        f"Caching with the {app.settings.cache_backend} backend. Each of the "
+        f"{app.settings.workers} workers can use "
+        f"{app.settings.db_conn_per_worker} DB connections and "
+        f"{app.settings.fetch_conn_per_worker} connections to dilbert.com"
+    )
+
+    # Profiling is off until turned on through the admin endpoints
+    app.profiler = Profiler(app.settings.slow_request_threshold)
+
     # Initialize independent components in parallel
-    await asyncio.gather(_init_db_pool(), _init_client_sess())
+    await asyncio.gather(_init_cache_backend(), _init_client_sess())
 
-    # Initialization of scrapers depends on the DB pool and the aiohttp
+    # Both scrapers scrape from "dilbert.com", so they share its availability
+    breaker = CircuitBreaker(app.logger, budget=app.settings.scrape_budget)
+
+    # Initialization of scrapers depends on the cache backend and the aiohttp
     # client session. Hence, this can't be done in the above
     # `asyncio.gather`.
-    app.comic_scraper = ComicScraper(app.db_pool, app.client_sess, app.logger)
+    app.comic_scraper = ComicScraper(
+        app.cache_backend,
+        app.client_sess,
+        app.logger,
+        breaker=breaker,
+        cache_limit=app.settings.cache_limit,
+    )
     app.latest_date_scraper = LatestDateScraper(
-        app.db_pool, app.client_sess, app.logger
+        app.cache_backend,
+        app.client_sess,
+        app.logger,
+        breaker=breaker,
+        refresh_hours=app.settings.latest_date_refresh,
+    )
+    await asyncio.gather(
+        app.comic_scraper.start(), app.latest_date_scraper.start()
     )
+    app.neighbour_prefetcher = NeighbourPrefetcher(
+        app.comic_scraper, window=app.settings.neighbour_prefetch_window
+    )
+    app.neighbour_prefetcher.start()
+    app.latest_refresher = LatestRefresher(
+        app.cache_backend,
+        app.comic_scraper,
+        app.latest_date_scraper,
+        refresh_hours=app.settings.latest_date_refresh,
+    )
+    app.latest_refresher.start()
+
+    # The rendered page for a comic only depends on the comic's date and the
+    # latest date, so cache the rendered pages for these.
+    app.page_cache = LRUCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+
+    app.image_cache = None
+    if app.settings.img_proxy:
+        app.image_cache = ImageCache(
+            IMG_CACHE_DIR, IMG_CACHE_SIZE, app.client_sess, app.logger
+        )
+        app.image_cache.start()
+
+    await _warm_up()
+    app.is_ready = True
+
+    # Warm up the cache in the background, so that startup isn't delayed
+    app.prefetch_task = None
+    if app.settings.startup_prefetch_days > 0:
+        app.prefetch_task = asyncio.create_task(
+            prefetch_on_startup(
+                app.cache_backend,
+                app.comic_scraper,
+                app.latest_date_scraper,
+                app.settings.startup_prefetch_days,
+            )
+        )
 
 
 @app.after_serving
 async def close_aux() -> None:
     """Gracefully close the auxiliary items."""
+    app.is_ready = False
+    app.profiler.stop()
+    if app.prefetch_task is not None:
+        app.prefetch_task.cancel()
+    if app.image_cache is not None:
+        await app.image_cache.close()
+
+    # The scrapers may have pending writes to the cache, so they must be
+    # closed before the cache backend.
+    await asyncio.gather(
+        app.latest_refresher.close(),
+        app.neighbour_prefetcher.close(),
+        app.comic_scraper.close(),
+        app.latest_date_scraper.close(),
+    )
+
     # Close independent components in parallel
-    await asyncio.gather(app.db_pool.close(), app.client_sess.close())
+    await asyncio.gather(app.cache_backend.close(), app.client_sess.close())
 
 
-async def _serve_template(date: str, data: dict, latest_comic: str) -> str:
-    """Serve the HTML given scraped data.
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """Get the URL of a static file, with its fingerprinted name."""
+    return app.static_assets.url_for(filename)
 
-    Both input dates must be in the format used by "dilbert.com".
+
+async def _serve_template(date: date, data: dict, latest_comic: date) -> str:
+    """Serve the HTML given scraped data.
 
     Args:
         date: The (possibly corrected) date of the comic
@@ -97,28 +242,32 @@ async def _serve_template(date: str, data: dict, latest_comic: str) -> str:
     Returns:
         The rendered template for the comic page
     """
-    date_obj = str_to_date(date)
+    # The template only needs dates in the format used by "dilbert.com"
+    date_str = date_to_str(date)
 
     # Links to previous and next comics
-    previous_comic = date_to_str(
-        max(str_to_date(FIRST_COMIC), date_obj - timedelta(days=1))
-    )
-    next_comic = date_to_str(
-        min(str_to_date(latest_comic), date_obj + timedelta(days=1))
-    )
+    previous_comic = date_to_str(max(FIRST_COMIC, date - timedelta(days=1)))
+    next_comic = date_to_str(min(latest_comic, date + timedelta(days=1)))
 
     # Whether to disable left/right navigation buttons
     disable_left_nav = date == FIRST_COMIC
     disable_right_nav = date == latest_comic
 
     # Link to original strip on "dilbert.com"
-    permalink = SRC_PREFIX + date
+    permalink = SRC_PREFIX + date_str
+
+    # Link to the comic image, either through this app or directly upstream
+    if app.settings.img_proxy:
+        img_url = f"/img/{date_str}"
+    else:
+        img_url = data["imgURL"]
 
     return await render_template(
         "layout.html",
         data=data,
-        date=date,
-        first_comic=FIRST_COMIC,
+        img_url=img_url,
+        date=date_str,
+        first_comic=date_to_str(FIRST_COMIC),
         previous_comic=previous_comic,
         next_comic=next_comic,
         disable_left_nav=disable_left_nav,
@@ -128,24 +277,48 @@ async def _serve_template(date: str, data: dict, latest_comic: str) -> str:
     )
 
 
-async def serve_comic(
-    date: str, *, show_latest: bool = False
-) -> Union[str, Response]:
+async def _get_page(
+    date: date, data: dict, latest_comic: date
+) -> RenderedPage:
+    """Get the rendered page for the comic, either from cache or by rendering.
+
+    Args:
+        date: The (possibly corrected) date of the comic
+        data: The scraped comic data
+        latest_comic: The date of the latest comic
+
+    Returns:
+        The rendered page for the comic
+    """
+    key = (date, latest_comic)
+    page = app.page_cache.get(key)
+
+    if page is None:
+        with span("render"):
+            with RENDER_SECONDS.time():
+                html = await _serve_template(date, data, latest_comic)
+            page = RenderedPage.from_html(html)
+        app.page_cache.put(key, page)
+
+    return page
+
+
+async def serve_comic(date: date, *, show_latest: bool = False) -> Response:
     """Serve the requested comic.
 
     Args:
-        date: The date of the requested comic, in the format used by
-            "dilbert.com"
+        date: The date of the requested comic
         show_latest: If there is no comic found for this date, then
             whether to show the latest comic
 
     Returns:
-        The rendered template for the comic page
+        The response with the rendered page, or "304 Not Modified" if the
+        client's copy is up-to-date
     """
     # Execute both in parallel, as they are independent of each other
     comic_data, latest_comic = await asyncio.gather(
-        app.comic_scraper.get_comic_data(date),
-        app.latest_date_scraper.get_latest_date(),
+        traced("comic_data", app.comic_scraper.get_comic_data(date)),
+        traced("latest_date", app.latest_date_scraper.get_latest_date()),
     )
 
     # The data is None if the input is invalid (i.e. "dilbert.com" has
@@ -158,6 +331,10 @@ async def serve_comic(
             )
             date = latest_comic
             comic_data = await app.comic_scraper.get_comic_data(date)
+            # The latest date may be stale, e.g. if "dilbert.com" took down
+            # the comic.
+            if comic_data is None:
+                raise NotFound
         else:
             raise NotFound
 
@@ -169,50 +346,306 @@ async def serve_comic(
     # The date of the latest comic is often retrieved from the cache. If
     # there is a comic for a date which is newer than the cached value, then
     # there is a new "latest comic". So cache this date.
-    if str_to_date(latest_comic) < str_to_date(date):
+    if latest_comic < date:
         latest_comic = date
         todos.append(app.latest_date_scraper.update_latest_date(date))
 
-    todos.append(_serve_template(date, comic_data, latest_comic))
+    todos.append(_get_page(date, comic_data, latest_comic))
     results = await asyncio.gather(*todos)
-    return results[-1]  # this is the rendered template
+    page = results[-1]  # this is the rendered page
+
+    # Users often navigate to the adjacent comics, so warm up the cache for
+    # them in the background.
+    app.neighbour_prefetcher.enqueue_neighbours(date, latest_comic)
+
+    # The page for the latest comic changes once a new comic is published, so
+    # clients should only cache it briefly. This also applies to the page
+    # that shows the latest comic instead of the requested one.
+    if show_latest or date == latest_comic:
+        max_age = LATEST_PAGE_MAX_AGE
+    else:
+        max_age = PAGE_MAX_AGE
+
+    return page_response(page, max_age=max_age)
+
+
+@app.before_request
+async def begin_trace() -> None:
+    """Start tracing the request, if profiling is on."""
+    app.profiler.begin_request(request.method, request.path)
+
+
+@app.after_request
+async def end_trace(response: Response) -> Response:
+    """Finish tracing the request, keeping it if it was slow."""
+    app.profiler.end_request()
+    return response
+
+
+@app.errorhandler(UpstreamUnavailableError)
+async def upstream_unavailable(error: UpstreamUnavailableError) -> Response:
+    """Tell the client to retry later, as "dilbert.com" is unavailable."""
+    app.logger.warning(f"Failing request, as {error}")
+    response = Response(
+        '"dilbert.com" is unavailable right now; please retry later',
+        status=503,
+        mimetype="text/plain",
+    )
+    response.retry_after = max(1, math.ceil(error.retry_after))
+    return response
 
 
 @app.route("/")
-async def latest_comic() -> str:
+async def latest_comic() -> Response:
     """Serve the latest comic."""
-    # If there is no comic for this date yet, "dilbert.com" will redirect
-    # to the homepage. The code can handle this by instead showing the contents
-    # of the latest comic.
-    today = date_to_str(curr_date())
+    # The latest date and its comic are kept cached by the refresher, so this
+    # doesn't probe "dilbert.com" for a comic for today, which usually doesn't
+    # exist for the first few hours of the day (in UTC).
+    latest = await app.latest_date_scraper.get_latest_date()
 
-    # If there is no comic for this date yet, we don't want to raise a 404, so
-    # just show the exact latest date without a redirection (to preserve the
-    # URL and load faster).
-    return await serve_comic(today, show_latest=True)
+    # If there is no comic for this date, we don't want to raise a 404, so just
+    # show the exact latest date without a redirection (to preserve the URL
+    # and load faster).
+    return await serve_comic(latest, show_latest=True)
 
 
 @app.route("/<int:year>-<int:month>-<int:day>")
-async def comic_page(year: int, month: int, day: int) -> Union[str, Response]:
+async def comic_page(year: int, month: int, day: int) -> Response:
     """Serve the requested comic from the given URL."""
-    # This depends on the format given by `DATE_FMT` from constants.py
-    date = f"{year:04d}-{month:02d}-{day:02d}"
+    # Build the date directly from the URL's components. This also checks to
+    # see if the date is invalid.
+    try:
+        comic_date = date(year, month, day)
+    except ValueError:
+        raise NotFound
+
+    return await serve_comic(comic_date)
 
-    # Check to see if the date is invalid
+
+async def _comics_ndjson(start: date, end: date) -> AsyncIterator[bytes]:
+    """Generate the data for all comics in the given range, as NDJSON.
+
+    Each line is a JSON object with the date (as used in URLs), title and
+    image URL of a comic. If "dilbert.com" becomes unavailable midway, then
+    the last line is a JSON object with the error, and the time (in seconds)
+    after which to retry. If the range has too many uncached comics, then the
+    last line is a JSON object with the error, and the date from which to
+    request the rest.
+    """
     try:
-        str_to_date(date)
+        async for comic, data in app.comic_scraper.iter_comic_data(start, end):
+            line = {
+                "date": date_to_str(comic),
+                "title": data["title"],
+                "imgURL": data["imgURL"],
+            }
+            yield json.dumps(line).encode() + b"\n"
+    except UpstreamUnavailableError as ex:
+        # The status code has already been sent, so report this in the body
+        app.logger.warning(f"Ending the comics stream early, as {ex}")
+        error = {
+            "error": '"dilbert.com" is unavailable right now',
+            "retryAfter": max(1, math.ceil(ex.retry_after)),
+        }
+        yield json.dumps(error).encode() + b"\n"
+    except ScrapeLimitError as ex:
+        app.logger.info(
+            f"Ending the comics stream at {ex.resume_from}, as {ex}"
+        )
+        error = {
+            "error": "Too many uncached comics for one request",
+            "resumeFrom": date_to_str(ex.resume_from),
+        }
+        yield json.dumps(error).encode() + b"\n"
+
+
+@app.route("/api/comics")
+async def comics_api() -> Response:
+    """Serve the data for all comics in a range of dates, as NDJSON.
+
+    The range is given by the query parameters "from" and "to" (both
+    inclusive), in the format used in URLs. The comics are streamed as they
+    are retrieved, so that long ranges don't have to be held in memory.
+    """
+    try:
+        start = str_to_date(request.args["from"])
+        end = str_to_date(request.args["to"])
+    except (KeyError, ValueError):
+        raise BadRequest(
+            'The dates "from" and "to" must be given as YYYY-MM-DD'
+        )
+
+    # Don't scrape dates for which there can't be any comics
+    latest = await app.latest_date_scraper.get_latest_date()
+    start = max(start, FIRST_COMIC)
+    end = min(end, latest)
+
+    return Response(
+        _comics_ndjson(start, end), mimetype="application/x-ndjson"
+    )
+
+
+@app.route("/img/<int:year>-<int:month>-<int:day>")
+async def comic_image(year: int, month: int, day: int) -> Response:
+    """Serve the image for the requested comic through the on-disk cache."""
+    if app.image_cache is None:
+        raise NotFound
+
+    try:
+        comic_date = date(year, month, day)
     except ValueError:
         raise NotFound
 
-    return await serve_comic(date)
+    comic_data = await app.comic_scraper.get_comic_data(comic_date)
+    if comic_data is None:
+        raise NotFound
+
+    try:
+        image = await app.image_cache.get_image(
+            comic_date, comic_data["imgURL"]
+        )
+    except UpstreamUnavailableError as ex:
+        # The client can still get the image directly from upstream
+        app.logger.warning(f"Not proxying the image for {comic_date}: {ex}")
+        return redirect(comic_data["imgURL"])
+    except Exception:
+        # The client can still get the image directly from upstream, so simply
+        # log the error with the traceback.
+        app.logger.exception(f"Failed to proxy the image for {comic_date}")
+        return redirect(comic_data["imgURL"])
+
+    return await image_response(image)
+
+
+@app.route(f"{ASSET_URL_PREFIX}/<path:name>")
+async def static_asset(name: str) -> Response:
+    """Serve a static file by its fingerprinted name."""
+    asset = app.static_assets.get(name)
+    if asset is None:
+        raise NotFound
+    return asset_response(asset)
+
+
+@app.route("/metrics")
+async def metrics() -> Response:
+    """Serve the metrics of this worker in the Prometheus text format."""
+    # These gauges are cheap to compute, so they are only updated when needed
+    for scraper in (app.comic_scraper, app.latest_date_scraper):
+        SCRAPER_MEM_CACHE_HIT_RATIO.set(
+            scraper.mem_cache.hit_ratio, type(scraper).__name__
+        )
+    PENDING_LAST_USED.set(app.comic_scraper.pending_flush)
+
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/healthz")
+async def healthz() -> Response:
+    """Report that this worker is alive."""
+    response = Response("OK", mimetype="text/plain")
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/readyz")
+async def readyz() -> Response:
+    """Report whether this worker is warmed up and can serve requests.
+
+    Load balancers should only send requests to this worker once this
+    succeeds.
+    """
+    if app.is_ready:
+        response = Response("Ready", mimetype="text/plain")
+    else:
+        response = Response("Not ready", status=503, mimetype="text/plain")
+    response.cache_control.no_store = True
+    return response
 
 
 @app.route("/random")
 async def random_comic() -> Response:
-    """Serve a random comic."""
-    first = str_to_date(FIRST_COMIC)
-    latest = curr_date()
-    rand_date = date_to_str(random.uniform(first, latest))  # type: ignore
-    # If there is no comic for this date yet, "dilbert.com" will auto-redirect
-    # to the latest comic.
-    return redirect(f"/{rand_date}")
+    """Serve a random comic.
+
+    The comic is usually picked from the cache, and it is served directly
+    instead of redirecting to its page, so that this needs a single round trip
+    and usually no scraping.
+    """
+    latest = await app.latest_date_scraper.get_latest_date()
+    rand_date = app.comic_scraper.random_date(
+        latest, cached_bias=app.settings.random_cached_bias
+    )
+    response = await serve_comic(rand_date, show_latest=True)
+
+    # Each request gets a different comic, so clients mustn't cache this
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    response.cache_control.no_store = True
+    return response
+
+
+def _check_admin() -> None:
+    """Check if the request is authorized for the admin endpoints.
+
+    The token must be given as a bearer token in the "Authorization" header.
+    The admin endpoints don't exist if no token is set for this deployment.
+    """
+    token = app.settings.admin_token
+    if not token:
+        raise NotFound
+
+    given = request.headers.get("Authorization", "")
+    # Compare in constant time, so that the token can't be guessed by timing
+    if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+        raise Unauthorized
+
+
+@app.route("/admin/profiler", methods=["POST"])
+async def start_profiler() -> Response:
+    """Start profiling this worker, discarding the previous results.
+
+    Profiling stops on its own after the time (in seconds) given by the query
+    parameter "duration".
+    """
+    _check_admin()
+    duration = request.args.get("duration", PROFILE_DURATION, type=float)
+    app.profiler.start(duration)
+    app.logger.info(f"Started profiling for {duration}s")
+    return Response("", status=204)
+
+
+@app.route("/admin/profiler", methods=["DELETE"])
+async def stop_profiler() -> Response:
+    """Stop profiling this worker, keeping the results."""
+    _check_admin()
+    app.profiler.stop()
+    app.logger.info("Stopped profiling")
+    return Response("", status=204)
+
+
+@app.route("/admin/profiler")
+async def profiler_stacks() -> Response:
+    """Serve the stack samples of this worker in the "folded" format.
+
+    The output can be rendered as a flame graph with tools like FlameGraph's
+    `flamegraph.pl` or speedscope.
+    """
+    _check_admin()
+    response = Response(app.profiler.folded_stacks(), mimetype="text/plain")
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/admin/profiler/slow")
+async def profiler_slow_requests() -> Response:
+    """Serve the traces of the recent slow requests of this worker, as JSON.
+
+    Each trace has the spans of the request, and the stack samples taken while
+    it ran in the "folded" format.
+    """
+    _check_admin()
+    response = Response(
+        json.dumps(app.profiler.slow_requests()),
+        mimetype="application/json",
+    )
+    response.cache_control.no_store = True
+    return response
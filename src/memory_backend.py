@@ -0,0 +1,125 @@
+"""Cache backend in the worker's memory."""
+import heapq
+import math
+from collections.abc import Iterable
+from datetime import date, datetime, time
+from time import monotonic
+from typing import Optional
+
+from cache_backend import CacheBackend, ComicRow
+from utils import curr_date
+
+
+class MemoryBackend(CacheBackend):
+    """Cache backend in the worker's memory, for a single worker.
+
+    Nothing is persisted, so the cache is empty on every startup. This is
+    meant for local development, and for deployments with a single worker and
+    no database.
+    """
+
+    def __init__(self):
+        """Start with an empty cache."""
+        # The image URL, title and time of last use, keyed by the comic's date
+        self._comics: dict[date, tuple[str, str, float]] = {}
+        # The latest date, and when it was last checked
+        self._latest: Optional[tuple[date, float]] = None
+
+    async def get_comic(self, comic: date) -> Optional[tuple[str, str]]:
+        """Get the image URL and the title of the comic, if it's cached."""
+        entry = self._comics.get(comic)
+        return None if entry is None else (entry[0], entry[1])
+
+    async def upsert_comic(
+        self, comic: date, img_url: str, title: str
+    ) -> None:
+        """Cache the comic, or refresh it and mark it as used if cached."""
+        self._comics[comic] = (img_url, title, monotonic())
+
+    async def insert_comics_if_missing(
+        self, rows: Iterable[ComicRow], *, used: bool = False
+    ) -> None:
+        """Cache the comics in one go, leaving the cached ones untouched."""
+        # The start of the day, on the same clock as the other times of use
+        today = curr_date()
+        start_of_day = (
+            monotonic()
+            - (
+                datetime.utcnow() - datetime.combine(today, time.min)
+            ).total_seconds()
+        )
+
+        for comic, img_url, title in rows:
+            if used:
+                # These are marked as used at the start of the day, with older
+                # comics slightly earlier (by a millisecond per day), so that
+                # they are evicted first.
+                last_used = start_of_day - (today - comic).days / 1000
+            else:
+                # These are marked as never used, so that they are evicted
+                # first
+                last_used = -math.inf
+            self._comics.setdefault(comic, (img_url, title, last_used))
+
+    async def touch_comics(self, comics: list[date]) -> None:
+        """Mark the comics as used now."""
+        now = monotonic()
+        for comic in comics:
+            entry = self._comics.get(comic)
+            if entry is not None:
+                self._comics[comic] = (entry[0], entry[1], now)
+
+    async def find_cached_comics(self, comics: list[date]) -> set[date]:
+        """Get which of the comics are cached."""
+        return {comic for comic in comics if comic in self._comics}
+
+    async def get_comics_between(
+        self, start: date, end: date
+    ) -> list[ComicRow]:
+        """Get the cached comics between the given dates (both inclusive)."""
+        return sorted(
+            (comic, entry[0], entry[1])
+            for comic, entry in self._comics.items()
+            if start <= comic <= end
+        )
+
+    async def get_cached_dates(self) -> list[date]:
+        """Get the dates of all cached comics, in no particular order."""
+        return list(self._comics)
+
+    async def count_comics(self) -> int:
+        """Get the exact no. of cached comics."""
+        return len(self._comics)
+
+    async def evict_oldest_comics(self, limit: int) -> int:
+        """Remove the least recently used comics, up to the given limit."""
+        oldest = heapq.nsmallest(
+            limit, self._comics, key=lambda comic: self._comics[comic][2]
+        )
+        for comic in oldest:
+            del self._comics[comic]
+        return len(oldest)
+
+    async def get_latest(
+        self, refresh_hours: float
+    ) -> Optional[tuple[date, float]]:
+        """Get the latest date, if it was checked recently enough."""
+        if self._latest is None:
+            return None
+
+        latest, last_check = self._latest
+        fresh_for = last_check + refresh_hours * 60 * 60 - monotonic()
+        return None if fresh_for < 0 else (latest, fresh_for)
+
+    async def get_stale_latest(self) -> Optional[date]:
+        """Get the latest date, ignoring when it was last checked."""
+        return None if self._latest is None else self._latest[0]
+
+    async def upsert_latest(self, latest: date) -> int:
+        """Cache the latest date.
+
+        There are no other workers using this cache, so none are notified.
+        """
+        rows_updated = 0 if self._latest is None else 1
+        self._latest = (latest, monotonic())
+        return rows_updated
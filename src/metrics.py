@@ -0,0 +1,225 @@
+"""Metrics for monitoring the app, in the Prometheus text format.
+
+Recording a metric only updates a few numbers in memory, so it is cheap enough
+to be done in the request path. The metrics are only formatted when they are
+requested at "/metrics".
+
+NOTE: Each worker process has its own metrics, so every scrape of "/metrics"
+only shows the metrics of the worker that served it.
+"""
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Union
+
+from constants import LATENCY_BUCKETS
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[str, ...]
+
+_LABEL_ESCAPES = str.maketrans({"\\": r"\\", '"': r"\"", "\n": r"\n"})
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Format the labels of a sample in the Prometheus text format."""
+    if not names:
+        return ""
+    # Backslashes, double quotes and newlines must be escaped in values
+    pairs = (
+        f'{name}="{value.translate(_LABEL_ESCAPES)}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """Base class for a metric, with the values for each set of labels."""
+
+    type_name = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ):
+        """Register the metric.
+
+        Args:
+            name: The name of the metric
+            documentation: The description of the metric
+            labelnames: The names of the labels of the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _samples(self) -> Iterator[str]:
+        """Get the samples of this metric in the Prometheus text format."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Get this metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """A metric for a value that only goes up."""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        """Register the metric, with no values yet."""
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        """Increase the value for the given labels."""
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        """Get the current value for the given labels."""
+        return self._values.get(labelvalues, 0)
+
+    def _samples(self) -> Iterator[str]:
+        for labelvalues, value in self._values.items():
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_total{labels} {value}"
+
+
+class Gauge(_Metric):
+    """A metric for a value that can go up and down."""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        """Register the metric, with no values yet."""
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        """Set the value for the given labels."""
+        self._values[labelvalues] = value
+
+    def _samples(self) -> Iterator[str]:
+        for labelvalues, value in self._values.items():
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}{labels} {value}"
+
+
+class Histogram(_Metric):
+    """A metric for the distribution of values, e.g. durations in seconds."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs
+    ):
+        """Register the metric, with no values yet.
+
+        Args:
+            *args: The arguments for `_Metric`
+            buckets: The upper bounds of the buckets, in increasing order
+            **kwargs: The keyword arguments for `_Metric`
+        """
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # For each set of labels: the count of values in each bucket (and one
+        # more for values above the largest bound), and the sum of values.
+        # These counts are not cumulative; that is only needed on rendering.
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Record a value for the given labels."""
+        entry = self._values.get(labelvalues)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self._values[labelvalues] = entry
+
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def count(self, *labelvalues: str) -> int:
+        """Get the no. of values recorded for the given labels."""
+        entry = self._values.get(labelvalues)
+        return 0 if entry is None else sum(entry[0])
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Record the duration (in seconds) of the enclosed block.
+
+        The block can contain awaits, in which case the time spent waiting is
+        included too. The time is recorded even if the block raises.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labelvalues)
+
+    def _samples(self) -> Iterator[str]:
+        bounds: list[Union[float, str]] = [*self.buckets, "+Inf"]
+        for labelvalues, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(
+                    (*self.labelnames, "le"), (*labelvalues, str(bound))
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {total[0]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# All metrics, in the order in which they are rendered
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    """Get all metrics in the Prometheus text format."""
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+# ==================================================
+# Metrics for the app
+# ==================================================
+SCRAPER_STAGE_SECONDS = Histogram(
+    "dilbert_scraper_stage_seconds",
+    "Time taken by each stage of retrieving data in a scraper",
+    ("scraper", "stage"),
+)
+SCRAPER_LOOKUPS = Counter(
+    "dilbert_scraper_lookups",
+    "Retrievals of data by a scraper, by where the data was found",
+    ("scraper", "source"),
+)
+SCRAPER_MEM_CACHE_HIT_RATIO = Gauge(
+    "dilbert_scraper_mem_cache_hit_ratio",
+    "Fraction of lookups in a scraper's in-memory cache that were hits",
+    ("scraper",),
+)
+PENDING_LAST_USED = Gauge(
+    "dilbert_pending_last_used_updates",
+    "No. of comics whose `last_used` is yet to be written to the database",
+)
+RENDER_SECONDS = Histogram(
+    "dilbert_render_seconds", "Time taken to render the page for a comic"
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "dilbert_db_pool_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+)
+HTTP_CONN_QUEUED_SECONDS = Histogram(
+    "dilbert_http_connection_queued_seconds",
+    'Time spent queued for a free connection to "dilbert.com", when all '
+    "connections were in use",
+)
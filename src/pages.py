@@ -0,0 +1,138 @@
+"""Rendered pages, and conditional responses for them."""
+from datetime import datetime, timezone
+from hashlib import sha256
+from typing import NamedTuple, Optional
+
+from quart import Response, request
+
+from compression import choose_coding, compress
+from constants import PAGE_BROTLI_QUALITY, PAGE_GZIP_LEVEL
+
+
+class RenderedPage(NamedTuple):
+    """A rendered HTML page, along with its validators for conditional GETs.
+
+    The page is compressed once when rendered, so that cached pages are served
+    compressed without compressing them on every request.
+
+    Attributes:
+        bodies: The HTML for each available content coding
+        etag: A strong entity tag, derived from the HTML
+        last_modified: When the page was rendered
+    """
+
+    bodies: dict[str, bytes]
+    etag: str
+    last_modified: datetime
+
+    @classmethod
+    def from_html(cls, html: str) -> "RenderedPage":
+        """Create a page from its rendered HTML.
+
+        Args:
+            html: The rendered HTML
+
+        Returns:
+            The page along with its validators
+        """
+        # The ETag only depends on the HTML, so that every worker gives the
+        # same ETag for the same page.
+        data = html.encode()
+        etag = sha256(data).hexdigest()[:32]
+        bodies = compress(
+            data,
+            gzip_level=PAGE_GZIP_LEVEL,
+            brotli_quality=PAGE_BROTLI_QUALITY,
+        )
+        # HTTP dates have a resolution of seconds
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        return cls(bodies, etag, now)
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime]) -> bool:
+    """Check if the client's copy of a resource is up-to-date.
+
+    Args:
+        etag: The current entity tag of the resource
+        last_modified: When the resource was last modified, if known
+
+    Returns:
+        Whether a "304 Not Modified" response can be sent
+    """
+    # As per RFC 7232, If-Modified-Since is ignored if If-None-Match is given
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    modified_since = request.if_modified_since
+    return (
+        last_modified is not None
+        and modified_since is not None
+        and last_modified <= modified_since
+    )
+
+
+def compressed_response(
+    bodies: dict[str, bytes],
+    etag: str,
+    last_modified: Optional[datetime],
+    *,
+    mimetype: str,
+) -> Response:
+    """Create a compressed response, honouring conditional requests.
+
+    The content coding is chosen as per the client's "Accept-Encoding". If
+    the client's copy is up-to-date, then a "304 Not Modified" response is
+    returned. Caching headers are left to the caller.
+
+    Args:
+        bodies: The data for each available content coding, as given by
+            `compression.compress`
+        etag: A strong entity tag for the uncompressed data
+        last_modified: When the data was last modified, if known
+        mimetype: The MIME type of the uncompressed data
+
+    Returns:
+        The response with the data in the chosen content coding
+    """
+    coding = choose_coding(bodies)
+    # As per RFC 7232, each coding is a different representation, so each
+    # needs its own strong entity tag.
+    if coding != "identity":
+        etag = f"{etag}-{coding}"
+
+    if is_not_modified(etag, last_modified):
+        response = Response("", status=304)
+    else:
+        response = Response(bodies[coding], mimetype=mimetype)
+        if coding != "identity":
+            response.content_encoding = coding
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Shared caches mustn't give compressed responses to clients that don't
+    # accept them
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def page_response(page: RenderedPage, *, max_age: int) -> Response:
+    """Create a response for the page, honouring conditional requests.
+
+    The page is compressed as per the client's "Accept-Encoding". If the
+    client's copy of the page is up-to-date, then a "304 Not Modified"
+    response is returned.
+
+    Args:
+        page: The rendered page
+        max_age: The time (in seconds) for which clients may cache the page
+
+    Returns:
+        The response for the page
+    """
+    response = compressed_response(
+        page.bodies, page.etag, page.last_modified, mimetype="text/html"
+    )
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
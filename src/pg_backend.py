@@ -0,0 +1,202 @@
+"""Cache backend using PostgreSQL."""
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Optional
+
+from asyncpg import Connection
+from asyncpg.pool import Pool
+
+from cache_backend import CacheBackend, ComicRow, LatestListener
+from constants import LATEST_DATE_CHANNEL
+from db import CacheConnection, acquire, rows_affected
+from utils import date_to_str, str_to_date
+
+
+class PostgresBackend(CacheBackend):
+    """Cache backend using PostgreSQL, which is shared by all workers.
+
+    All queries are run through the statements in `db.Statements`.
+    Workers are notified of new latest dates through PostgreSQL's
+    LISTEN/NOTIFY, and locks shared by all workers are advisory locks.
+
+    Listening and advisory locks need a connection that is kept across many
+    operations, so they use a connection outside the pool. Otherwise, a
+    block holding a lock would hold a pooled connection while its own queries
+    wait for another, which deadlocks once the pool runs out.
+
+    Attributes:
+        pool: The database connection pool
+    """
+
+    def __init__(
+        self, pool: Pool, connect: Callable[[], Awaitable[CacheConnection]]
+    ):
+        """Store the connection pool.
+
+        Args:
+            pool: The database connection pool, as created by
+                `connections.create_db_pool`
+            connect: The function for opening a connection outside the pool,
+                which is used for listening and for advisory locks
+        """
+        self.pool = pool
+        self._connect = connect
+        # The connection outside the pool, which is opened on first use
+        self._conn: Optional[CacheConnection] = None
+        # asyncpg doesn't allow concurrent operations on a connection
+        self._conn_lock = asyncio.Lock()
+        # The keys of the advisory locks held by this worker. A connection can
+        # take an advisory lock that it already holds, so these keep the lock
+        # exclusive within this worker too.
+        self._held: set[int] = set()
+        self._listeners: dict[LatestListener, Callable] = {}
+
+    async def close(self) -> None:
+        """Close the connection pool, and the connection outside it."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def _use_conn(self) -> AsyncIterator[CacheConnection]:
+        """Use the connection outside the pool, reopening it if it was lost.
+
+        Listeners are added again to a reopened connection. Advisory locks are
+        released by PostgreSQL when their connection is lost, so these can't
+        be restored.
+        """
+        async with self._conn_lock:
+            if self._conn is None or self._conn.is_closed():
+                self._conn = await self._connect()
+                for on_notification in self._listeners.values():
+                    await self._conn.add_listener(
+                        LATEST_DATE_CHANNEL, on_notification
+                    )
+            yield self._conn
+
+    @asynccontextmanager
+    async def exclusive(self, key: int) -> AsyncIterator[bool]:
+        """Try to take an advisory lock, held till the context exits."""
+        if key in self._held:
+            yield False
+            return
+
+        self._held.add(key)
+        try:
+            async with self._use_conn() as conn:
+                acquired = await conn.stmts.try_lock.fetchval(key)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    async with self._use_conn() as conn:
+                        await conn.stmts.unlock.fetchval(key)
+        finally:
+            self._held.discard(key)
+
+    async def listen_latest(self, callback: LatestListener) -> None:
+        """Start listening for new latest dates cached by any worker."""
+
+        def on_notification(
+            conn: Connection, pid: int, channel: str, payload: str
+        ) -> None:
+            callback(str_to_date(payload))
+
+        async with self._use_conn() as conn:
+            await conn.add_listener(LATEST_DATE_CHANNEL, on_notification)
+        self._listeners[callback] = on_notification
+
+    async def unlisten_latest(self, callback: LatestListener) -> None:
+        """Stop listening for new latest dates."""
+        on_notification = self._listeners.pop(callback, None)
+        if on_notification is None:
+            return
+
+        async with self._conn_lock:
+            if self._conn is not None and not self._conn.is_closed():
+                await self._conn.remove_listener(
+                    LATEST_DATE_CHANNEL, on_notification
+                )
+
+    async def get_comic(self, comic: date) -> Optional[tuple[str, str]]:
+        """Get the image URL and the title of the comic, if it's cached."""
+        async with acquire(self.pool) as conn:
+            row = await conn.stmts.get_comic.fetchrow(comic)
+        return None if row is None else (row[0], row[1])
+
+    async def upsert_comic(
+        self, comic: date, img_url: str, title: str
+    ) -> None:
+        """Cache the comic, or refresh it and mark it as used if cached."""
+        async with acquire(self.pool) as conn:
+            await conn.stmts.upsert_comic.fetch(comic, img_url, title)
+
+    async def insert_comics_if_missing(
+        self, rows: Iterable[ComicRow], *, used: bool = False
+    ) -> None:
+        """Cache the comics in one go, leaving the cached ones untouched."""
+        async with acquire(self.pool) as conn:
+            if used:
+                stmt = conn.stmts.insert_used_comic_if_missing
+            else:
+                stmt = conn.stmts.insert_comic_if_missing
+            await stmt.executemany(rows)
+
+    async def touch_comics(self, comics: list[date]) -> None:
+        """Mark the comics as used now."""
+        async with acquire(self.pool) as conn:
+            await conn.stmts.touch_comics.fetch(comics)
+
+    async def find_cached_comics(self, comics: list[date]) -> set[date]:
+        """Get which of the comics are cached."""
+        async with acquire(self.pool) as conn:
+            rows = await conn.stmts.find_cached_comics.fetch(comics)
+        return {row[0] for row in rows}
+
+    async def get_comics_between(
+        self, start: date, end: date
+    ) -> list[ComicRow]:
+        """Get the cached comics between the given dates (both inclusive)."""
+        async with acquire(self.pool) as conn:
+            rows = await conn.stmts.get_comics_between.fetch(start, end)
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    async def get_cached_dates(self) -> list[date]:
+        """Get the dates of all cached comics, in no particular order."""
+        async with acquire(self.pool) as conn:
+            rows = await conn.stmts.get_cached_dates.fetch()
+        return [row[0] for row in rows]
+
+    async def count_comics(self) -> int:
+        """Get the exact no. of cached comics."""
+        async with acquire(self.pool) as conn:
+            return await conn.stmts.count_comics.fetchval()
+
+    async def evict_oldest_comics(self, limit: int) -> int:
+        """Remove the least recently used comics, up to the given limit."""
+        async with acquire(self.pool) as conn:
+            status = await conn.stmts.evict_oldest_comics.execute(limit)
+        return rows_affected(status)
+
+    async def get_latest(
+        self, refresh_hours: float
+    ) -> Optional[tuple[date, float]]:
+        """Get the latest date, if it was checked recently enough."""
+        async with acquire(self.pool) as conn:
+            row = await conn.stmts.get_latest.fetchrow(refresh_hours)
+        return None if row is None else (row[0], float(row[1]))
+
+    async def get_stale_latest(self) -> Optional[date]:
+        """Get the latest date, ignoring when it was last checked."""
+        async with acquire(self.pool) as conn:
+            return await conn.stmts.get_stale_latest.fetchval()
+
+    async def upsert_latest(self, latest: date) -> int:
+        """Cache the latest date, and notify all listening workers."""
+        async with acquire(self.pool) as conn:
+            return await conn.stmts.upsert_latest.fetchval(
+                latest, LATEST_DATE_CHANNEL, date_to_str(latest)
+            )
@@ -0,0 +1,329 @@
+"""Bulk prefetching of comics into the database cache.
+
+This can be run as a script to warm up the cache before any traffic arrives,
+e.g. for a freshly provisioned database:
+
+    DATABASE_URL=... python src/prefetch.py --days 30
+
+The app can also do this on startup; see `startup_prefetch_days` in
+settings.py.
+"""
+import asyncio
+import logging
+from argparse import ArgumentParser
+from datetime import date, timedelta
+
+from breaker import CircuitBreaker, UpstreamUnavailableError
+from cache_backend import CacheBackend
+from comics import ComicData, ComicScraper
+from connections import create_cache_backend, create_client_sess
+from constants import (
+    FIRST_COMIC,
+    NEIGHBOUR_PREFETCH_QUEUE,
+    NEIGHBOUR_PREFETCH_WINDOW,
+    NEIGHBOUR_PREFETCH_WORKERS,
+    PREFETCH_BATCH_SIZE,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_LOCK_KEY,
+)
+from latest import LatestDateScraper
+from settings import load_settings
+
+
+async def prefetch_comics(
+    scraper: ComicScraper,
+    dates: list[date],
+    *,
+    concurrency: int = PREFETCH_CONCURRENCY,
+    batch_size: int = PREFETCH_BATCH_SIZE,
+) -> int:
+    """Scrape the given comics and cache them in the database in batches.
+
+    Comics that are already cached are skipped. If the cache can't hold all
+    the given comics, then only the newest ones are prefetched. If
+    "dilbert.com" becomes unavailable, then prefetching stops early, and only
+    the comics scraped till then are cached.
+
+    Args:
+        scraper: The scraper for the comics
+        dates: The dates of the comics to be prefetched
+        concurrency: The max. no. of comics scraped at a time
+        batch_size: The no. of comics cached in one go
+
+    Returns:
+        The no. of comics that were cached
+    """
+    # Prefetching more than the cache can hold would only evict the comics
+    # prefetched earlier. Newer comics are usually viewed more, so keep them.
+    dates = sorted(dates, reverse=True)[: scraper.low_watermark]
+    dates = await scraper.get_uncached_dates(dates)
+    scraper.logger.info(f"Prefetching {len(dates)} uncached comics")
+
+    pending = iter(dates)
+    batch: list[ComicData] = []
+    num_cached = 0
+
+    async def flush() -> None:
+        nonlocal batch, num_cached
+        # Swap out the batch before awaiting, so that the other workers can
+        # keep adding to a new batch.
+        comics, batch = batch, []
+        # These are likely to be viewed, so they mustn't be the first to be
+        # evicted.
+        await scraper.cache_many(comics, used=True)
+        num_cached += len(comics)
+
+    async def worker() -> None:
+        # The workers share the same iterator, so each date is scraped once
+        for comic in pending:
+            try:
+                data = await scraper.scrape_comic_data(comic)
+            except UpstreamUnavailableError:
+                raise  # the rest would fail the same way, so stop prefetching
+            except Exception:
+                # A single failure shouldn't stop the entire prefetch, so
+                # simply log the error with the traceback.
+                scraper.logger.exception(f"Failed to prefetch comic {comic}")
+                continue
+
+            if data is None:
+                continue  # there is no comic for this date
+            batch.append(data)
+            if len(batch) >= batch_size:
+                await flush()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    except UpstreamUnavailableError as ex:
+        # Keep the comics scraped so far, and let the cache fill up on demand
+        # once "dilbert.com" is available again.
+        scraper.logger.warning(f"Stopped prefetching comics: {ex}")
+    finally:
+        # If a worker failed (e.g. in caching a batch), then the rest are of no
+        # use
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    if batch:
+        await flush()
+
+    return num_cached
+
+
+async def prefetch_recent(
+    comic_scraper: ComicScraper,
+    latest_date_scraper: LatestDateScraper,
+    days: int,
+    **kwargs,
+) -> int:
+    """Prefetch the comics of the given no. of most recent days.
+
+    Args:
+        comic_scraper: The scraper for the comics
+        latest_date_scraper: The scraper for the latest comic date
+        days: The no. of most recent days whose comics are to be prefetched
+        **kwargs: Options for prefetching, as given to `prefetch_comics`
+
+    Returns:
+        The no. of comics that were cached
+    """
+    latest = await latest_date_scraper.get_latest_date()
+    num_days = min(days, (latest - FIRST_COMIC).days + 1)
+    dates = [latest - timedelta(days=i) for i in range(num_days)]
+    return await prefetch_comics(comic_scraper, dates, **kwargs)
+
+
+async def prefetch_on_startup(
+    backend: CacheBackend,
+    comic_scraper: ComicScraper,
+    latest_date_scraper: LatestDateScraper,
+    days: int,
+) -> None:
+    """Prefetch the most recent comics, unless another worker is doing so.
+
+    Args:
+        backend: The backend of the cache
+        comic_scraper: The scraper for the comics
+        latest_date_scraper: The scraper for the latest comic date
+        days: The no. of most recent days whose comics are to be prefetched
+    """
+    logger = comic_scraper.logger
+
+    # Every worker runs this on startup, but only one of them should prefetch.
+    # Hence, this uses a lock shared by all workers, which is held till the
+    # prefetch ends.
+    async with backend.exclusive(PREFETCH_LOCK_KEY) as acquired:
+        if not acquired:
+            logger.info("Another worker is prefetching comics")
+            return
+
+        try:
+            num_cached = await prefetch_recent(
+                comic_scraper, latest_date_scraper, days
+            )
+        except Exception:
+            # The cache will simply fill up on demand, so simply log the error
+            # with the traceback.
+            logger.exception("Prefetching comics on startup failed")
+        else:
+            logger.info(f"Prefetched {num_cached} comics on startup")
+
+
+class NeighbourPrefetcher:
+    """Prefetcher for the comics next to the ones being viewed.
+
+    Users often navigate to the previous or next comic, so these are retrieved
+    in the background through the comic scraper, which caches them. To avoid
+    starving requests of connections to "dilbert.com", a fixed no. of workers
+    retrieve the comics from a bounded queue. Comics that don't fit in the
+    queue are simply not prefetched.
+
+    Attributes:
+        scraper: The scraper for the comics
+        window: The no. of days on each side of a viewed comic to prefetch
+    """
+
+    def __init__(
+        self,
+        scraper: ComicScraper,
+        *,
+        window: int = NEIGHBOUR_PREFETCH_WINDOW,
+        workers: int = NEIGHBOUR_PREFETCH_WORKERS,
+        queue_size: int = NEIGHBOUR_PREFETCH_QUEUE,
+    ):
+        """Initialize the queue for the comics to be prefetched.
+
+        Args:
+            scraper: The scraper for the comics
+            window: The no. of days on each side of a viewed comic to
+                prefetch
+            workers: The no. of background workers
+            queue_size: The max. no. of comics queued for prefetching
+        """
+        self.scraper = scraper
+        self.window = window
+        self._num_workers = workers
+        self._queue: asyncio.Queue[date] = asyncio.Queue(queue_size)
+        self._workers: list[asyncio.Task] = []
+
+    async def _work(self) -> None:
+        """Prefetch the queued comics forever."""
+        while True:
+            date = await self._queue.get()
+            try:
+                await self.scraper.get_comic_data(date)
+            except Exception:
+                # This was only speculative, so simply log the error with the
+                # traceback.
+                self.scraper.logger.exception(
+                    f"Failed to prefetch neighbouring comic {date}"
+                )
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        """Start the background workers."""
+        if self.window > 0 and not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work())
+                for _ in range(self._num_workers)
+            ]
+
+    async def close(self) -> None:
+        """Stop the background workers."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enqueue_neighbours(self, date: date, latest_comic: date) -> None:
+        """Queue the comics around the given one for prefetching.
+
+        Args:
+            date: The date of the comic being viewed
+            latest_comic: The date of the latest comic
+        """
+        if not self._workers:
+            return
+
+        # Queue the nearest comics first, as they are the likeliest to be
+        # viewed next.
+        for offset in range(1, self.window + 1):
+            for neighbour in (
+                date - timedelta(days=offset),
+                date + timedelta(days=offset),
+            ):
+                if not FIRST_COMIC <= neighbour <= latest_comic:
+                    continue
+
+                if neighbour in self.scraper.mem_cache:
+                    continue  # already cached, so nothing to do
+
+                try:
+                    self._queue.put_nowait(neighbour)
+                except asyncio.QueueFull:
+                    self.scraper.logger.debug(
+                        "Prefetch queue is full; skipping neighbouring comics"
+                    )
+                    return
+
+
+async def _main(days: int, concurrency: int) -> None:
+    """Prefetch the most recent comics into the cache."""
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("prefetch")
+
+    settings = load_settings()
+    settings.check()
+    breaker = CircuitBreaker(logger, budget=settings.scrape_budget)
+
+    backend = await create_cache_backend(settings)
+    sess = create_client_sess(settings)
+    try:
+        comic_scraper = ComicScraper(
+            backend,
+            sess,
+            logger,
+            breaker=breaker,
+            cache_limit=settings.cache_limit,
+        )
+        latest_date_scraper = LatestDateScraper(
+            backend,
+            sess,
+            logger,
+            breaker=breaker,
+            refresh_hours=settings.latest_date_refresh,
+        )
+        num_cached = await prefetch_recent(
+            comic_scraper,
+            latest_date_scraper,
+            days,
+            concurrency=concurrency,
+        )
+        logger.info(f"Prefetched {num_cached} comics")
+    finally:
+        await asyncio.gather(backend.close(), sess.close())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Prefetch the most recent comics into the cache"
+    )
+    parser.add_argument(
+        "-d",
+        "--days",
+        type=int,
+        default=30,
+        help="the no. of most recent days whose comics are to be prefetched",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=PREFETCH_CONCURRENCY,
+        help="the max. no. of comics scraped at a time",
+    )
+    args = parser.parse_args()
+    asyncio.run(_main(args.days, args.concurrency))
@@ -0,0 +1,270 @@
+"""Profiling of a worker at runtime, to find where requests spend time.
+
+Profiling is off by default, and is turned on per worker through the admin
+endpoints in main.py. While it is on:
+    * A background thread samples the stack of the event loop's thread at a
+      regular interval. The samples are aggregated as "folded" stacks, which
+      can be rendered as flame graphs with tools like FlameGraph or speedscope.
+    * Each request records spans for its main stages, e.g. retrieving the
+      comic and rendering the page; see `span`.
+    * Requests slower than a threshold are kept along with their spans and
+      the stack samples taken while they ran.
+
+Sampling only needs the GIL briefly at each interval, and a span is a no-op
+while profiling is off, so the overhead is low.
+"""
+import os
+import sys
+import threading
+from collections import Counter, deque
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter
+from types import FrameType
+from typing import Any, NamedTuple, Optional, TypeVar
+
+from constants import (
+    PROFILE_INTERVAL,
+    PROFILE_MAX_SAMPLES,
+    PROFILE_MAX_SLOW_REQUESTS,
+)
+
+Result = TypeVar("Result")
+
+
+class Span(NamedTuple):
+    """A timed stage of a request.
+
+    Attributes:
+        name: The name of the stage
+        start: When the stage started (in seconds), since the request started
+        duration: The duration (in seconds) of the stage
+    """
+
+    name: str
+    start: float
+    duration: float
+
+
+@dataclass
+class RequestTrace:
+    """The spans of a request, and the stack samples taken while it ran.
+
+    Attributes:
+        method: The HTTP method of the request
+        path: The path of the request
+        start: When the request started, as per `time.perf_counter`
+        duration: The duration (in seconds) of the request, once it's done
+        spans: The spans of the request, in the order in which they ended
+        stacks: The no. of samples of each folded stack, if this request was
+            slow
+    """
+
+    method: str
+    path: str
+    start: float
+    duration: Optional[float] = None
+    spans: list[Span] = field(default_factory=list)
+    stacks: dict[str, int] = field(default_factory=dict)
+
+    def to_json(self) -> dict[str, Any]:
+        """Convert this trace to a JSON-serializable dict."""
+        return {
+            "method": self.method,
+            "path": self.path,
+            "duration": self.duration,
+            "spans": [span._asdict() for span in self.spans],
+            "stacks": _format_folded(self.stacks),
+        }
+
+
+# The trace of the current request, if profiling is on
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Record the enclosed block as a span of the current request.
+
+    This does nothing if profiling is off, or if this isn't within a request.
+
+    Args:
+        name: The name of the span
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        end = perf_counter()
+        trace.spans.append(Span(name, start - trace.start, end - start))
+
+
+def _fold(frame: Optional[FrameType]) -> str:
+    """Convert a stack to a single line, from the outermost frame inwards."""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        frames.append(f"{code.co_name} ({filename})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def _format_folded(stacks: dict[str, int]) -> list[str]:
+    """Format the stacks as lines of the "folded" format for flame graphs."""
+    return [f"{stack} {count}" for stack, count in sorted(stacks.items())]
+
+
+class Profiler:
+    """Sampling profiler and request tracer for the worker's event loop.
+
+    Attributes:
+        slow_threshold: The duration (in seconds) above which a request is
+            kept along with its trace
+        interval: The time (in seconds) between stack samples
+    """
+
+    def __init__(
+        self, slow_threshold: float, *, interval: float = PROFILE_INTERVAL
+    ):
+        """Store the parameters, without starting profiling.
+
+        Args:
+            slow_threshold: The duration (in seconds) above which a request is
+                kept along with its trace
+            interval: The time (in seconds) between stack samples
+        """
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        # Guards the samples, as they are written by the sampling thread
+        self._lock = threading.Lock()
+        self._stacks: Counter[str] = Counter()
+        # Recent samples with their times, for attributing them to requests
+        self._samples: deque[tuple[float, str]] = deque(
+            maxlen=PROFILE_MAX_SAMPLES
+        )
+        self._slow: deque[RequestTrace] = deque(
+            maxlen=PROFILE_MAX_SLOW_REQUESTS
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        """Check if profiling is on."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float) -> None:
+        """Start profiling, discarding the results of the previous run.
+
+        This must be called from the event loop's thread, as that thread is
+        the one that is sampled.
+
+        Args:
+            duration: The time (in seconds) after which profiling stops on its
+                own, so that it isn't left on by mistake
+        """
+        self.stop()
+        with self._lock:
+            self._stacks.clear()
+            self._samples.clear()
+        self._slow.clear()
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), monotonic() + duration),
+            name="profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop profiling, keeping its results."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _sample(self, thread_id: int, deadline: float) -> None:
+        """Sample the stack of the given thread until stopped or timed out."""
+        while not self._stop.wait(self.interval) and monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                # The thread has exited
+                return
+
+            stack = _fold(frame)
+            # Don't keep the frame alive, as it references its locals
+            del frame
+            with self._lock:
+                self._stacks[stack] += 1
+                self._samples.append((perf_counter(), stack))
+
+    def begin_request(self, method: str, path: str) -> None:
+        """Start tracing the current request, if profiling is on.
+
+        Args:
+            method: The HTTP method of the request
+            path: The path of the request
+        """
+        if self.enabled:
+            _current_trace.set(RequestTrace(method, path, perf_counter()))
+
+    def end_request(self) -> None:
+        """Finish tracing the current request, keeping it if it was slow."""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+
+        _current_trace.set(None)
+        end = perf_counter()
+        trace.duration = end - trace.start
+        if trace.duration < self.slow_threshold:
+            return
+
+        # The event loop interleaves requests, so these samples may include
+        # other requests too.
+        with self._lock:
+            trace.stacks = Counter(
+                stack
+                for sampled_at, stack in self._samples
+                if trace.start <= sampled_at <= end
+            )
+        self._slow.append(trace)
+
+    def folded_stacks(self) -> str:
+        """Get all stack samples in the "folded" format for flame graphs."""
+        with self._lock:
+            lines = _format_folded(self._stacks)
+        return "\n".join(lines) + "\n"
+
+    def slow_requests(self) -> list[dict[str, Any]]:
+        """Get the traces of the slow requests, in JSON-serializable form."""
+        return [trace.to_json() for trace in self._slow]
+
+
+async def traced(name: str, awaitable: Awaitable[Result]) -> Result:
+    """Await the awaitable as a span of the current request.
+
+    This is useful for awaitables run in parallel, e.g. with `asyncio.gather`.
+
+    Args:
+        name: The name of the span
+        awaitable: The awaitable to be awaited
+
+    Returns:
+        The result of the awaitable
+    """
+    with span(name):
+        return await awaitable
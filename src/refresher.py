@@ -0,0 +1,162 @@
+"""Polling of "dilbert.com" for newly published comics in the background."""
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from cache_backend import CacheBackend
+from comics import ComicScraper
+from constants import (
+    LATEST_DATE_REFRESH,
+    PUBLISH_POLL_INTERVAL,
+    PUBLISH_WINDOW_HOURS,
+    PUBLISH_WINDOW_START,
+    REFRESH_LOCK_KEY,
+)
+from latest import LatestDateScraper
+from utils import curr_date
+
+
+class LatestRefresher:
+    """Refresher for the latest date, which also caches the latest comic.
+
+    Without this, the first visitor after a new comic is published would wait
+    for both the latest date and the new comic to be scraped. Instead, this
+    polls "dilbert.com" frequently within the window in which new comics are
+    published, until the new comic is found. Outside this window, it only
+    polls often enough to keep the cached latest date "fresh", so that
+    requests don't scrape it either.
+
+    Every worker runs this, but only one of them polls at a time, as this uses
+    a lock shared by all workers. A poll is skipped if another worker polled
+    recently.
+
+    Attributes:
+        backend: The backend of the cache
+        comic_scraper: The scraper for the comics
+        latest_date_scraper: The scraper for the latest comic date
+        poll_interval: The time (in seconds) between polls within the window
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        comic_scraper: ComicScraper,
+        latest_date_scraper: LatestDateScraper,
+        *,
+        refresh_hours: float = LATEST_DATE_REFRESH,
+        poll_interval: float = PUBLISH_POLL_INTERVAL,
+    ):
+        """Store the required objects.
+
+        Args:
+            backend: The backend of the cache
+            comic_scraper: The scraper for the comics
+            latest_date_scraper: The scraper for the latest comic date
+            refresh_hours: The no. of hrs after scraping the latest date when
+                it is to be scraped again
+            poll_interval: The time (in seconds) between polls within the
+                window
+        """
+        self.backend = backend
+        self.comic_scraper = comic_scraper
+        self.latest_date_scraper = latest_date_scraper
+        self.poll_interval = poll_interval
+        self._refresh_hours = refresh_hours
+        # Refresh well before the cached latest date becomes stale
+        self._refresh_interval = refresh_hours * 60 * 60 / 2
+        self._task: Optional[asyncio.Task] = None
+
+    def _secs_till_next_poll(self, latest: Optional[date]) -> float:
+        """Get the time (in seconds) till the next poll.
+
+        Args:
+            latest: The latest date found in the last poll, if any
+        """
+        now = datetime.utcnow()
+        today = now.date()
+        window_start = datetime.combine(today, PUBLISH_WINDOW_START)
+        window_end = window_start + timedelta(hours=PUBLISH_WINDOW_HOURS)
+
+        if window_start <= now < window_end and latest != today:
+            return self.poll_interval
+
+        # Wake up in time for the next window
+        if now >= window_start:
+            window_start += timedelta(days=1)
+        secs_till_window = (window_start - now).total_seconds()
+        return min(self._refresh_interval, secs_till_window)
+
+    def _checked_recently(self, fresh_for: float) -> bool:
+        """Check if the cached latest date was checked since the last poll.
+
+        Args:
+            fresh_for: The time (in seconds) for which the cached latest date
+                stays "fresh"
+        """
+        checked_ago = self._refresh_hours * 60 * 60 - fresh_for
+        return checked_ago < self.poll_interval / 2
+
+    async def poll(self) -> Optional[date]:
+        """Scrape the latest date, and cache it along with its comic.
+
+        This does nothing if another worker is polling right now.
+
+        Returns:
+            The latest date, or None if another worker is polling
+        """
+        logger = self.latest_date_scraper.logger
+
+        async with self.backend.exclusive(REFRESH_LOCK_KEY) as acquired:
+            if not acquired:
+                logger.info("Another worker is polling for a new comic")
+                return None
+
+            cached = await self.backend.get_latest(self._refresh_hours)
+            if cached is not None and self._checked_recently(cached[1]):
+                # Another worker has just polled, so don't poll again
+                latest = cached[0]
+            else:
+                if cached is not None and cached[0] == curr_date():
+                    # No newer comic can be published today, so simply keep
+                    # the cached latest date "fresh"
+                    latest = cached[0]
+                else:
+                    scraper = self.latest_date_scraper
+                    latest = await scraper.scrape_latest_date()
+                # This also notifies the other workers of the new date
+                await self.latest_date_scraper.update_latest_date(latest)
+
+            # This only scrapes the comic if it isn't cached already. It may
+            # have been requested before it was published, so forget that.
+            self.comic_scraper.forget_not_found(latest)
+            await self.comic_scraper.get_comic_data(latest)
+
+        return latest
+
+    async def _run(self) -> None:
+        """Poll forever, as per the schedule."""
+        latest: Optional[date] = None
+        while True:
+            await asyncio.sleep(self._secs_till_next_poll(latest))
+            try:
+                latest = await self.poll()
+            except Exception:
+                # This will be retried in the next poll, so simply log the
+                # error with the traceback.
+                self.latest_date_scraper.logger.exception(
+                    "Polling for a new comic failed"
+                )
+
+    def start(self) -> None:
+        """Start polling in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop polling, cancelling any poll in progress."""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
@@ -1,11 +1,20 @@
 """Abstract base class definition for a scraper, and a scraping exception."""
 import asyncio
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import partial
 from logging import Logger
 from typing import Generic, Optional, TypeVar, final
 
 from aiohttp import ClientSession
-from asyncpg.pool import Pool
+
+from breaker import CircuitBreaker, UpstreamUnavailableError
+from cache_backend import CacheBackend
+from constants import MEM_CACHE_SIZE, MEM_CACHE_TTL
+from lru import LRUCache
+from metrics import SCRAPER_LOOKUPS, SCRAPER_STAGE_SECONDS
+from profiling import span
 
 ScrapedData = TypeVar("ScrapedData")
 DataRef = TypeVar("DataRef")
@@ -18,66 +27,133 @@ class ScrapingException(Exception):
 class Scraper(ABC, Generic[ScrapedData, DataRef]):
     """Generic scraper that supports caching of whatever it scrapes.
 
+    The data is cached in two tiers: a small in-memory cache in front of the
+    cache backend (e.g. a database). Repeated requests for the same data are
+    thus served without any I/O.
+
     Attributes:
-        pool: The database connection pool
+        backend: The backend of the cache
         sess: The HTTP client session
         logger: The main app logger
+        mem_cache: The in-memory cache in front of the backend
+        breaker: The circuit breaker for scraping from the source
     """
 
-    def __init__(self, pool: Pool, sess: ClientSession, logger: Logger):
+    def __init__(
+        self,
+        backend: CacheBackend,
+        sess: ClientSession,
+        logger: Logger,
+        *,
+        breaker: Optional[CircuitBreaker] = None,
+        mem_cache_size: int = MEM_CACHE_SIZE,
+        mem_cache_ttl: float = MEM_CACHE_TTL,
+    ):
         """Store the required objects.
 
         Args:
-            pool: The database connection pool
+            backend: The backend of the cache
             sess: The HTTP client session
             logger: The main app logger
+            breaker: The circuit breaker for scraping from the source. This
+                can be shared by scrapers for the same source. If not given,
+                a new one with the default settings is used.
+            mem_cache_size: The max. no. of entries in the in-memory cache
+            mem_cache_ttl: The time (in seconds) for which an entry in the
+                in-memory cache stays valid
         """
-        self.pool = pool
+        self.backend = backend
         self.sess = sess
         self.logger = logger
+        self.breaker = breaker or CircuitBreaker(logger)
+        self.mem_cache: LRUCache[DataRef, ScrapedData] = LRUCache(
+            mem_cache_size, mem_cache_ttl
+        )
+        # Retrievals (from the backend or the source) that are in progress
+        self._in_flight: dict[DataRef, asyncio.Task] = {}
+        # The name used to label the metrics for this scraper
+        self._metrics_name = type(self).__name__
+
+    async def start(self) -> None:
+        """Start any background jobs needed by this scraper."""
+
+    async def close(self) -> None:
+        """Stop any background jobs, and write any pending changes."""
+
+    def _mem_cache_ttl(
+        self, reference: DataRef, data: ScrapedData
+    ) -> Optional[float]:
+        """Get the time (in seconds) for which to keep this data in memory.
+
+        If None is returned, then the in-memory cache's default TTL is used.
+        """
+        return None
+
+    def _mark_used(self, reference: DataRef) -> None:
+        """Record that the data for this reference was served from memory.
+
+        This can be used to keep the backend aware of data that is in use,
+        without any I/O in the in-memory hit path.
+        """
+
+    async def _fallback_data(
+        self, reference: DataRef, error: UpstreamUnavailableError
+    ) -> Optional[ScrapedData]:
+        """Get the data to be served while the source is unavailable.
+
+        If None is returned, then the error is raised to the caller.
+        """
+        return None
 
     @abstractmethod
     async def _get_cached_data(
         self, reference: DataRef
     ) -> Optional[ScrapedData]:
-        """Retrieve cached data from the database.
+        """Retrieve cached data from the backend.
 
         If data is not found in the cache, None should be returned.
         """
 
     @abstractmethod
     async def _cache_data(self, data: ScrapedData, reference: DataRef) -> None:
-        """Cache data into the database."""
+        """Cache data into the backend."""
 
     @abstractmethod
     async def _scrape_data(self, reference: DataRef) -> ScrapedData:
         """Scrape data from the source."""
 
+    @final
+    @contextmanager
+    def _stage(self, stage: str) -> Iterator[None]:
+        """Time a stage of retrieving data, for the metrics and the profiler.
+
+        Args:
+            stage: The name of the stage
+        """
+        with SCRAPER_STAGE_SECONDS.time(self._metrics_name, stage), span(
+            f"{self._metrics_name}.{stage}"
+        ):
+            yield
+
     @final
     async def _safely_cache_data(
         self, data: ScrapedData, reference: DataRef
     ) -> None:
         """Cache data while handling exceptions."""
         try:
-            await self._cache_data(data, reference)
+            with self._stage("cache_data"):
+                await self._cache_data(data, reference)
         except Exception:
             # Better to re-scrape later on than crash unexpectedly, so simply
             # log the error with the traceback.
             self.logger.exception("Caching data failed")
 
     @final
-    async def get_data(self, reference: DataRef) -> ScrapedData:
-        """Retrieve the data, either from the source or from cache.
-
-        Args:
-            reference: The thing that uniquely identifies the data that is
-                requested, i.e. a reference to the requested data
-
-        Returns:
-            The requested data
-        """
+    async def _fetch_data(self, reference: DataRef) -> ScrapedData:
+        """Retrieve the data, either from the backend or from the source."""
         try:
-            data = await self._get_cached_data(reference)
+            with self._stage("get_cached_data"):
+                data = await self._get_cached_data(reference)
         except Exception:
             # Better to re-scrape now than crash unexpectedly, so simply log
             # the error with the traceback.
@@ -85,11 +161,29 @@ class Scraper(ABC, Generic[ScrapedData, DataRef]):
         else:
             if data is not None:
                 self.logger.info("Successful retrieval from cache")
+                SCRAPER_LOOKUPS.inc(self._metrics_name, "database")
+                self.mem_cache.put(
+                    reference, data, self._mem_cache_ttl(reference, data)
+                )
                 return data
 
         self.logger.info("Couldn't fetch data from cache; trying to scrape")
-        data = await self._scrape_data(reference)
+        try:
+            with self._stage("scrape_data"):
+                data = await self.breaker.run(self._scrape_data(reference))
+        except UpstreamUnavailableError as ex:
+            fallback = await self._fallback_data(reference, ex)
+            if fallback is None:
+                raise
+            self.logger.warning(f"Serving fallback data, as {ex}")
+            SCRAPER_LOOKUPS.inc(self._metrics_name, "fallback")
+            return fallback
+
         self.logger.info("Scraped data from source")
+        SCRAPER_LOOKUPS.inc(self._metrics_name, "source")
+        self.mem_cache.put(
+            reference, data, self._mem_cache_ttl(reference, data)
+        )
 
         # We already have the data to be returned, so caching the newly scraped
         # data can be done independently in the background.
@@ -98,3 +192,49 @@ class Scraper(ABC, Generic[ScrapedData, DataRef]):
 
         self.logger.info("Cached scraped data")
         return data
+
+    @final
+    def _end_flight(self, reference: DataRef, task: asyncio.Task) -> None:
+        """Forget the given finished retrieval for the given reference."""
+        del self._in_flight[reference]
+
+        # The retrieval's exception (if any) is propagated to every waiting
+        # caller. Retrieve it here anyway, so that asyncio doesn't complain if
+        # all of the callers were cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    @final
+    async def get_data(self, reference: DataRef) -> ScrapedData:
+        """Retrieve the data, either from the source or from cache.
+
+        Concurrent calls for the same reference are coalesced, i.e. only one
+        of them retrieves the data, and all of them share its result (or its
+        exception).
+
+        Args:
+            reference: The thing that uniquely identifies the data that is
+                requested, i.e. a reference to the requested data
+
+        Returns:
+            The requested data
+        """
+        data = self.mem_cache.get(reference)
+        if data is not None:
+            self.logger.info("Successful retrieval from in-memory cache")
+            SCRAPER_LOOKUPS.inc(self._metrics_name, "memory")
+            self._mark_used(reference)
+            return data
+
+        task = self._in_flight.get(reference)
+        if task is None:
+            task = asyncio.create_task(self._fetch_data(reference))
+            self._in_flight[reference] = task
+            task.add_done_callback(partial(self._end_flight, reference))
+        else:
+            self.logger.info("Waiting for an in-flight retrieval of the data")
+            SCRAPER_LOOKUPS.inc(self._metrics_name, "in_flight")
+
+        # Shield the retrieval, so that a cancelled caller (e.g. due to a
+        # client disconnecting) doesn't cancel it for the other callers.
+        return await asyncio.shield(task)
@@ -0,0 +1,284 @@
+"""Settings for tuning the app per deployment, without code changes.
+
+Each setting is read from the environment variable named after it (in upper
+case, with the prefix "DILBERT_"). Settings can also be given in a JSON file,
+whose path is given in the environment variable "DILBERT_SETTINGS". The
+environment takes precedence over the file, and the defaults are in
+constants.py.
+
+The connection limits are totals for all hypercorn workers on one database or
+machine. They are split evenly across the workers, whose count is taken from
+"WEB_CONCURRENCY" (the variable also used in the Procfile).
+
+The cache database is only needed for the "postgres" backend.
+"""
+import json
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass, field, fields
+from types import NoneType
+from typing import Any, Optional, Union, get_args, get_origin, get_type_hints
+
+from constants import (
+    CACHE_BACKEND,
+    CACHE_LIMIT,
+    CACHE_LOW_MARGIN,
+    DB_TIMEOUT,
+    DB_WARM_CONN,
+    DNS_CACHE_TTL,
+    FETCH_READ_TIMEOUT,
+    FETCH_TIMEOUT,
+    IMG_PROXY,
+    KEEPALIVE_TIMEOUT,
+    LATEST_DATE_REFRESH,
+    MAX_DB_CONN,
+    MAX_FETCH_CONN,
+    NEIGHBOUR_PREFETCH_WINDOW,
+    RANDOM_CACHED_BIAS,
+    SCRAPE_BUDGET,
+    SLOW_REQUEST_THRESHOLD,
+    SQLITE_PATH,
+    STARTUP_PREFETCH_DAYS,
+)
+
+# Prefix of the environment variables for the settings
+_ENV_PREFIX = "DILBERT_"
+# Environment variable with the path to the settings file
+_FILE_ENV = "DILBERT_SETTINGS"
+# Settings read from environment variables not named as per the prefix, as
+# these variables are set by Heroku.
+_ENV_NAMES = {"database_url": "DATABASE_URL", "workers": "WEB_CONCURRENCY"}
+
+# The backends for the cache; see `connections.create_cache_backend`
+_CACHE_BACKENDS = ("postgres", "sqlite", "memory")
+
+_TRUE_STRS = {"1", "true", "yes", "on"}
+_FALSE_STRS = {"0", "false", "no", "off"}
+
+
+@dataclass(frozen=True)
+class Settings:
+    """All settings for tuning the app.
+
+    Attributes:
+        cache_backend: The backend for the cache, which is one of "postgres",
+            "sqlite" and "memory"
+        database_url: The URL of the cache database, for the "postgres"
+            backend
+        sqlite_path: The path of the database file, for the "sqlite" backend
+        workers: The no. of hypercorn workers sharing the connection limits
+        max_db_conn: The limit for connections to the cache database, across
+            all workers
+        db_warm_conn: The no. of connections to the cache database that each
+            worker opens on startup
+        db_timeout: The timeout (in seconds) for a single database operation
+        db_ssl: Whether to connect to the cache database over SSL
+        max_fetch_conn: The limit for connections to "dilbert.com", across
+            all workers
+        fetch_timeout: The timeout (in seconds) for establishing a connection
+            to "dilbert.com"
+        fetch_read_timeout: The timeout (in seconds) for reading a chunk of a
+            response from "dilbert.com", or None for no timeout
+        keepalive_timeout: The time (in seconds) for which idle connections to
+            "dilbert.com" are kept open for reuse
+        dns_cache_ttl: The time (in seconds) for which DNS lookups are cached,
+            or None to cache them forever
+        scrape_budget: The max. time (in seconds) for a single scrape,
+            including the time spent waiting for a free connection
+        cache_limit: The limit (in no. of comics) for the comics cache in the
+            database
+        latest_date_refresh: The no. of hrs after scraping the latest date
+            when it is to be scraped again
+        random_cached_bias: The probability with which "/random" picks one of
+            the cached comics, instead of any comic
+        startup_prefetch_days: The no. of most recent days whose comics are
+            prefetched on startup, or zero to disable this
+        neighbour_prefetch_window: The no. of days on each side of a viewed
+            comic whose comics are prefetched, or zero to disable this
+        img_proxy: Whether comic images are served through this app, instead
+            of directly from the upstream CDN
+        slow_request_threshold: The duration (in seconds) above which a
+            request is kept with its trace while profiling
+        admin_token: The token for the admin endpoints, which are disabled if
+            this isn't set
+    """
+
+    cache_backend: str = CACHE_BACKEND
+    # This contains the password, so keep it out of logs
+    database_url: Optional[str] = field(default=None, repr=False)
+    sqlite_path: str = SQLITE_PATH
+    workers: int = 1
+    max_db_conn: int = MAX_DB_CONN
+    db_warm_conn: int = DB_WARM_CONN
+    db_timeout: float = DB_TIMEOUT
+    db_ssl: bool = True
+    max_fetch_conn: int = MAX_FETCH_CONN
+    fetch_timeout: float = FETCH_TIMEOUT
+    fetch_read_timeout: Optional[float] = FETCH_READ_TIMEOUT
+    keepalive_timeout: float = KEEPALIVE_TIMEOUT
+    dns_cache_ttl: Optional[int] = DNS_CACHE_TTL
+    scrape_budget: float = SCRAPE_BUDGET
+    cache_limit: int = CACHE_LIMIT
+    latest_date_refresh: float = LATEST_DATE_REFRESH
+    random_cached_bias: float = RANDOM_CACHED_BIAS
+    startup_prefetch_days: int = STARTUP_PREFETCH_DAYS
+    neighbour_prefetch_window: int = NEIGHBOUR_PREFETCH_WINDOW
+    img_proxy: bool = IMG_PROXY
+    slow_request_threshold: float = SLOW_REQUEST_THRESHOLD
+    # This is a secret, so keep it out of logs
+    admin_token: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def db_conn_per_worker(self) -> int:
+        """Return the limit for connections to the database in one worker."""
+        return self.max_db_conn // self.workers
+
+    @property
+    def fetch_conn_per_worker(self) -> int:
+        """Return the limit for connections to "dilbert.com" in one worker."""
+        return self.max_fetch_conn // self.workers
+
+    def check(self) -> None:
+        """Check if the settings are usable.
+
+        Raises:
+            ValueError: If any setting is invalid
+        """
+        errors = []
+        uses_postgres = self.cache_backend == "postgres"
+
+        if self.cache_backend not in _CACHE_BACKENDS:
+            errors.append(
+                f"cache_backend must be one of {', '.join(_CACHE_BACKENDS)}, "
+                f"not {self.cache_backend}"
+            )
+        if uses_postgres and not self.database_url:
+            errors.append("database_url must be set for the postgres backend")
+
+        if self.workers < 1:
+            errors.append(f"workers must be positive, not {self.workers}")
+        else:
+            # Each worker keeps one connection outside its pool for listening
+            # to notifications and for locks. Its pool needs at least two
+            # more, so that background jobs don't block all requests.
+            if uses_postgres and self.db_conn_per_worker < 3:
+                errors.append(
+                    f"max_db_conn ({self.max_db_conn}) must allow at least 3 "
+                    f"connections for each of the {self.workers} workers"
+                )
+            if self.fetch_conn_per_worker < 1:
+                errors.append(
+                    f"max_fetch_conn ({self.max_fetch_conn}) must allow at "
+                    f"least 1 connection for each of the {self.workers} "
+                    "workers"
+                )
+
+        if self.db_warm_conn < 1:
+            errors.append(
+                f"db_warm_conn must be positive, not {self.db_warm_conn}"
+            )
+
+        for name in (
+            "db_timeout",
+            "fetch_timeout",
+            "fetch_read_timeout",
+            "scrape_budget",
+            "latest_date_refresh",
+            "slow_request_threshold",
+        ):
+            value = getattr(self, name)
+            if value is not None and value <= 0:
+                errors.append(f"{name} must be positive, not {value}")
+
+        for name in (
+            "keepalive_timeout",
+            "dns_cache_ttl",
+            "startup_prefetch_days",
+            "neighbour_prefetch_window",
+        ):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                errors.append(f"{name} must not be negative, not {value}")
+
+        # Cleaning the cache needs room below the limit
+        if self.cache_limit <= CACHE_LOW_MARGIN:
+            errors.append(
+                f"cache_limit must be more than {CACHE_LOW_MARGIN}, not "
+                f"{self.cache_limit}"
+            )
+
+        if not 0 <= self.random_cached_bias <= 1:
+            errors.append(
+                "random_cached_bias must be between 0 and 1, not "
+                f"{self.random_cached_bias}"
+            )
+
+        if errors:
+            raise ValueError("Invalid settings: " + "; ".join(errors))
+
+
+def _convert(value: Any, hint: Any) -> Any:
+    """Convert the raw value of a setting to the type given by the hint.
+
+    Values from the environment are always strings, while those from the file
+    can already be of the required type.
+    """
+    if get_origin(hint) is Union:
+        # This must be `Optional[...]`, as no other unions are used
+        if value is None or (
+            isinstance(value, str) and value.lower() in ("", "none")
+        ):
+            return None
+        hint = next(arg for arg in get_args(hint) if arg is not NoneType)
+
+    if hint is bool and isinstance(value, str):
+        if value.lower() in _TRUE_STRS:
+            return True
+        elif value.lower() in _FALSE_STRS:
+            return False
+        raise ValueError(f"Invalid boolean: {value!r}")
+    elif hint is int and isinstance(value, float):
+        # Don't silently truncate e.g. 2.5 from a JSON file
+        if not value.is_integer():
+            raise ValueError(f"Invalid integer: {value!r}")
+
+    return hint(value)
+
+
+def load_settings(environ: Mapping[str, str] = os.environ) -> Settings:
+    """Load the settings from the environment and the settings file.
+
+    Args:
+        environ: The environment variables
+
+    Returns:
+        The loaded settings, which are yet to be checked
+
+    Raises:
+        ValueError: If the value of any setting has the wrong type
+    """
+    raw: dict[str, Any] = {}
+    if _FILE_ENV in environ:
+        with open(environ[_FILE_ENV]) as settings_file:
+            raw.update(json.load(settings_file))
+
+    hints = get_type_hints(Settings)
+    names = {setting.name for setting in fields(Settings)}
+
+    unknown = raw.keys() - names
+    if unknown:
+        raise ValueError(f"Unknown settings in file: {', '.join(unknown)}")
+
+    for name in names:
+        env_name = _ENV_NAMES.get(name, _ENV_PREFIX + name.upper())
+        if env_name in environ:
+            raw[name] = environ[env_name]
+
+    kwargs = {}
+    for name, value in raw.items():
+        try:
+            kwargs[name] = _convert(value, hints[name])
+        except (TypeError, ValueError) as ex:
+            raise ValueError(f"Invalid value for setting {name}: {ex}")
+
+    return Settings(**kwargs)
@@ -0,0 +1,266 @@
+"""Cache backend using SQLite."""
+import asyncio
+import fcntl
+import json
+import sqlite3
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, Optional, TypeVar
+
+from cache_backend import SCHEMA_FILE, CacheBackend, ComicRow
+
+Result = TypeVar("Result")
+
+# The queries used on the cache, keyed by the method that uses them. Dates are
+# stored as ISO 8601 strings, and lists of dates are given as JSON arrays of
+# such strings, as SQLite has neither a date type nor array parameters.
+_QUERIES = {
+    # ==================================================
+    # Comics cache
+    # ==================================================
+    "get_comic": "SELECT img_url, title FROM comic_cache WHERE comic = ?;",
+    "upsert_comic": """INSERT INTO comic_cache (comic, img_url, title)
+        VALUES (?, ?, ?)
+        ON CONFLICT (comic) DO UPDATE
+        SET img_url = excluded.img_url, title = excluded.title,
+            last_used = CURRENT_TIMESTAMP;""",
+    # These are marked as used long ago; see the PostgreSQL statement in db.py
+    "insert_comics_if_missing": """INSERT INTO comic_cache
+        (comic, img_url, title, last_used)
+        VALUES (?, ?, ?, '1970-01-01 00:00:00')
+        ON CONFLICT (comic) DO NOTHING;""",
+    # These are marked as used at the start of the day, with older comics
+    # slightly earlier; see the PostgreSQL statement in db.py. `||` binds
+    # tighter than `/` here.
+    "insert_used_comics_if_missing": """INSERT INTO comic_cache
+        (comic, img_url, title, last_used)
+        VALUES (?1, ?2, ?3, strftime(
+            '%Y-%m-%d %H:%M:%f',
+            'now',
+            'start of day',
+            ((julianday(?1) - julianday('now', 'start of day')) / 1000)
+                || ' seconds'
+        ))
+        ON CONFLICT (comic) DO NOTHING;""",
+    "touch_comics": """UPDATE comic_cache SET last_used = CURRENT_TIMESTAMP
+        WHERE comic IN (SELECT value FROM json_each(?));""",
+    "find_cached_comics": """SELECT comic FROM comic_cache
+        WHERE comic IN (SELECT value FROM json_each(?));""",
+    # ISO 8601 strings sort like dates, so this is a range scan on the
+    # primary key
+    "get_comics_between": """SELECT comic, img_url, title FROM comic_cache
+        WHERE comic BETWEEN ? AND ? ORDER BY comic;""",
+    "get_cached_dates": "SELECT comic FROM comic_cache;",
+    "count_comics": "SELECT count(*) FROM comic_cache;",
+    "evict_oldest_comics": """DELETE FROM comic_cache
+        WHERE comic IN
+        (SELECT comic FROM comic_cache ORDER BY last_used LIMIT ?);""",
+    # ==================================================
+    # Latest date cache
+    # ==================================================
+    # `julianday` gives fractional days, so this gives the time (in seconds)
+    # for which the entry stays "fresh", like the PostgreSQL query.
+    "get_latest": """SELECT latest,
+            (julianday(last_check) + ? / 24.0 - julianday('now')) * 86400
+        FROM latest_date
+        WHERE julianday(last_check) + ? / 24.0 >= julianday('now');""",
+    "get_stale_latest": "SELECT latest FROM latest_date;",
+    "update_latest": """UPDATE latest_date
+        SET latest = ?, last_check = CURRENT_TIMESTAMP;""",
+    "insert_latest": """INSERT INTO latest_date (latest) VALUES (?)
+        ON CONFLICT (latest) DO UPDATE SET last_check = CURRENT_TIMESTAMP;""",
+}
+
+
+class SQLiteBackend(CacheBackend):
+    """Cache backend using an SQLite database file.
+
+    The file can be shared by all workers on the same machine, as it is used
+    in WAL mode, in which readers don't block the writer. Locks shared by all
+    workers are file locks next to the database file. New latest dates are
+    not notified to other workers, so they only see a new latest date once
+    their in-memory copy expires.
+
+    The `sqlite3` module is blocking, so all queries run on a single thread
+    that owns the connection, keeping the event loop free.
+
+    Attributes:
+        path: The path of the database file
+    """
+
+    def __init__(self, path: str, timeout: float):
+        """Store the path of the database file.
+
+        `connect` must be awaited before using this backend.
+
+        Args:
+            path: The path of the database file
+            timeout: The time (in seconds) for which a query waits for another
+                worker's write to finish
+        """
+        self.path = path
+        self._timeout = timeout
+        # A single thread, so that queries don't need their own locking
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        self._conn: sqlite3.Connection
+
+    async def _run(self, func: Callable[..., Result], *args: Any) -> Result:
+        """Run the function on the thread that owns the connection."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> None:
+        """Open the database file, and create the schema if needed."""
+        # Transactions are started explicitly, when more than one statement
+        # must be atomic.
+        self._conn = sqlite3.connect(
+            self.path, timeout=self._timeout, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        # This is safe in WAL mode, and avoids a sync on every commit
+        self._conn.execute("PRAGMA synchronous = NORMAL;")
+        self._conn.executescript(SCHEMA_FILE.read_text())
+
+    async def connect(self) -> None:
+        """Open the database file, and create the schema if needed."""
+        await self._run(self._connect)
+
+    async def close(self) -> None:
+        """Close the database file."""
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    @asynccontextmanager
+    async def exclusive(self, key: int) -> AsyncIterator[bool]:
+        """Try to take a file lock, held till the context exits."""
+        with open(f"{self.path}-{key:x}.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+            # Closing the file releases the lock
+            yield True
+
+    def _fetchone(self, query: str, *args: Any) -> Optional[tuple]:
+        """Run the query, and get its first row."""
+        return self._conn.execute(_QUERIES[query], args).fetchone()
+
+    def _fetchall(self, query: str, *args: Any) -> list[tuple]:
+        """Run the query, and get all its rows."""
+        return self._conn.execute(_QUERIES[query], args).fetchall()
+
+    def _execute(self, query: str, *args: Any) -> int:
+        """Run the query, and get the no. of rows affected."""
+        return self._conn.execute(_QUERIES[query], args).rowcount
+
+    def _insert_many(
+        self, query: str, rows: list[tuple[str, str, str]]
+    ) -> None:
+        """Insert the missing comics in a single transaction."""
+        with self._conn:
+            self._conn.execute("BEGIN;")
+            self._conn.executemany(_QUERIES[query], rows)
+
+    def _upsert_latest(self, latest: str) -> int:
+        """Update the latest date, or insert it if the cache is empty."""
+        with self._conn:
+            # Take the write lock upfront, so that two workers can't both
+            # insert into an empty table.
+            self._conn.execute("BEGIN IMMEDIATE;")
+            rows_updated = self._execute("update_latest", latest)
+            if rows_updated == 0:
+                self._execute("insert_latest", latest)
+        return rows_updated
+
+    async def get_comic(self, comic: date) -> Optional[tuple[str, str]]:
+        """Get the image URL and the title of the comic, if it's cached."""
+        return await self._run(self._fetchone, "get_comic", comic.isoformat())
+
+    async def upsert_comic(
+        self, comic: date, img_url: str, title: str
+    ) -> None:
+        """Cache the comic, or refresh it and mark it as used if cached."""
+        await self._run(
+            self._execute, "upsert_comic", comic.isoformat(), img_url, title
+        )
+
+    async def insert_comics_if_missing(
+        self, rows: Iterable[ComicRow], *, used: bool = False
+    ) -> None:
+        """Cache the comics in one go, leaving the cached ones untouched."""
+        query = (
+            "insert_used_comics_if_missing"
+            if used
+            else "insert_comics_if_missing"
+        )
+        str_rows = [
+            (comic.isoformat(), url, title) for comic, url, title in rows
+        ]
+        await self._run(self._insert_many, query, str_rows)
+
+    async def touch_comics(self, comics: list[date]) -> None:
+        """Mark the comics as used now."""
+        await self._run(self._execute, "touch_comics", _to_json(comics))
+
+    async def find_cached_comics(self, comics: list[date]) -> set[date]:
+        """Get which of the comics are cached."""
+        rows = await self._run(
+            self._fetchall, "find_cached_comics", _to_json(comics)
+        )
+        return {date.fromisoformat(row[0]) for row in rows}
+
+    async def get_comics_between(
+        self, start: date, end: date
+    ) -> list[ComicRow]:
+        """Get the cached comics between the given dates (both inclusive)."""
+        rows = await self._run(
+            self._fetchall,
+            "get_comics_between",
+            start.isoformat(),
+            end.isoformat(),
+        )
+        return [(date.fromisoformat(row[0]), row[1], row[2]) for row in rows]
+
+    async def get_cached_dates(self) -> list[date]:
+        """Get the dates of all cached comics, in no particular order."""
+        rows = await self._run(self._fetchall, "get_cached_dates")
+        return [date.fromisoformat(row[0]) for row in rows]
+
+    async def count_comics(self) -> int:
+        """Get the exact no. of cached comics."""
+        rows = await self._run(self._fetchall, "count_comics")
+        return rows[0][0]
+
+    async def evict_oldest_comics(self, limit: int) -> int:
+        """Remove the least recently used comics, up to the given limit."""
+        return await self._run(self._execute, "evict_oldest_comics", limit)
+
+    async def get_latest(
+        self, refresh_hours: float
+    ) -> Optional[tuple[date, float]]:
+        """Get the latest date, if it was checked recently enough."""
+        row = await self._run(
+            self._fetchone, "get_latest", refresh_hours, refresh_hours
+        )
+        return None if row is None else (date.fromisoformat(row[0]), row[1])
+
+    async def get_stale_latest(self) -> Optional[date]:
+        """Get the latest date, ignoring when it was last checked."""
+        row = await self._run(self._fetchone, "get_stale_latest")
+        return None if row is None else date.fromisoformat(row[0])
+
+    async def upsert_latest(self, latest: date) -> int:
+        """Cache the latest date.
+
+        Other workers aren't notified, as SQLite has no way to do so.
+        """
+        return await self._run(self._upsert_latest, latest.isoformat())
+
+
+def _to_json(comics: list[date]) -> str:
+    """Convert the dates to a JSON array, for use with `json_each`."""
+    return json.dumps([comic.isoformat() for comic in comics])
@@ -0,0 +1,76 @@
+"""Helper for running jobs periodically in the background."""
+import asyncio
+from collections.abc import Awaitable, Callable
+from logging import Logger
+from typing import Optional
+
+
+class PeriodicTask:
+    """Task that runs a job periodically in the background.
+
+    Exceptions raised by the job are logged, and do not stop the task.
+
+    Attributes:
+        job: The coroutine function to be run periodically
+        interval: The time (in seconds) between consecutive runs
+        logger: The main app logger
+        name: The name of the job, used for logging
+    """
+
+    def __init__(
+        self,
+        job: Callable[[], Awaitable[None]],
+        interval: float,
+        logger: Logger,
+        *,
+        name: str,
+    ):
+        """Store the job and its schedule.
+
+        Args:
+            job: The coroutine function to be run periodically
+            interval: The time (in seconds) between consecutive runs
+            logger: The main app logger
+            name: The name of the job, used for logging
+        """
+        self.job = job
+        self.interval = interval
+        self.logger = logger
+        self.name = name
+        self._task: Optional[asyncio.Task] = None
+        # Set to stop the task once the current run (if any) finishes
+        self._stopping = asyncio.Event()
+
+    async def _run(self) -> None:
+        """Run the job with the given interval between runs, until stopped."""
+        while True:
+            # Only the wait between runs is interrupted when stopping, so
+            # that a run is never cut short.
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                return
+
+            try:
+                await self.job()
+            except Exception:
+                # The job will be retried in the next run, so simply log the
+                # error with the traceback.
+                self.logger.exception(f"Periodic job '{self.name}' failed")
+
+    def start(self) -> None:
+        """Start running the job in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop running the job, and wait for the current run to finish."""
+        if self._task is None:
+            return
+
+        self._stopping.set()
+        await self._task
+        self._task = None
+        self._stopping.clear()
@@ -1,10 +1,15 @@
 """Utilities for the viewer app."""
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 
 from constants import DATE_FMT
 
+# Size of the caches for parsing and formatting dates. There are only ~12k
+# comics, so this is enough to hold all the commonly used dates.
+_DATE_CACHE_SIZE = 4096
 
-def curr_date() -> datetime:
+
+def curr_date() -> date:
     """Return the current date.
 
     The timezone is fixed to UTC so that the code is independent of local time.
@@ -12,11 +17,15 @@ def curr_date() -> datetime:
     Returns:
         The current date
     """
-    return datetime.utcnow()
+    return datetime.utcnow().date()
+
 
+@lru_cache(maxsize=_DATE_CACHE_SIZE)
+def str_to_date(date_str: str, /, *, fmt: str = DATE_FMT) -> date:
+    """Convert the date string to a `datetime.date` object.
 
-def str_to_date(date_str: str, /, *, fmt: str = DATE_FMT) -> datetime:
-    """Convert the date string to a `datetime.datetime` object.
+    `datetime.strptime` is slow, so results are cached, and dates in the
+    format used by "dilbert.com" are parsed without it.
 
     Args:
         date_str: The input date
@@ -24,12 +33,22 @@ def str_to_date(date_str: str, /, *, fmt: str = DATE_FMT) -> datetime:
 
     Returns:
         The converted date
+
+    Raises:
+        ValueError: If the date string is invalid for the given format
     """
-    return datetime.strptime(date_str, fmt)
+    if fmt == DATE_FMT:
+        # This format is ISO 8601, which `date.fromisoformat` parses quickly
+        return date.fromisoformat(date_str)
+    return datetime.strptime(date_str, fmt).date()
+
 
+@lru_cache(maxsize=_DATE_CACHE_SIZE)
+def date_to_str(date_obj: date, /, *, fmt: str = DATE_FMT) -> str:
+    """Convert the `datetime.date` object to a date string.
 
-def date_to_str(date_obj: datetime, /, *, fmt: str = DATE_FMT) -> str:
-    """Convert the `datetime.datetime` object to a date string.
+    Results are cached, and dates in the format used by "dilbert.com" are
+    formatted without `date.strftime`.
 
     Args:
         date_obj: The input date
@@ -38,4 +57,6 @@ def date_to_str(date_obj: datetime, /, *, fmt: str = DATE_FMT) -> str:
     Returns:
         The converted date
     """
+    if fmt == DATE_FMT:
+        return date_obj.isoformat()
     return date_obj.strftime(fmt)